@@ -0,0 +1,165 @@
+import re
+import time
+import argparse
+import unicodedata
+import numpy as np
+import pandas as pd
+from item_similarity import ratings_matrix, item_neighbors, SIMILARITIES
+
+NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+
+def normalize_name(name):
+
+    """
+        route name for lookups: accents stripped, lower case, punctuation and runs of spaces collapsed to one space
+    """
+
+    name = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    return NON_ALNUM_RE.sub(' ', name).strip()
+
+def route_stats(df):
+
+    """
+        one row per route (sorted by route_id) with its name, type, grade and the mean, median and count of its ratings
+    """
+
+    groups = df.groupby('route_id', sort=True)
+    stats = groups[['name', 'type', 'grade']].first().fillna('')
+    ratings = groups['ratings']
+
+    return stats.assign(mean=ratings.mean(), median=ratings.median(), count=ratings.size())
+
+class also_climbed(object):
+
+    """
+        "people who climbed X also climbed": the top n neighbors of every route (see item_similarity.item_neighbors)
+        next to the rating statistics of every route, as arrays indexed by route position, so a lookup is a dictionary
+        access (route_id or normalized name to position) followed by array indexing, with no pass over the ratings
+    """
+
+    def __init__(self, route_ids, names, types, grades, mean, median, count, neighbors, similarity, support):
+
+        self.route_ids = route_ids
+        self.names = names
+        self.types = types
+        self.grades = grades
+        self.mean = mean
+        self.median = median
+        self.count = count
+        self.neighbors = neighbors
+        self.similarity = similarity
+        self.support = support
+
+        self.positions = {route_id: i for i, route_id in enumerate(route_ids.tolist())}
+
+        # a name can belong to several routes, the most rated one comes first
+        self.name_positions = {}
+        for i in np.lexsort((np.arange(len(count)), -count)).tolist():
+            self.name_positions.setdefault(normalize_name(names[i]), []).append(i)
+
+    @classmethod
+    def build(cls, df, n=50, name='msd', k=None, min_support=2):
+
+        ratings, user_ids, item_ids = ratings_matrix(df)
+        table = item_neighbors.build(ratings, item_ids, name, k or n, min_support)
+        stats = route_stats(df).loc[item_ids]
+
+        return cls(np.asarray(item_ids), stats['name'].to_numpy(dtype=str), stats['type'].to_numpy(dtype=str),
+                   stats['grade'].to_numpy(dtype=str), stats['mean'].to_numpy(dtype=np.float32),
+                   stats['median'].to_numpy(dtype=np.float32), stats['count'].to_numpy(dtype=np.int32),
+                   table.neighbors[:, :n], table.similarity[:, :n], table.support[:, :n])
+
+    def save(self, path):
+
+        np.savez_compressed(path, route_ids=self.route_ids, names=self.names, types=self.types, grades=self.grades,
+                            mean=self.mean, median=self.median, count=self.count, neighbors=self.neighbors,
+                            similarity=self.similarity, support=self.support)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path, allow_pickle=False) as table:
+            return cls(*[table[f] for f in ['route_ids', 'names', 'types', 'grades', 'mean', 'median', 'count',
+                                            'neighbors', 'similarity', 'support']])
+
+    def find(self, route):
+
+        """
+            the position of a route_id, or of the most rated route with this name (None if neither matches)
+        """
+
+        if route in self.positions:
+            return self.positions[route]
+
+        matches = self.name_positions.get(normalize_name(route))
+        return matches[0] if matches else None
+
+    def routes(self, rows):
+
+        fields = zip(self.route_ids[rows].tolist(), self.names[rows].tolist(), self.types[rows].tolist(),
+                     self.grades[rows].tolist(), self.mean[rows].tolist(), self.median[rows].tolist(), self.count[rows].tolist())
+
+        return [{'route_id': r, 'name': name, 'type': t, 'grade': g, 'mean': mean, 'median': median, 'count': count}
+                for r, name, t, g, mean, median, count in fields]
+
+    def lookup(self, route, n=None):
+
+        """
+            the route (a route_id or a name) and its top n (default: all) neighbors with their similarity, the number of
+            climbers who rated both, and their rating statistics; None for an unknown route
+        """
+
+        i = self.find(route)
+        if i is None:
+            return None
+
+        neighbors = self.neighbors[i, :n]
+        found = neighbors >= 0
+        climbed = self.routes(neighbors[found])
+
+        for r, similarity, support in zip(climbed, self.similarity[i, :n][found].tolist(), self.support[i, :n][found].tolist()):
+            r['similarity'], r['support'] = similarity, support
+
+        return self.routes([i])[0], climbed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the "people who climbed X also climbed" table, or look a route up in it')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='openbeta-ratings-nevada.zip', help='the ratings csv')
+    parser.add_argument('-o', action='store', dest='table', type=str,
+                        required=False, default='also_climbed.npz', help='the table file')
+    parser.add_argument('-n', action='store', dest='n', type=int,
+                        required=False, default=50, help='the number of neighbors per route')
+    parser.add_argument('-s', action='store', dest='similarity', type=str, choices=SIMILARITIES,
+                        required=False, default='msd', help='the similarity measure')
+    parser.add_argument('-m', action='store', dest='min_support', type=int,
+                        required=False, default=2, help='the minimum number of common climbers of a neighbor')
+    parser.add_argument('-r', action='store', dest='route', type=str,
+                        required=False, default=None, help='look up a route name or id in an existing table instead')
+    args = parser.parse_args()
+
+    if args.route is None:
+
+        start = time.perf_counter()
+        df = pd.read_csv(args.data, compression='zip' if args.data.endswith('.zip') else None)
+        also_climbed.build(df, args.n, args.similarity, min_support=args.min_support).save(args.table)
+        print(f'table of {df["route_id"].nunique()} routes built in {time.perf_counter() - start:.2f} s, saved to {args.table}')
+
+    else:
+
+        table = also_climbed.load(args.table)
+        route = int(args.route) if args.route.isdigit() else args.route
+        found = table.lookup(route, args.n)
+        if found is None:
+            raise SystemExit(f'no route {args.route}')
+
+        climbed, neighbors = found
+        print("People who climbed '{}' ({}, {}) also climbed".format(climbed['name'], climbed['grade'], climbed['type']))
+        print('-'*100)
+        print('{:<40} {:<12} {:<8} {:<8} {:<8} {:<8} {:<10} {:<8}'.format(
+            *['name', 'route_id', 'type', 'grade', 'mean', 'median', 'ratings', 'sim']))
+        print('-'*100)
+        for r in neighbors:
+            print('{:<40} {:<12} {:<8} {:<8} {:<8.2f} {:<8.1f} {:<10} {:<8.3f}'.format(
+                r['name'][:39], r['route_id'], r['type'], r['grade'], r['mean'], r['median'], r['count'], r['similarity']))
@@ -0,0 +1,65 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from item_similarity import ratings_matrix, item_neighbors
+from also_climbed import also_climbed
+
+def notebook_lookup(df, neighbors, climb_name, n=50):
+
+    """
+        predict_routes from the notebook, minus the printing: scan for the route by name, then aggregate its neighbors'
+        ratings from the whole frame
+    """
+
+    route_id = df[df.name == climb_name]['route_id'].iloc[0]
+    recs, _, _ = neighbors.get_neighbors(route_id, n)
+    results = df[df.route_id.isin(recs)]
+
+    # the notebook's pivot_table(index=[...], aggfunc=[np.mean, np.median, np.size], values='ratings')
+    return results.groupby(['name', 'route_id', 'type', 'grade'])['ratings'].agg(['mean', 'median', 'size'])
+
+def latencies(fn, queries):
+
+    runs = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        runs.append(time.perf_counter() - start)
+
+    return 1e6 * np.array(runs)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time "also climbed" lookups in the precomputed table against the notebook')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='openbeta-ratings-nevada.zip', help='the ratings csv')
+    parser.add_argument('-q', action='store', dest='queries', type=int,
+                        required=False, default=200, help='the number of routes looked up')
+    parser.add_argument('-n', action='store', dest='n', type=int,
+                        required=False, default=50, help='the number of neighbors per route')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, compression='zip' if args.data.endswith('.zip') else None)
+    ratings, user_ids, item_ids = ratings_matrix(df)
+
+    start = time.perf_counter()
+    table = also_climbed.build(df, args.n)
+    print(f'{len(item_ids)} routes, table built in {time.perf_counter() - start:.2f} s')
+
+    neighbors = item_neighbors.build(ratings, item_ids, k=args.n)
+    names = df.drop_duplicates('route_id').sample(args.queries, random_state=0, replace=True)
+    route_ids, route_names = names['route_id'].tolist(), names['name'].tolist()
+
+    print('-'*60)
+    print('{:<26} {:<12} {:<12} {:<10}'.format(*['lookup', 'p50 (us)', 'p99 (us)', 'speedup']))
+    print('-'*60)
+
+    base = None
+    for label, fn, queries in [('notebook (by name)', lambda q: notebook_lookup(df, neighbors, q, args.n), route_names),
+                               ('table by name', lambda q: table.lookup(q, args.n), route_names),
+                               ('table by route_id', lambda q: table.lookup(q, args.n), route_ids)]:
+        runs = latencies(fn, queries)
+        base = base or np.median(runs)
+        print('{:<26} {:<12.0f} {:<12.0f} {:<10.0f}'.format(label, np.median(runs), np.percentile(runs, 99),
+                                                           base / np.median(runs)))
@@ -0,0 +1,55 @@
+import os
+import time
+import argparse
+import pandas as pd
+from item_similarity import ratings_matrix, item_neighbors
+
+def tiled(df, copies):
+
+    """
+        the ratings repeated with disjoint users and routes per copy, a stand-in for more states' data
+    """
+
+    users, routes = df['users'].max() + 1, df['route_id'].max() + 1
+    return pd.concat([df.assign(users=df['users'] + c * users, route_id=df['route_id'] + c * routes) for c in range(copies)],
+                     ignore_index=True)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time the neighbor table build as the ratings grow')
+    parser.add_argument('-d', action='store', dest='data', type=str, nargs='+',
+                        required=False, default=['openbeta-ratings-nevada.zip'],
+                        help='ratings csv files (e.g. Nevada, then the full US export), timed in order')
+    parser.add_argument('-x', action='store', dest='copies', type=int, nargs='+',
+                        required=False, default=[1, 4, 16], help='tile each file this many times')
+    parser.add_argument('-s', action='store', dest='similarity', type=str,
+                        required=False, default='msd', help='the similarity measure')
+    parser.add_argument('-k', action='store', dest='k', type=int,
+                        required=False, default=40, help='the number of neighbors kept per route')
+    args = parser.parse_args()
+
+    print('{:<32} {:<10} {:<9} {:<10} {:<14} {:<12} {:<12}'.format(
+        *['data', 'users', 'routes', 'ratings', 'pivot (MB)', 'build (s)', 'table (MB)']))
+    print('-'*102)
+
+    for path in args.data:
+
+        df = pd.read_csv(path, compression='zip' if path.endswith('.zip') else None)
+        for copies in args.copies:
+
+            data = tiled(df, copies)
+            start = time.perf_counter()
+            ratings, user_ids, item_ids = ratings_matrix(data)
+            table = item_neighbors.build(ratings, item_ids, args.similarity, args.k)
+            build_s = time.perf_counter() - start
+
+            table.save('benchmark_neighbors.npz')
+            table_mb = os.path.getsize('benchmark_neighbors.npz') / 2**20
+            os.remove('benchmark_neighbors.npz')
+
+            print('{:<32} {:<10} {:<9} {:<10} {:<14.0f} {:<12.2f} {:<12.2f}'.format(
+                f'{os.path.basename(path)} x{copies}', len(user_ids), len(item_ids), ratings.nnz,
+                len(user_ids) * len(item_ids) * 8 / 2**20, build_s, table_mb))
+
+    print()
+    print('pivot (MB) is the dense users x routes float matrix of pivot_table, which the build never creates')
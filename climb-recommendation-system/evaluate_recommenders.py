@@ -0,0 +1,149 @@
+import time
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from surprise import Dataset, Reader, accuracy
+from surprise import KNNBasic, KNNWithMeans, KNNWithZScore, KNNBaseline
+from surprise.model_selection import KFold
+
+ALGORITHMS = {'KNNBasic': KNNBasic, 'KNNWithMeans': KNNWithMeans, 'KNNWithZScore': KNNWithZScore, 'KNNBaseline': KNNBaseline}
+
+_worker_folds = None  # the (trainset, testset) folds used by pool workers, built once per process
+
+
+def kfold_splits(df, n_splits=5, seed=0):
+
+    reader = Reader(rating_scale=(0, 4))
+    data = Dataset.load_from_df(df[['users', 'route_id', 'ratings']], reader)
+
+    return list(KFold(n_splits=n_splits, random_state=seed).split(data))
+
+
+def init_evaluation_worker(df, n_splits, seed):
+
+    global _worker_folds
+    if _worker_folds is None:  # forked workers inherit the parent's folds
+        _worker_folds = kfold_splits(df, n_splits, seed)
+
+
+def precision_recall_at_k(predictions, k=10, threshold=3.5):
+
+    """
+        precision@k and recall@k averaged over users: a route is relevant if its true rating is at least threshold,
+        and recommended if it is among the user's k highest estimates and its estimate is at least threshold
+    """
+
+    user_est_true = defaultdict(list)
+    for uid, _, true_r, est, _ in predictions:
+        user_est_true[uid].append((est, true_r))
+
+    precisions, recalls = [], []
+    for ratings in user_est_true.values():
+
+        ratings.sort(key=lambda x: x[0], reverse=True)
+        n_rel = sum(true_r >= threshold for _, true_r in ratings)
+        n_rec_k = sum(est >= threshold for est, _ in ratings[:k])
+        n_rel_and_rec_k = sum(true_r >= threshold and est >= threshold for est, true_r in ratings[:k])
+
+        precisions.append(n_rel_and_rec_k / n_rec_k if n_rec_k else 0.0)
+        recalls.append(n_rel_and_rec_k / n_rel if n_rel else 0.0)
+
+    return np.mean(precisions), np.mean(recalls)
+
+
+def evaluate_in_worker(job):
+
+    config_id, config, fold, top_k, threshold = job
+    trainset, testset = _worker_folds[fold]
+
+    algo = ALGORITHMS[config['algo']](k=config['k'], verbose=False,
+                                      sim_options={'name': config['name'], 'user_based': config['user_based'],
+                                                   'min_support': config['min_support']})
+
+    start = time.perf_counter()
+    algo.fit(trainset)
+    fit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = algo.test(testset)
+    predict_s = time.perf_counter() - start
+
+    precision, recall = precision_recall_at_k(predictions, top_k, threshold)
+
+    return dict(config_id=config_id, **config, fold=fold, rmse=accuracy.rmse(predictions, verbose=False),
+                mae=accuracy.mae(predictions, verbose=False), **{f'precision@{top_k}': precision, f'recall@{top_k}': recall},
+                fit_seconds=fit_s, predict_seconds=predict_s, n_test=len(testset))
+
+
+def config_grid(algos=('KNNWithZScore',), names=('msd',), user_based=(False,), min_supports=(2,), ks=(40,)):
+
+    return [{'algo': a, 'name': n, 'user_based': u, 'min_support': m, 'k': k}
+            for a, n, u, m, k in itertools.product(algos, names, user_based, min_supports, ks)]
+
+
+def evaluate(df, configs, n_splits=5, seed=0, jobs=None, top_k=10, threshold=3.5):
+
+    """
+        cross-validates every config on the same n_splits folds, one (config, fold) task per pool worker; the ratings
+        are sent to each worker once (forked workers inherit the folds), returns one row per (config, fold)
+    """
+
+    global _worker_folds
+    _worker_folds = kfold_splits(df, n_splits, seed)
+
+    jobs_list = [(i, config, fold, top_k, threshold) for i, config in enumerate(configs) for fold in range(n_splits)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_evaluation_worker, initargs=(df, n_splits, seed)) as pool:
+        rows = list(pool.map(evaluate_in_worker, jobs_list))
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Cross-validate recommender configurations in parallel')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='openbeta-ratings-nevada.zip', help='the ratings csv')
+    parser.add_argument('-a', action='store', dest='algos', type=str, nargs='+', choices=list(ALGORITHMS),
+                        required=False, default=['KNNWithZScore'], help='the algorithms')
+    parser.add_argument('-s', action='store', dest='names', type=str, nargs='+', choices=['msd', 'cosine', 'pearson', 'pearson_baseline'],
+                        required=False, default=['msd', 'pearson'], help='the similarity measures')
+    parser.add_argument('-u', action='store', dest='based', type=str, nargs='+', choices=['item', 'user'],
+                        required=False, default=['item', 'user'], help='item- and/or user-based similarities')
+    parser.add_argument('-m', action='store', dest='min_supports', type=int, nargs='+',
+                        required=False, default=[1, 2, 5], help='the minimum supports')
+    parser.add_argument('-k', action='store', dest='ks', type=int, nargs='+',
+                        required=False, default=[40], help='the maximum numbers of neighbors')
+    parser.add_argument('-f', action='store', dest='folds', type=int,
+                        required=False, default=5, help='the number of folds')
+    parser.add_argument('-r', action='store', dest='seed', type=int,
+                        required=False, default=0, help='the seed of the fold split')
+    parser.add_argument('-j', action='store', dest='jobs', type=int,
+                        required=False, default=None, help='the number of worker processes')
+    parser.add_argument('-n', action='store', dest='top_k', type=int,
+                        required=False, default=10, help='k of precision@k and recall@k')
+    parser.add_argument('-t', action='store', dest='threshold', type=float,
+                        required=False, default=3.5, help='the lowest rating of a relevant route')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default=None, help='the results csv (default: evaluation-<time>.csv)')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, compression='zip' if args.data.endswith('.zip') else None)
+    configs = config_grid(args.algos, args.names, [b == 'user' for b in args.based], args.min_supports, args.ks)
+
+    start = time.perf_counter()
+    results = evaluate(df, configs, args.folds, args.seed, args.jobs, args.top_k, args.threshold)
+    elapsed = time.perf_counter() - start
+
+    out = args.out or time.strftime('evaluation-%Y%m%d-%H%M%S.csv')
+    results.to_csv(out, index=False)
+
+    metrics = ['rmse', 'mae', f'precision@{args.top_k}', f'recall@{args.top_k}', 'fit_seconds', 'predict_seconds']
+    summary = results.groupby(['config_id', 'algo', 'name', 'user_based', 'min_support', 'k'])[metrics].mean()
+
+    pd.set_option('display.width', 200)
+    print(summary.sort_values('rmse').round(4).to_string())
+    print()
+    print(f'{len(configs)} configs x {args.folds} folds in {elapsed:.1f} s, results written to {out}')
@@ -0,0 +1,170 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+SIMILARITIES = ('msd', 'cosine')
+
+def ratings_matrix(df, user_col='users', item_col='route_id', rating_col='ratings'):
+
+    """
+        the ratings as a sparse CSR users x items matrix, with the user and item ids of its rows and columns
+        (a user's repeated ratings of a route are averaged, like pivot_table)
+    """
+
+    users, user_ids = pd.factorize(df[user_col], sort=True)
+    items, item_ids = pd.factorize(df[item_col], sort=True)
+    shape = (len(user_ids), len(item_ids))
+
+    ratings = sparse.coo_matrix((df[rating_col].to_numpy(dtype=float), (users, items)), shape=shape).tocsr()
+    counts = sparse.coo_matrix((np.ones(len(df)), (users, items)), shape=shape).tocsr() # duplicates are summed by tocsr
+    ratings.data /= counts.data
+
+    return ratings, np.asarray(user_ids), np.asarray(item_ids)
+
+def similarity_block(R, B, R2, cols, name='msd', min_support=1):
+
+    """
+        the similarities of the item pairs (i, cols[j]) with at least min_support common users, as Surprise computes them
+        for item-based KNN: over the users who rated both items, msd gives 1 / (mean squared difference + 1) and cosine
+        gives sum(r_i * r_j) / sqrt(sum(r_i^2) * sum(r_j^2)); returns the arrays i, j, similarity and support
+
+        R, B and R2 are CSC users x items matrices of the ratings, of ones where rated, and of squared ratings. Only
+        pairs of items rated by a common user are ever materialized.
+    """
+
+    def pairs(X):
+        X = X.tocsr()
+        X.sort_indices()
+        return np.repeat(np.arange(X.shape[0]), np.diff(X.indptr)) * len(cols) + X.indices, X.data
+
+    keys, n = pairs(B.T @ B[:, cols]) # sorted
+
+    def at(X):
+        # sparse products drop zero sums (e.g. of zero ratings), so place their values on the support's pairs
+        x_keys, x_values = pairs(X)
+        values = np.zeros(len(keys))
+        values[np.searchsorted(keys, x_keys)] = x_values
+        return values
+
+    prods = at(R.T @ R[:, cols])
+    sq_i = at(R2.T @ B[:, cols]) # sum of r_i^2 over the common users
+    sq_j = at(B.T @ R2[:, cols])
+
+    keep = n >= max(min_support, 1)
+    i, j, n, prods, sq_i, sq_j = keys[keep] // len(cols), keys[keep] % len(cols), n[keep], prods[keep], sq_i[keep], sq_j[keep]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if name == 'msd':
+            sim = 1.0 / ((sq_i + sq_j - 2 * prods) / n + 1.0)
+        elif name == 'cosine':
+            sim = prods / np.sqrt(sq_i * sq_j)
+        else:
+            raise ValueError(f'unknown similarity {name}, expected one of {SIMILARITIES}')
+
+    return i, j, np.where(np.isfinite(sim), sim, 0.0), n
+
+class item_neighbors(object):
+
+    """
+        the k most similar routes of every route, as an (items, k) table of neighbor positions (-1 where a route has
+        fewer than k neighbors with a nonzero similarity), similarities and supports, ordered by similarity
+    """
+
+    def __init__(self, item_ids, neighbors, similarity, support, name, min_support):
+
+        self.item_ids = item_ids
+        self.neighbors = neighbors
+        self.similarity = similarity
+        self.support = support
+        self.name = name
+        self.min_support = min_support
+        self.positions = pd.Index(item_ids)
+
+    @classmethod
+    def build(cls, ratings, item_ids, name='msd', k=40, min_support=2, block_size=1024):
+
+        """
+            the neighbor table of a users x items ratings matrix, computed for block_size items at a time from sparse
+            products, so neither the dense users x items nor the items x items matrix is ever held in memory
+        """
+
+        R = sparse.csc_matrix(ratings, dtype=float)
+        B = R.copy()
+        B.data = np.ones_like(B.data)
+        R2 = R.multiply(R).tocsc()
+
+        n_items = R.shape[1]
+        neighbors = np.full((n_items, k), -1, dtype=np.int32)
+        similarity = np.zeros((n_items, k), dtype=np.float32)
+        support = np.zeros((n_items, k), dtype=np.int32)
+
+        for start in range(0, n_items, block_size):
+
+            i, j, sim, sup = similarity_block(R, B, R2, np.arange(start, min(start + block_size, n_items)), name,
+                                              min_support)
+            j = j + start
+            keep = (i != j) & (sim > 0) # not its own neighbor
+            i, j, sim, sup = i[keep], j[keep], sim[keep], sup[keep]
+
+            # top k per item: by item, then by similarity, ties to the lower neighbor position
+            order = np.lexsort((i, -sim, j))
+            i, j, sim, sup = i[order], j[order], sim[order], sup[order]
+            rank = np.arange(len(j)) - np.searchsorted(j, j)
+            top = rank < k
+
+            neighbors[j[top], rank[top]] = i[top]
+            similarity[j[top], rank[top]] = sim[top]
+            support[j[top], rank[top]] = sup[top]
+
+        return cls(np.asarray(item_ids), neighbors, similarity, support, name, min_support)
+
+    def save(self, path):
+
+        np.savez_compressed(path, item_ids=self.item_ids, neighbors=self.neighbors, similarity=self.similarity,
+                            support=self.support, name=self.name, min_support=self.min_support)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path, allow_pickle=False) as table:
+            return cls(table['item_ids'], table['neighbors'], table['similarity'], table['support'], str(table['name']),
+                       int(table['min_support']))
+
+    def get_neighbors(self, item_id, n=None):
+
+        """
+            (route_ids, similarities, supports) of the n (default: all k) most similar routes of a route
+        """
+
+        row = self.positions.get_loc(item_id)
+        found = self.neighbors[row, :n] >= 0
+        cols = self.neighbors[row, :n][found]
+
+        return self.item_ids[cols], self.similarity[row, :n][found], self.support[row, :n][found]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the item-item neighbor table of a ratings file')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='openbeta-ratings-nevada.zip', help='the ratings csv (users, route_id, ratings)')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='item_neighbors.npz', help='the neighbor table file')
+    parser.add_argument('-s', action='store', dest='similarity', type=str, choices=SIMILARITIES,
+                        required=False, default='msd', help='the similarity measure')
+    parser.add_argument('-k', action='store', dest='k', type=int,
+                        required=False, default=40, help='the number of neighbors kept per route')
+    parser.add_argument('-m', action='store', dest='min_support', type=int,
+                        required=False, default=2, help='the minimum number of common users of a neighbor')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, compression='zip' if args.data.endswith('.zip') else None)
+
+    start = time.perf_counter()
+    ratings, user_ids, item_ids = ratings_matrix(df)
+    table = item_neighbors.build(ratings, item_ids, args.similarity, args.k, args.min_support)
+    table.save(args.out)
+
+    print(f'{len(user_ids)} users x {len(item_ids)} routes, {ratings.nnz} ratings: '
+          f'neighbor table built in {time.perf_counter() - start:.2f} s, saved to {args.out}')
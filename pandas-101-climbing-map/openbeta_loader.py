@@ -0,0 +1,173 @@
+import os
+import io
+import json
+import time
+import zipfile
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+# the fields the map needs, as dotted paths into each route record; a [lng, lat] field becomes float lng and lat columns
+FIELDS = ['route_name', 'grade.YDS', 'safety', 'type', 'metadata.parent_sector', 'metadata.mp_route_id',
+          'metadata.mp_sector_id', 'metadata.parent_lnglat']
+LNGLAT_FIELD = 'metadata.parent_lnglat'
+
+# fields with few distinct values, stored as categoricals
+CATEGORICAL = ['type', 'state', 'metadata.state', 'safety', 'grade.YDS', 'metadata.parent_sector']
+
+def open_lines(path):
+
+    """
+        the lines of a JSONL file, or of the first member of a zip archive
+    """
+
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        return io.TextIOWrapper(archive.open(archive.namelist()[0]), encoding='utf-8')
+
+    return open(path, 'r', encoding='utf-8')
+
+def project(record, path):
+
+    for key in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+
+    if isinstance(record, dict): # e.g. type: {"trad": true, "sport": true} -> "sport, trad"
+        return ', '.join(sorted(k for k, v in record.items() if v))
+
+    return record
+
+class column_builder(object):
+
+    """
+        one output column, filled chunk by chunk: categoricals keep only int codes into a growing category list,
+        [lng, lat] fields only float arrays, other fields object arrays
+    """
+
+    def __init__(self, field, categorical):
+
+        self.field = field
+        self.categorical = categorical
+        self.codes = {}
+        self.chunks = []
+
+    def add(self, values):
+
+        if self.field == LNGLAT_FIELD:
+            lnglat = [v if isinstance(v, (list, tuple)) and len(v) == 2 else (np.nan, np.nan) for v in values]
+            self.chunks.append(np.array(lnglat, dtype=float).reshape(-1, 2))
+        elif self.categorical:
+            codes = self.codes
+            self.chunks.append(np.array([-1 if v is None else codes.setdefault(v, len(codes)) for v in values], dtype=np.int32))
+        else:
+            self.chunks.append(np.array(values, dtype=object))
+
+    def columns(self):
+
+        if self.field == LNGLAT_FIELD:
+            lnglat = np.concatenate(self.chunks) if self.chunks else np.empty((0, 2))
+            return {'lng': lnglat[:, 0], 'lat': lnglat[:, 1]}
+
+        values = np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=object)
+        if self.categorical:
+            values = pd.Categorical.from_codes(values, categories=list(self.codes))
+
+        return {self.field: values}
+
+def read_chunks(path, fields=FIELDS, chunksize=50000):
+
+    """
+        lists of the projected values of each field, chunksize records at a time; only one chunk of parsed records
+        is held at once
+    """
+
+    paths = [f.split('.') for f in fields]
+    with open_lines(path) as lines:
+
+        chunk = []
+        for line in lines:
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) == chunksize:
+                yield [[project(r, p) for r in chunk] for p in paths]
+                chunk = []
+
+        if chunk:
+            yield [[project(r, p) for r in chunk] for p in paths]
+
+def parse_routes(path, fields=FIELDS, categorical=CATEGORICAL, chunksize=50000):
+
+    builders = [column_builder(f, f in categorical) for f in fields]
+    for values in read_chunks(path, fields, chunksize):
+        for builder, column in zip(builders, values):
+            builder.add(column)
+
+    columns = {}
+    for builder in builders:
+        columns.update(builder.columns())
+
+    return pd.DataFrame(columns)
+
+def cache_path(path, fields, categorical, cache_dir):
+
+    """
+        the cache file of a source file and projection, named by the source's name, size and modification time and the
+        fields, so a changed source or projection never reads a stale cache
+    """
+
+    stat = os.stat(path)
+    key = json.dumps([os.path.basename(path), stat.st_size, int(stat.st_mtime), list(fields), sorted(categorical)])
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    return os.path.join(cache_dir, f'{name}-{hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]}.parquet')
+
+def to_geodataframe(df):
+
+    import geopandas as gpd # optional, only for maps
+    return gpd.GeoDataFrame(df, crs='EPSG:4326', geometry=gpd.points_from_xy(df['lng'], df['lat']))
+
+def load_routes(path, fields=FIELDS, categorical=CATEGORICAL, chunksize=50000, cache_dir='.openbeta_cache', geometry=False):
+
+    """
+        the routes of an OpenBeta JSONL export (zipped or not) as a DataFrame with one column per dotted field (float lng
+        and lat for metadata.parent_lnglat, categoricals for the CATEGORICAL fields), or as a GeoDataFrame of points
+        with geometry=True
+
+        The first load parses the JSON in chunks and writes the columns to a parquet file in cache_dir (None: no cache);
+        later loads of the same file and fields read that instead.
+    """
+
+    cached = cache_path(path, fields, categorical, cache_dir) if cache_dir else None
+
+    if cached and os.path.exists(cached):
+        df = pd.read_parquet(cached)
+    else:
+        df = parse_routes(path, fields, categorical, chunksize)
+        if cached:
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(cached + '.tmp', index=False)
+            os.replace(cached + '.tmp', cached) # readers never see a partial file
+
+    return to_geodataframe(df) if geometry else df
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load an OpenBeta routes JSONL export and cache its columns as parquet')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='../../opendata/openbeta-usa-routes-aug-2020.zip', help='the routes export')
+    parser.add_argument('-f', action='store', dest='fields', type=str, nargs='+',
+                        required=False, default=FIELDS, help='dotted fields to load')
+    parser.add_argument('-c', action='store', dest='cache_dir', type=str,
+                        required=False, default='.openbeta_cache', help='the parquet cache directory')
+    args = parser.parse_args()
+
+    for attempt in ['first load', 'second load']:
+        start = time.perf_counter()
+        df = load_routes(args.data, args.fields, cache_dir=args.cache_dir)
+        print(f'{attempt}: {len(df)} routes in {time.perf_counter() - start:.2f} s, '
+              f'{df.memory_usage(deep=True).sum() / 2**20:.1f} MB in memory')
+
+    print(df.dtypes.to_string())
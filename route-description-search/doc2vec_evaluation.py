@@ -0,0 +1,104 @@
+import json
+import random
+import argparse
+import collections
+import numpy as np
+from doc2vec_search.vector_index import normalize_rows
+
+
+def self_ranks(model, corpus, samples, epochs=None, block_size=256):
+
+    """
+        the rank of each sampled training document among all docs when its own words are inferred
+        (rank 0 means the inferred vector is most similar to the document's trained vector)
+
+        The sample vectors are inferred into one matrix and compared with all doc vectors in blocks
+        of one matrix product each; a document's rank is the number of docs with a strictly higher
+        cosine similarity, which is its position in model.dv.most_similar without sorting anything.
+    """
+
+    inferred = np.vstack([model.infer_vector(corpus[doc_id].words, epochs=epochs) for doc_id in samples])
+    queries = normalize_rows(inferred)
+    docs = normalize_rows(model.dv.vectors)
+    samples = np.asarray(samples)
+
+    ranks = np.empty(len(samples), dtype=np.int64)
+    for start in range(0, len(samples), block_size):
+
+        block = slice(start, start + block_size)
+        sims = queries[block] @ docs.T
+        own = sims[np.arange(sims.shape[0]), samples[block]]
+        ranks[block] = np.count_nonzero(sims > own[:, None], axis=1)
+
+    return ranks
+
+
+def self_rank_report(model, corpus, n_samples=1000, seed=None, epochs=None, model_name=None):
+
+    """
+        runs the self-rank sanity check on n_samples random training documents and returns a
+        JSON-serializable report (sorted keys, so reports from two model versions diff cleanly)
+    """
+
+    samples = random.Random(seed).sample(range(len(corpus)), min(n_samples, len(corpus)))
+    ranks = self_ranks(model, corpus, samples, epochs=epochs)
+    counts = collections.Counter(ranks.tolist())
+
+    return {'model': model_name,
+            'n_docs': len(model.dv),
+            'vector_size': model.vector_size,
+            'epochs': epochs or model.epochs,
+            'n_samples': len(samples),
+            'seed': seed,
+            'rank_counts': {str(rank): counts[rank] for rank in sorted(counts)},
+            'summary': {'top1': float(np.mean(ranks < 1)),
+                        'top5': float(np.mean(ranks < 5)),
+                        'top10': float(np.mean(ranks < 10)),
+                        'median_rank': float(np.median(ranks)),
+                        'mean_rank': float(np.mean(ranks)),
+                        'mean_reciprocal_rank': float(np.mean(1.0 / (ranks + 1)))}}
+
+
+def print_rank_table(report):
+
+    print('{:<10} {:<10} {:<15}'.format(*['rank', 'count', 'cumulative sum']))
+    print('------------------------------------')
+    cumsum = 0
+    for rank, count in report['rank_counts'].items():
+        cumsum += count
+        print('{:<10} {:<10} {:<15}'.format(*[rank, count, cumsum]))
+    print('------------------------------------')
+    print()
+
+
+def write_report(report, path):
+
+    with open(path, 'w') as out:
+        json.dump(report, out, indent=2)  # in report order, so rank_counts stays sorted by rank
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Self-rank sanity check of a trained doc2vec model')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model')
+    parser.add_argument('--token-cache', action='store', dest='token_cache', type=str,
+                        required=False, default='doc2vec_tokens', help='the token cache the model was trained on')
+    parser.add_argument('-n', action='store', dest='n_samples', type=int,
+                        required=False, default=1000, help='the number of training documents to check')
+    parser.add_argument('--seed', action='store', dest='seed', type=int,
+                        required=False, default=0, help='the seed for choosing the sampled documents')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='doc2vec_sanity_check.json', help='the JSON report')
+    args = parser.parse_args()
+
+    from gensim.models import Doc2Vec
+    from token_corpus import token_cache, tagged_corpus
+
+    model = Doc2Vec.load(args.model)
+    corpus = tagged_corpus(token_cache.open(args.token_cache))
+
+    report = self_rank_report(model, corpus, n_samples=args.n_samples, seed=args.seed, model_name=args.model)
+    print_rank_table(report)
+    write_report(report, args.out)
+    print('report written to', args.out)
@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from gensim.models import Doc2Vec
+from text_cleaning import clean_desc
+from inference_cache import infer_query_vector
+from vector_index import normalize_rows
+
+
+_worker_model = None  # the model used by pool workers, loaded once per process
+
+
+def init_inference_worker(model_path):
+
+    global _worker_model
+    if _worker_model is None:  # forked workers inherit the parent's model
+        _worker_model = Doc2Vec.load(model_path)
+
+
+def infer_in_worker(job):
+
+    tokens, epochs, seed = job
+    return infer_query_vector(_worker_model, tokens, epochs=epochs, seed=seed)
+
+
+def inference_pool(model, model_path='doc2vec.model', jobs=None):
+
+    """
+        a process pool whose workers each hold a copy of the model for infer_in_worker
+        (forked workers inherit model, spawned workers load it from model_path)
+    """
+
+    global _worker_model
+    _worker_model = model
+
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_inference_worker, initargs=(model_path,))
+
+
+def score_queries(normed_vectors, query_vectors, topn=3, block_size=256):
+
+    """
+        exact cosine top-n for many queries at once: one matrix product per block of queries
+        followed by a row-wise argpartition, yields (doc_ids, scores) arrays of shape (block, topn)
+    """
+
+    queries = normalize_rows(query_vectors)
+    topn = min(topn, len(normed_vectors))
+
+    for start in range(0, len(queries), block_size):
+
+        scores = queries[start:start + block_size] @ normed_vectors.T
+        part = np.argpartition(-scores, topn - 1, axis=1)[:, :topn]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind='stable')
+
+        yield np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def search_many(queries, store, model, model_path='doc2vec.model', topn=3, jobs=None, epochs=1000, seed=None,
+                cache=None, fields=('route_ID', 'route_name', 'type_string'), chunk_size=1024):
+
+    """
+        searches many descriptions at once, yielding one result dict per query (in query order)
+
+        Queries are processed in chunks: each chunk is cleaned and inferred across a process pool
+        (workers load the model once), then scored against all doc vectors in a single matrix
+        product. Results are yielded as soon as their chunk is scored, so output can be streamed.
+    """
+
+    normed_vectors = store.vectors if store.vectors is not None else normalize_rows(model.dv.vectors)
+    workers = jobs or os.cpu_count() or 1
+    args = (store, normed_vectors, list(fields), topn, epochs, seed, cache, max(1, chunk_size // (4 * workers)))
+
+    with inference_pool(model, model_path=model_path, jobs=workers) as pool:
+
+        chunk = []
+        for query in queries:
+            chunk.append(query)
+            if len(chunk) == chunk_size:
+                yield from _search_chunk(pool, chunk, *args)
+                chunk = []
+
+        if chunk:
+            yield from _search_chunk(pool, chunk, *args)
+
+
+def _search_chunk(pool, chunk, store, normed_vectors, fields, topn, epochs, seed, cache, chunksize):
+
+    tokens = list(pool.map(clean_desc, chunk, chunksize=chunksize))
+
+    vectors = [None] * len(chunk)
+    if cache is not None:
+        vectors = [cache.get((tuple(t), epochs, seed)) for t in tokens]
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    jobs = [(tokens[i], epochs, seed) for i in missing]
+    for i, vector in zip(missing, pool.map(infer_in_worker, jobs, chunksize=chunksize)):
+        vectors[i] = vector
+        if cache is not None:
+            cache.put((tuple(tokens[i]), epochs, seed), vector)
+
+    start = 0
+    for doc_ids, scores in score_queries(normed_vectors, np.vstack(vectors), topn=topn):
+
+        topn = doc_ids.shape[1]
+        rows = store.doc_rows[doc_ids]
+        gathered = store.lookup(doc_ids.ravel(), fields)  # one gather for the whole block
+
+        for i in range(len(doc_ids)):
+            results = [dict({f: gathered[f][i * topn + j] for f in fields}, rank=j, doc_id=int(doc_ids[i, j]),
+                            score=float(scores[i, j])) for j in range(topn) if rows[i, j] >= 0]
+            yield {'query': chunk[start + i], 'results': results}
+
+        start += len(doc_ids)
+
+
+def write_jsonl(results, out):
+
+    for res in results:
+        out.write(json.dumps(res, default=lambda x: x.item() if hasattr(x, 'item') else str(x)) + '\n')
+        out.flush()
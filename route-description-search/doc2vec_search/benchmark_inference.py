@@ -0,0 +1,76 @@
+import time
+import argparse
+import itertools
+import numpy as np
+from gensim.models import Doc2Vec
+from text_cleaning import clean_desc
+from inference_cache import infer_query_vector
+
+
+def top_ids(model, vector, topn):
+    return {doc_id for doc_id, _ in model.dv.most_similar(positive=[vector], topn=topn)}
+
+
+def overlap(a, b):
+    return len(a & b) / max(len(a | b), 1)  # Jaccard overlap of two top-n sets
+
+
+def read_queries(paths):
+
+    queries = []
+    for path in paths:
+        with open(path, 'r') as qf:
+            queries += [q.strip() for q in qf if q.strip()]
+
+    return queries
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark query inference latency and ranking stability vs. epochs')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model')
+    parser.add_argument('-q', action='store', dest='queries', type=str, nargs='+', required=False,
+                        default=['../validation_phrases.txt', '../validation_descriptions.txt'], help='query files')
+    parser.add_argument('-n', action='store', dest='topn', type=int,
+                        required=False, default=10, help='the number of results compared between runs')
+    parser.add_argument('-r', action='store', dest='repeats', type=int,
+                        required=False, default=5, help='the number of repeated inferences per query')
+    args = parser.parse_args()
+
+    model = Doc2Vec.load(args.model)
+    tokens = [clean_desc(q) for q in read_queries(args.queries)]
+
+    # the reference ranking is a seeded inference with a generous budget
+    reference = [top_ids(model, infer_query_vector(model, t, epochs=2000, seed=0), args.topn) for t in tokens]
+
+    print(f'{len(tokens)} queries, top {args.topn}, {args.repeats} repeats per query')
+    print('-'*84)
+    print('{:<10} {:<12} {:<12} {:<24} {:<24}'.format(
+        *['epochs', 'p50 (ms)', 'p99 (ms)', 'repeat overlap (unseeded)', 'overlap vs. reference']))
+    print('-'*84)
+
+    for epochs in (25, 50, 100, 250, 500, 1000):
+
+        latencies, stability, agreement = [], [], []
+        for t, ref in zip(tokens, reference):
+
+            runs = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                vector = infer_query_vector(model, t, epochs=epochs)
+                latencies.append(1000 * (time.perf_counter() - start))
+                runs.append(top_ids(model, vector, args.topn))
+
+            stability += [overlap(a, b) for a, b in itertools.combinations(runs, 2)]
+            agreement += [overlap(run, ref) for run in runs]
+
+        line = [epochs, *np.percentile(latencies, [50, 99]), np.mean(stability), np.mean(agreement)]
+        print('{:<10} {:<12.2f} {:<12.2f} {:<24.3f} {:<24.3f}'.format(*line))
+
+    print('-'*84)
+
+    # seeded inference is reproducible by construction, confirm it
+    seeded = [[top_ids(model, infer_query_vector(model, t, epochs=100, seed=0), args.topn) for _ in range(2)]
+              for t in tokens]
+    print('seeded repeat overlap (epochs = 100):', np.mean([overlap(a, b) for a, b in seeded]))
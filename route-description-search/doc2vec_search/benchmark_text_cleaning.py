@@ -0,0 +1,67 @@
+import re
+import time
+import string
+import argparse
+import pandas as pd
+from nltk import word_tokenize
+from gensim.parsing.preprocessing import remove_stopwords
+from text_cleaning import clean_desc, clean_series, join_description
+
+
+def legacy_clean_desc(desc):
+
+    """
+        the original per-call implementation, kept here as the reference
+    """
+
+    desc = str(desc).lower()  # lowercase
+    desc = remove_stopwords(desc)
+    desc = re.sub(r'\s+', ' ', desc)  # multiple spaces converted to single spaces
+    desc = re.sub('[0-9]', '', desc)  # remove digits
+    desc = re.sub(r'(?<=\w)-(?=\w)', ' ', desc)  # dash replaced with space
+    desc = re.sub(f'[{re.escape(string.punctuation)}]', '', desc)  # remove punctuation and special characters
+
+    tokens = word_tokenize(desc)
+    tokens = [t for t in tokens if len(t) > 1]  # remove short tokens
+
+    return tokens
+
+
+def docs_per_sec(fn, docs):
+
+    start = time.perf_counter()
+    out = fn(docs)
+    return len(docs) / (time.perf_counter() - start), out
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark description cleaning against the original implementation')
+    parser.add_argument('-d', action='store', dest='data', type=str, required=False,
+                        default='../Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', help='the curated route data')
+    parser.add_argument('-n', action='store', dest='n_docs', type=int,
+                        required=False, default=20000, help='the number of descriptions to clean')
+    args = parser.parse_args()
+
+    df = pd.read_pickle(args.data, compression='zip')
+    docs = df.loc[df['description'].str.len() > 0, 'description'].head(args.n_docs).map(join_description)
+    docs = docs.reset_index(drop=True)
+
+    legacy_rate, reference = docs_per_sec(lambda d: [legacy_clean_desc(x) for x in d], docs)
+    runs = [('clean_desc (nltk)', lambda d: [clean_desc(x) for x in d]),
+            ('clean_desc (whitespace)', lambda d: [clean_desc(x, tokenizer='whitespace') for x in d]),
+            ('clean_series (nltk)', clean_series),
+            ('clean_series (whitespace)', lambda d: clean_series(d, tokenizer='whitespace'))]
+
+    print(f'{len(docs)} descriptions')
+    print('-'*76)
+    print('{:<28} {:<12} {:<10} {:<24}'.format(*['implementation', 'docs/sec', 'speedup', 'identical to original']))
+    print('-'*76)
+    print('{:<28} {:<12.0f} {:<10} {:<24}'.format(*['original', legacy_rate, '1.00', '-']))
+
+    for name, fn in runs:
+        rate, tokens = docs_per_sec(fn, docs)
+        same = sum(a == b for a, b in zip(tokens, reference)) / len(docs)
+        print('{:<28} {:<12.0f} {:<10.2f} {:<24}'.format(*[name, rate, rate / legacy_rate, f'{100 * same:.2f}%']))
+
+    print('-'*76)
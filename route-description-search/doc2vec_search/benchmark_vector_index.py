@@ -0,0 +1,73 @@
+import time
+import argparse
+import numpy as np
+from gensim.models import Doc2Vec
+from vector_index import ivf_index
+
+
+def timed_search(search, queries):
+
+    """
+        runs search on every query, returns the results and the per-query latencies in ms
+    """
+
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(1000 * (time.perf_counter() - start))
+
+    return results, np.array(latencies)
+
+
+def recall_at_k(exact, approx):
+
+    """
+        mean fraction of the exact topn doc ids that the approximate search also returned
+    """
+
+    hits = [len({d for d, _ in e} & {d for d, _ in a}) / max(len(e), 1) for e, a in zip(exact, approx)]
+    return float(np.mean(hits))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the IVF vector index against the exact model.dv scan')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model')
+    parser.add_argument('-i', action='store', dest='index', type=str,
+                        required=False, default='doc2vec_index', help='the index directory built by vector_index.py')
+    parser.add_argument('-q', action='store', dest='n_queries', type=int,
+                        required=False, default=500, help='the number of benchmark queries')
+    parser.add_argument('-n', action='store', dest='topn', type=int,
+                        required=False, default=10, help='k for recall@k')
+    args = parser.parse_args()
+
+    model = Doc2Vec.load(args.model)
+    index = ivf_index.load(args.index)
+
+    # queries are noisy copies of random doc vectors, which mimics inferred vectors without paying for inference
+    rng = np.random.RandomState(0)
+    docs = rng.choice(len(model.dv), args.n_queries, replace=False)
+    vectors = model.dv.vectors[docs]
+    noise = rng.normal(scale=0.25 * np.std(vectors), size=vectors.shape).astype(np.float32)
+    queries = vectors + noise
+
+    exact, exact_ms = timed_search(lambda q: model.dv.most_similar(positive=[q], topn=args.topn), queries)
+
+    print(f'{len(index)} docs, {index.n_lists} lists, {args.n_queries} queries, k = {args.topn}')
+    print('-'*60)
+    print('{:<12} {:<12} {:<12} {:<12}'.format(*['nprobe', 'recall@k', 'p50 (ms)', 'p99 (ms)']))
+    print('-'*60)
+    print('{:<12} {:<12.3f} {:<12.3f} {:<12.3f}'.format(*['exact', 1.0, *np.percentile(exact_ms, [50, 99])]))
+
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+
+        if nprobe > index.n_lists:
+            break
+
+        approx, approx_ms = timed_search(lambda q: index.search(q, topn=args.topn, nprobe=nprobe), queries)
+        line = [nprobe, recall_at_k(exact, approx), *np.percentile(approx_ms, [50, 99])]
+        print('{:<12} {:<12.3f} {:<12.3f} {:<12.3f}'.format(*line))
+
+    print('-'*60)
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from gensim.models import Doc2Vec
+from text_cleaning import clean_series
+from route_store import route_store
+from vector_index import ivf_index
+from batch_search import inference_pool, infer_in_worker
+from search_artifact import search_artifact, write_artifact
+
+
+STATE_FILE = 'incremental.json'
+INFERRED_FILE = 'inferred.npy'
+
+
+def content_hash(description):
+
+    """
+        hash of a route's description (a list of paragraphs), the only input to its doc vector
+    """
+
+    encoded = json.dumps(description, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def route_hashes(route_data):
+    return dict(zip(route_data['route_ID'].astype(np.int64).tolist(), route_data['description'].map(content_hash)))
+
+
+def load_state(artifact):
+
+    """
+        the update state kept in the artifact: route hashes, which docs have inferred (not trained)
+        vectors and the update history; an artifact straight from search_artifact.py is the trained base
+    """
+
+    path = os.path.join(artifact.path, STATE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as state_file:
+            state = json.load(state_file)
+        state['hashes'] = {int(r): h for r, h in state['hashes'].items()}
+        inferred = np.load(os.path.join(artifact.path, INFERRED_FILE))
+        return state, inferred
+
+    rows = np.arange(artifact.n_routes)
+    route_ids = artifact.column_values('route_ID', rows).tolist()
+    hashes = dict(zip(route_ids, map(content_hash, artifact.column_values('description', rows))))
+    state = {'base_docs': len(artifact), 'hashes': hashes, 'history': []}
+
+    return state, np.zeros(len(artifact), dtype=bool)
+
+
+def doc_routes(artifact):
+
+    """
+        route_ID of every doc tag, -1 for docs without a route (including tombstones)
+    """
+
+    doc_rows = np.asarray(artifact.doc_rows)
+    route_ids = np.asarray(artifact.columns['route_ID'], dtype=np.int64)
+
+    return np.where(doc_rows >= 0, route_ids[np.maximum(doc_rows, 0)], -1)
+
+
+def plan_update(routes_of_docs, old_hashes, new_hashes):
+
+    """
+        compares the routes in the artifact with the new route data, returns
+        (changed doc tags, their route_IDs), the added route_IDs and the tombstoned doc tags
+    """
+
+    doc_of_route = {r: d for d, r in enumerate(routes_of_docs.tolist()) if r >= 0}
+
+    changed = [(doc_of_route[r], r) for r, h in new_hashes.items() if r in doc_of_route and old_hashes.get(r) != h]
+    added = [r for r in new_hashes if r not in doc_of_route]
+    deleted = [d for r, d in doc_of_route.items() if r not in new_hashes]
+
+    return changed, added, deleted
+
+
+def drift_metrics(inferred, routes_of_docs, base_docs, oov_rate):
+
+    live = routes_of_docs >= 0
+    n_live = max(int(live.sum()), 1)
+
+    return {'inferred_fraction': float((inferred & live).sum() / n_live),
+            'tombstone_fraction': float((~live).sum() / max(len(live), 1)),
+            'growth': float(len(live) / max(base_docs, 1) - 1.0),
+            'oov_rate': oov_rate}
+
+
+def replace_dir(new_path, path):
+
+    """
+        swaps new_path in for path; processes that already opened the old files keep reading them
+    """
+
+    old_path = path + '.old'
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(new_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def incremental_update(model, model_path, artifact, route_data, index=None, epochs=None, seed=0, jobs=None,
+                       thresholds=None):
+
+    """
+        brings the search artifact (and optionally the ivf index) up to date with route_data without
+        retraining: only added and changed routes are inferred, changed routes keep their doc tag,
+        added routes get new doc tags and deleted routes are tombstoned (doc tag -> no route, zero
+        vector, left out of the index). Doc tags are never reused, so the index, the model and any
+        stored results keep meaning the same thing.
+
+        Returns the new artifact directory contents as (store, vectors, state, inferred, index, report);
+        report['retrain'] lists the drift metrics that crossed their thresholds.
+    """
+
+    thresholds = thresholds or {}
+    state, inferred = load_state(artifact)
+    routes_of_docs = doc_routes(artifact)
+    new_hashes = route_hashes(route_data)
+
+    changed, added, deleted = plan_update(routes_of_docs, state['hashes'], new_hashes)
+
+    docs = [d for d, _ in changed] + list(range(len(routes_of_docs), len(routes_of_docs) + len(added)))
+    routes = [r for _, r in changed] + added
+    descriptions = route_data.set_index('route_ID')['description'].loc[routes] if routes else pd.Series([], dtype=object)
+    tokens = clean_series(descriptions)
+
+    vectors = np.zeros((len(routes_of_docs) + len(added), artifact.vectors.shape[1]), dtype=np.float32)
+    vectors[:len(routes_of_docs)] = artifact.vectors
+    if tokens:
+        with inference_pool(model, model_path=model_path, jobs=jobs) as pool:
+            work = [(t, epochs, seed) for t in tokens]
+            vectors[docs] = np.vstack(list(pool.map(infer_in_worker, work, chunksize=64)))
+
+    routes_of_docs = np.concatenate([routes_of_docs, np.array(added, dtype=np.int64)])
+    routes_of_docs[deleted] = -1
+    vectors[deleted] = 0.0
+    inferred = np.concatenate([inferred, np.zeros(len(added), dtype=bool)])
+    inferred[docs] = True
+
+    route_data = route_data.reset_index(drop=True)
+    pos = pd.Index(route_data['route_ID']).get_indexer(routes_of_docs)
+    store = route_store(route_data, np.where(routes_of_docs >= 0, pos, -1).astype(np.int64))
+
+    n_tokens = sum(len(t) for t in tokens)
+    n_oov = sum(t not in model.wv.key_to_index for ts in tokens for t in ts)
+    metrics = drift_metrics(inferred, routes_of_docs, state['base_docs'], n_oov / n_tokens if n_tokens else 0.0)
+
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'changed': len(changed), 'added': len(added),
+              'deleted': len(deleted), 'docs': len(routes_of_docs), 'metrics': metrics,
+              'retrain': sorted(m for m, limit in thresholds.items() if metrics[m] > limit)}
+    state = {'base_docs': state['base_docs'], 'hashes': new_hashes, 'history': state['history'] + [report]}
+
+    if index is not None:
+        index = index.reassign(vectors, live=routes_of_docs >= 0)
+
+    return store, vectors, state, inferred, index, report
+
+
+def save_update(path, store, vectors, state, inferred, index=None, index_path=None):
+
+    """
+        writes the updated artifact (and index) next to the old ones and swaps them in
+    """
+
+    write_artifact(path + '.new', store, vectors)
+    with open(os.path.join(path + '.new', STATE_FILE), 'w') as state_file:
+        json.dump(dict(state, hashes={str(r): h for r, h in state['hashes'].items()}), state_file)
+    np.save(os.path.join(path + '.new', INFERRED_FILE), inferred)
+    replace_dir(path + '.new', path)
+
+    if index is not None:
+        index.save(index_path + '.new')
+        replace_dir(index_path + '.new', index_path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Update the search artifact with new, changed and deleted routes without retraining')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model used for inference')
+    parser.add_argument('-a', action='store', dest='artifact', type=str,
+                        required=False, default='search_artifact', help='the search artifact directory to update')
+    parser.add_argument('-d', action='store', dest='data', type=str, required=False,
+                        default='../Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', help='the current curated route data')
+    parser.add_argument('-i', action='store', dest='index', type=str,
+                        required=False, default=None, help='a vector index directory to update as well')
+    parser.add_argument('-e', action='store', dest='epochs', type=int,
+                        required=False, default=None, help='inference epochs per document (default: the training epochs)')
+    parser.add_argument('-j', action='store', dest='jobs', type=int,
+                        required=False, default=None, help='the number of inference worker processes')
+    parser.add_argument('--max-inferred', action='store', dest='max_inferred', type=float, required=False,
+                        default=0.10, help='schedule a retrain when more than this fraction of live docs is inferred')
+    parser.add_argument('--max-tombstones', action='store', dest='max_tombstones', type=float, required=False,
+                        default=0.10, help='schedule a retrain when more than this fraction of docs is tombstoned')
+    parser.add_argument('--max-oov', action='store', dest='max_oov', type=float, required=False,
+                        default=0.20, help='schedule a retrain when more than this fraction of new tokens is out of vocabulary')
+    parser.add_argument('--schedule', action='store', dest='schedule', type=str, required=False,
+                        default='retrain_scheduled.json', help='written when a full retrain is due')
+    args = parser.parse_args()
+
+    model = Doc2Vec.load(args.model)
+    artifact = search_artifact.open(args.artifact)
+    index = ivf_index.load(args.index, mmap=False) if args.index else None
+
+    # the same routes the model is trained on: the artifact's columns, routes with a description
+    df = pd.read_pickle(args.data, compression='zip')
+    df = df.loc[df['description'].str.len() > 0, list(artifact.columns)]
+    df = df.drop_duplicates('route_ID').assign(route_ID=df['route_ID'].astype(np.int64))
+
+    thresholds = {'inferred_fraction': args.max_inferred, 'tombstone_fraction': args.max_tombstones,
+                  'oov_rate': args.max_oov}
+
+    start = time.perf_counter()
+    store, vectors, state, inferred, index, report = incremental_update(
+        model, args.model, artifact, df, index=index, epochs=args.epochs, jobs=args.jobs, thresholds=thresholds)
+    save_update(args.artifact, store, vectors, state, inferred, index=index, index_path=args.index)
+
+    print(f'{report["changed"]} changed, {report["added"]} added, {report["deleted"]} deleted routes '
+          f'in {time.perf_counter() - start:.1f} s')
+    print(json.dumps(report['metrics'], indent=2))
+
+    if report['retrain']:
+        with open(args.schedule, 'w') as schedule_file:
+            json.dump(report, schedule_file, indent=2)
+        print(f'full retrain scheduled ({", ".join(report["retrain"])}), see {args.schedule}')
@@ -0,0 +1,111 @@
+import os
+import copy
+import zlib
+import pickle
+import collections
+import numpy as np
+
+
+class inference_cache(object):
+
+    """
+        size-bounded LRU cache of inferred query vectors
+
+        Keys are (token tuple, epochs, seed) so a cached vector is only reused for the same cleaned
+        query inferred the same way. Hits and misses are counted, and the cache can be saved to and
+        loaded from a pickle file so that a warm cache survives restarts.
+    """
+
+    def __init__(self, maxsize=4096):
+
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+
+        vector = self.entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return vector
+
+    def put(self, key, vector):
+
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)  # least recently used
+
+    def stats(self):
+
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def save(self, path):
+
+        with open(path, 'wb') as out:
+            pickle.dump(list(self.entries.items()), out)  # oldest first, so load restores the LRU order
+
+    @classmethod
+    def load(cls, path, maxsize=4096):
+
+        cache = cls(maxsize=maxsize)
+        if os.path.exists(path):
+            with open(path, 'rb') as cached:
+                for key, vector in pickle.load(cached):
+                    cache.put(key, vector)
+
+        return cache
+
+
+def seeded_model(model, seed, tokens):
+
+    """
+        a shallow copy of the model (sharing its vectors) with its own random state seeded from seed
+        and the query tokens, which makes infer_vector deterministic for a given query (independent of
+        which queries were inferred before it); the shared model's random state is never touched, so
+        concurrent queries and later training are unaffected
+    """
+
+    query_seed = (seed + zlib.crc32(' '.join(tokens).encode('utf-8'))) % 2**32
+    seeded = copy.copy(model)
+    if isinstance(model.random, np.random.RandomState):
+        seeded.random = np.random.RandomState(query_seed)
+    else:
+        seeded.random = np.random.default_rng(query_seed)
+
+    return seeded
+
+
+def infer_query_vector(model, tokens, epochs=1000, seed=None, cache=None):
+
+    """
+        model.infer_vector with an epoch budget, an optional seed for reproducible vectors, and an
+        optional inference_cache; tokens should come from clean_desc
+    """
+
+    key = (tuple(tokens), epochs, seed)
+    if cache is not None:
+        vector = cache.get(key)
+        if vector is not None:
+            return vector
+
+    if seed is not None:
+        model = seeded_model(model, seed, tokens)
+
+    vector = model.infer_vector(list(tokens), epochs=epochs)
+
+    if cache is not None:
+        cache.put(key, vector)
+
+    return vector
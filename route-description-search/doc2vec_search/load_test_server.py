@@ -0,0 +1,110 @@
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import numpy as np
+from urllib.parse import quote
+
+
+async def open_connection(host, port, unix_socket):
+
+    if unix_socket:
+        return await asyncio.open_unix_connection(unix_socket)
+
+    return await asyncio.open_connection(host, port)
+
+
+async def request(reader, writer, query, topn):
+
+    """
+        one keep-alive GET /search round trip, returns the HTTP status
+    """
+
+    writer.write(f'GET /search?q={quote(query)}&n={topn} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+
+    json.loads(await reader.readexactly(length))
+
+    return status
+
+
+async def client(host, port, unix_socket, queries, topn, deadline, latencies, errors):
+
+    reader, writer = await open_connection(host, port, unix_socket)
+    try:
+        for query in queries:
+            if time.perf_counter() > deadline:
+                break
+            start = time.perf_counter()
+            status = await request(reader, writer, query, topn)
+            latencies.append(1000 * (time.perf_counter() - start))
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_level(host, port, unix_socket, queries, concurrency, requests, topn, duration):
+
+    latencies, errors = [], []
+    per_client = max(1, requests // concurrency)
+    cycle = itertools.cycle(queries)
+    deadline = time.perf_counter() + duration
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, unix_socket, [next(cycle) for _ in range(per_client)], topn,
+                                  deadline, latencies, errors) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return latencies, errors, elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test the description search server')
+    parser.add_argument('-q', action='store', dest='queries', type=str,
+                        required=False, default='../validation_phrases.txt', help='a file with one query per line')
+    parser.add_argument('-c', action='store', dest='levels', type=int, nargs='+',
+                        required=False, default=[1, 2, 4, 8, 16, 32], help='the concurrency levels to test')
+    parser.add_argument('-r', action='store', dest='requests', type=int,
+                        required=False, default=200, help='the number of requests per concurrency level')
+    parser.add_argument('-t', action='store', dest='duration', type=float,
+                        required=False, default=60.0, help='the maximum seconds spent per concurrency level')
+    parser.add_argument('-n', action='store', dest='topn', type=int,
+                        required=False, default=3, help='the number of results per query')
+    parser.add_argument('--host', action='store', dest='host', type=str,
+                        required=False, default='127.0.0.1', help='the server host')
+    parser.add_argument('--port', action='store', dest='port', type=int,
+                        required=False, default=8080, help='the server port')
+    parser.add_argument('--unix', action='store', dest='unix', type=str,
+                        required=False, default=None, help='connect to this unix socket instead of TCP')
+    args = parser.parse_args()
+
+    with open(args.queries, 'r') as qf:
+        queries = [q.strip() for q in qf if q.strip()]
+
+    print('-'*78)
+    print('{:<13} {:<10} {:<8} {:<13} {:<10} {:<10} {:<10}'.format(
+        *['concurrency', 'requests', 'errors', 'req/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)']))
+    print('-'*78)
+
+    for concurrency in args.levels:
+
+        latencies, errors, elapsed = asyncio.run(run_level(args.host, args.port, args.unix, queries, concurrency,
+                                                           args.requests, args.topn, args.duration))
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (np.nan,)*3
+        line = [concurrency, len(latencies), len(errors), len(latencies) / elapsed, p50, p95, p99]
+        print('{:<13} {:<10} {:<8} {:<13.1f} {:<10.1f} {:<10.1f} {:<10.1f}'.format(*line))
+
+    print('-'*78)
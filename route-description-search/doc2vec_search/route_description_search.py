@@ -1,66 +1,58 @@
-import re
-import string
+import os
+import sys
 import math
-import pickle
-import gzip
-import pandas as pd
+import contextlib
 import numpy as np
 import warnings
 import argparse
 
 warnings.filterwarnings('ignore')
-from gensim.parsing.preprocessing import remove_stopwords
 from gensim.models import Doc2Vec
-from nltk import word_tokenize
-from geopy.geocoders import Nominatim
+from text_cleaning import clean_desc
+from vector_index import ivf_index, exact_search
+from route_store import load_search_data
+from inference_cache import inference_cache, infer_query_vector
+from sector_geocoder import nominatim_resolver, offline_resolver
+from batch_search import search_many, write_jsonl
 
 
-def clean_desc(desc):
-
-    """
-        cleans descriptions for use with doc2vec model
-    """
-
-    desc = str(desc).lower()  # lowercase
-    desc = remove_stopwords(desc)
-    desc = re.sub(r'\s+', ' ', desc)  # multiple spaces converted to single spaces
-    desc = re.sub('[0-9]', '', desc)  # remove digits
-    desc = re.sub(r'(?<=\w)-(?=\w)', ' ', desc)  # dash replaced with space
-    desc = re.sub(f'[{re.escape(string.punctuation)}]', '', desc)  # remove punctuation and special characters
-
-    tokens = word_tokenize(desc)
-    tokens = [t for t in tokens if len(t) > 1]  # remove short tokens
-
-    return tokens
-
-
-def description_search(model, desc, routeID_key, route_data, topn=3):
+def description_search(model, desc, store, topn=3, index=None, nprobe=None, epochs=1000, seed=None, cache=None):
 
     """
         model is the doc2vec model, desc is the description
-        returns all the data (contained in route_data) for the topn routes
+        returns all the data (contained in the route_store) for the topn routes
+        if an ivf_index is given it is searched (probing nprobe lists) instead of scanning model.dv
+        epochs is the inference budget, a seed makes the inferred vector (and so the ranking) reproducible,
+        and an inference_cache skips inference for queries that were already seen
     """
 
     tokens = clean_desc(desc)  # get the cleaned description
-    inferred_vector = model.infer_vector(tokens, epochs=1000)  # convert to a vector
-    sims = model.dv.most_similar(positive=[inferred_vector], topn=topn)
-    res = pd.DataFrame()
-    route_data.route_ID = route_data.route_ID.astype(int)
-
-    for doc_id, score in sims:  # make sure the routes are in the correct order
-
-        route_id = routeID_key[doc_id]
-        route = route_data.query(f'route_ID == {route_id}').copy()
-        route['score'] = score
-        res = pd.concat([res, route])
-
+    inferred_vector = infer_query_vector(model, tokens, epochs=epochs, seed=seed, cache=cache)  # convert to a vector
+
+    if index is not None:
+        sims = index.search(inferred_vector, topn=topn, nprobe=nprobe)
+    elif store.vectors is not None:
+        sims = exact_search(store.vectors, inferred_vector, topn=topn)
+    else:
+        sims = model.dv.most_similar(positive=[inferred_vector], topn=topn)
+
+    doc_ids = [doc_id for doc_id, _ in sims]  # sims are in rank order, take keeps that order
+    scores = [score for _, score in sims]
+    res = store.take(doc_ids, scores)
     res['query'] = desc
-    res.reset_index(drop=True, inplace=True)
 
     return res
 
 
-def print_search_results(res):
+def print_search_results(res, resolver=None):
+
+    """
+        prints the search results, resolver turns a result's coordinates into an address
+        (see sector_geocoder.py, the default looks addresses up online with Nominatim)
+    """
+
+    if resolver is None:
+        resolver = nominatim_resolver()
 
     query = res['query'].unique()[0]
     N = len(res)
@@ -79,11 +71,7 @@ def print_search_results(res):
         ceil = math.ceil(nc/100)
         lon, lat = row.parent_loc
 
-        geolocator = Nominatim(user_agent='http')
-        loc_str = f'{lat}, {lon}'
-        location = geolocator.reverse(loc_str)
-        display = location.raw['display_name']
-        address = ','.join(display.split(',')[0:-2])
+        address = resolver.address(lat, lon)
 
         print('-'*100)
         print(f'RESULT {i} (similarity = {sim}):')
@@ -104,15 +92,49 @@ if __name__ == '__main__':
                         required=False, default='guano', help='a hypothetical route description')
     parser.add_argument('-n', action='store', dest='topn', type=int,
                         required=False, default=3, help='the number of results to return')
+    queries = parser.add_mutually_exclusive_group()  # batch queries do not use a vector index
+    queries.add_argument('-i', action='store', dest='index', type=str,
+                         required=False, default=None, help='a vector index directory built by vector_index.py')
+    parser.add_argument('-p', action='store', dest='nprobe', type=int,
+                        required=False, default=None, help='the number of index lists to probe (recall/latency knob)')
+    parser.add_argument('-e', action='store', dest='epochs', type=int,
+                        required=False, default=1000, help='the number of inference epochs for the query')
+    parser.add_argument('-s', action='store', dest='seed', type=int,
+                        required=False, default=None, help='a seed for reproducible query vectors')
+    parser.add_argument('-c', action='store', dest='cache', type=str,
+                        required=False, default=None, help='a file for persisting the inferred vector cache')
+    queries.add_argument('-f', action='store', dest='queries', type=str,
+                         required=False, default=None, help='a file with one description per line (- for stdin), results are written as JSONL')
+    parser.add_argument('-j', action='store', dest='jobs', type=int,
+                        required=False, default=None, help='the number of worker processes for batch queries')
+    parser.add_argument('-a', action='store', dest='data', type=str,
+                        required=False, default='search_data.pkl.zip', help='the search data, or a search artifact directory')
+    parser.add_argument('-g', action='store', dest='addresses', type=str,
+                        required=False, default='sector_addresses.pkl.zip', help='the sector address table built by sector_geocoder.py')
     args = parser.parse_args()
+    if args.queries and args.nprobe is not None:
+        parser.error('argument -p: not allowed with argument -f')
 
     model = Doc2Vec.load('doc2vec.model')
 
-    with gzip.open('search_data.pkl.zip', 'rb') as key:
-        search_data = pickle.load(key)
+    store = load_search_data(args.data)
+    index = ivf_index.load(args.index) if args.index else None
+    cache = inference_cache.load(args.cache) if args.cache else None
+
+    if args.queries:
+
+        with contextlib.nullcontext(sys.stdin) if args.queries == '-' else open(args.queries, 'r') as query_file:
+            queries = (q.strip() for q in query_file if q.strip())
+            results = search_many(queries, store, model, model_path='doc2vec.model', topn=args.topn, jobs=args.jobs,
+                                  epochs=args.epochs, seed=args.seed, cache=cache)
+            write_jsonl(results, sys.stdout)
+
+    else:
 
-    route_data = search_data['route_data']
-    routeID_key = search_data['routeID_key']
+        res = description_search(model, args.desc, store, topn=args.topn, index=index, nprobe=args.nprobe,
+                                 epochs=args.epochs, seed=args.seed, cache=cache)
+        resolver = offline_resolver.load(args.addresses) if os.path.exists(args.addresses) else nominatim_resolver()
+        print_search_results(res, resolver=resolver)
 
-    res = description_search(model, args.desc, routeID_key, route_data, topn=args.topn)
-    print_search_results(res)
+    if cache is not None:
+        cache.save(args.cache)
@@ -0,0 +1,97 @@
+import os
+import gzip
+import pickle
+import numpy as np
+import pandas as pd
+
+
+class route_store(object):
+
+    """
+        route data laid out for search: doc tag -> row position is precomputed once, so the rows for
+        a list of search hits are gathered with a single positional take (no per-hit queries)
+    """
+
+    def __init__(self, route_data, doc_rows):
+
+        self.route_data = route_data  # one row per route, route_ID as int, default RangeIndex
+        self.doc_rows = doc_rows  # doc_rows[doc_id] is the row of that doc's route, -1 if missing
+        self.vectors = None  # search falls back to the model's doc vectors
+
+    def __len__(self):
+        return len(self.doc_rows)
+
+    @property
+    def n_routes(self):
+        return len(self.route_data)
+
+    @classmethod
+    def from_search_data(cls, route_data, routeID_key):
+
+        """
+            route_data is the route DataFrame and routeID_key maps doc tag -> route_ID
+            (both as stored in search_data.pkl.zip); neither input is modified
+        """
+
+        route_data = route_data.reset_index(drop=True)
+        route_data = route_data.assign(route_ID=route_data['route_ID'].astype(np.int64))
+
+        doc_ids = np.fromiter(routeID_key.keys(), dtype=np.int64, count=len(routeID_key))
+        doc_route_ids = np.fromiter((int(r) for r in routeID_key.values()), dtype=np.int64, count=len(routeID_key))
+
+        first = ~route_data['route_ID'].duplicated().values  # a route_ID maps to its first row
+        row_of_route = pd.Index(route_data['route_ID'].values[first])
+        pos = row_of_route.get_indexer(doc_route_ids)
+        rows = np.where(pos >= 0, np.flatnonzero(first)[pos], -1)
+
+        doc_rows = np.full(doc_ids.max() + 1 if len(doc_ids) else 0, -1, dtype=np.int64)
+        doc_rows[doc_ids] = rows
+
+        return cls(route_data, doc_rows)
+
+    def take(self, doc_ids, scores=None):
+
+        """
+            the route rows for doc_ids (in the given order), with an optional score column
+            doc ids whose route is missing from the route data are dropped
+        """
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = self.doc_rows[doc_ids]
+        found = rows >= 0
+
+        res = self.route_data.take(rows[found])
+        if scores is not None:
+            res['score'] = np.asarray(scores)[found]
+
+        return res.reset_index(drop=True)
+
+    def lookup(self, doc_ids, fields):
+
+        """
+            {field: list of values} for doc_ids (a 1d array), None where a doc has no route
+        """
+
+        rows = self.doc_rows[np.asarray(doc_ids, dtype=np.int64)]
+        found = (rows >= 0).tolist()
+        rows = np.where(rows >= 0, rows, 0)
+
+        return {f: [v if ok else None for v, ok in zip(self.route_data[f].to_numpy()[rows].tolist(), found)]
+                for f in fields}
+
+
+def load_search_data(path='search_data.pkl.zip'):
+
+    """
+        loads the gzip-pickled search data and builds the route store from it,
+        or opens a search artifact directory written by search_artifact.py
+    """
+
+    if os.path.isdir(path):
+        from search_artifact import search_artifact
+        return search_artifact.open(path)
+
+    with gzip.open(path, 'rb') as key:
+        search_data = pickle.load(key)
+
+    return route_store.from_search_data(search_data['route_data'], search_data['routeID_key'])
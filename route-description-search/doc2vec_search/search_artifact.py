@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from numbers import Number
+from vector_index import normalize_rows
+
+
+ARTIFACT_VERSION = 1
+
+
+class blob_column(object):
+
+    """
+        a column of JSON values stored as one utf-8 blob plus row offsets, both memory-mapped
+        rows are only decoded when taken, so opening the column reads nothing
+    """
+
+    def __init__(self, data, offsets):
+
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def take(self, rows):
+
+        data, offsets = self.data, self.offsets
+        return [json.loads(data[offsets[r]:offsets[r + 1]].tobytes().decode('utf-8')) for r in rows]
+
+    @staticmethod
+    def write(values, path, name):
+
+        offsets = [0]
+        with open(os.path.join(path, f'{name}.blob'), 'wb') as blob:
+            for value in values:
+                # default= converts numpy scalars stored in object columns
+                encoded = json.dumps(value, ensure_ascii=False, default=lambda o: o.item()).encode('utf-8')
+                blob.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+
+        np.save(os.path.join(path, f'{name}.offsets.npy'), np.array(offsets, dtype=np.int64))
+
+    @classmethod
+    def open(cls, path, name):
+
+        offsets = np.load(os.path.join(path, f'{name}.offsets.npy'), mmap_mode='r')
+        if offsets[-1] > 0:
+            data = np.memmap(os.path.join(path, f'{name}.blob'), dtype=np.uint8, mode='r', shape=(int(offsets[-1]),))
+        else:
+            data = np.empty(0, dtype=np.uint8)
+
+        return cls(data, offsets)
+
+
+def column_kind(values):
+
+    """
+        'array' for numeric columns, 'pairs' for (lon, lat)-style columns of numeric 2-tuples and
+        'blob' for everything else (strings, lists of paragraphs, None)
+    """
+
+    if values.dtype.kind in 'biuf':
+        return 'array'
+
+    def is_pair(v):
+        return isinstance(v, (list, tuple)) and len(v) == 2 and all(isinstance(x, Number) for x in v)
+
+    if len(values) and all(is_pair(v) for v in values):
+        return 'pairs'
+
+    return 'blob'
+
+
+class search_artifact(object):
+
+    """
+        the search data as a versioned directory of memory-mapped files:
+
+            manifest.json         version, sizes and the column layout
+            vectors.npy           unit-normalized float32 doc vectors, row i is doc tag i
+            doc_rows.npy          doc tag -> route row, -1 if the doc has no route
+            <column>.npy          numeric columns, and (n, 2) float64 arrays for coordinate pairs
+            <column>.blob         other columns as concatenated JSON values ...
+            <column>.offsets.npy  ... with row i at blob[offsets[i]:offsets[i+1]]
+
+        Opening it only parses the manifest; the arrays are paged in on first use and the vectors are
+        shared through the page cache by every process that opens the same artifact. Has the same
+        search interface as route_store (doc_rows, take, lookup, n_routes) plus the vectors.
+    """
+
+    def __init__(self, path, manifest, vectors, doc_rows, columns):
+
+        self.path = path
+        self.manifest = manifest
+        self.vectors = vectors
+        self.doc_rows = doc_rows
+        self.columns = columns  # name -> memmapped array or blob_column, in manifest order
+
+    def __len__(self):
+        return len(self.doc_rows)
+
+    @property
+    def n_routes(self):
+        return self.manifest['n_routes']
+
+    def column_values(self, name, rows):
+
+        column, kind = self.columns[name], self.manifest['columns'][name]
+        if kind == 'blob':
+            return column.take(rows)
+        if kind == 'pairs':
+            return [tuple(pair) for pair in column[rows].tolist()]
+
+        return column[rows]
+
+    def take(self, doc_ids, scores=None):
+
+        """
+            the route rows for doc_ids (in the given order) as a DataFrame, with an optional score
+            column; doc ids whose route is missing are dropped
+        """
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = self.doc_rows[doc_ids]
+        found = rows >= 0
+
+        res = pd.DataFrame({name: self.column_values(name, rows[found]) for name in self.columns})
+        if scores is not None:
+            res['score'] = np.asarray(scores)[found]
+
+        return res
+
+    def lookup(self, doc_ids, fields):
+
+        """
+            {field: list of values} for doc_ids (a 1d array), None where a doc has no route
+        """
+
+        rows = self.doc_rows[np.asarray(doc_ids, dtype=np.int64)]
+        found = (rows >= 0).tolist()
+        rows = np.where(rows >= 0, rows, 0)
+
+        def values(name):
+            taken = self.column_values(name, rows)
+            return taken.tolist() if isinstance(taken, np.ndarray) else taken
+
+        return {f: [v if ok else None for v, ok in zip(values(f), found)] for f in fields}
+
+    @classmethod
+    def open(cls, path):
+
+        with open(os.path.join(path, 'manifest.json'), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['version'] != ARTIFACT_VERSION:
+            raise ValueError(f'{path} is a version {manifest["version"]} search artifact, '
+                             f'this code reads version {ARTIFACT_VERSION}')
+
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        doc_rows = np.load(os.path.join(path, 'doc_rows.npy'), mmap_mode='r')
+
+        columns = {}
+        for name, kind in manifest['columns'].items():
+            if kind == 'blob':
+                columns[name] = blob_column.open(path, name)
+            else:
+                columns[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+        return cls(path, manifest, vectors, doc_rows, columns)
+
+
+def write_artifact(path, store, vectors):
+
+    """
+        writes a route_store and the model's doc vectors (model.dv.vectors) as a search artifact
+        only routes some doc points to are kept; the manifest is written last, so a partly written
+        directory fails to open instead of opening with missing columns; an artifact already at path
+        is replaced as a whole (including any incremental update state kept in it)
+    """
+
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    doc_rows = np.asarray(store.doc_rows, dtype=np.int64)
+    if len(doc_rows) < len(vectors):  # docs past the last tagged route have no route
+        doc_rows = np.concatenate([doc_rows, np.full(len(vectors) - len(doc_rows), -1, dtype=np.int64)])
+
+    kept = np.unique(doc_rows[doc_rows >= 0])
+    new_rows = np.full(len(store.route_data), -1, dtype=np.int64)
+    new_rows[kept] = np.arange(len(kept))
+    doc_rows = np.where(doc_rows >= 0, new_rows[np.maximum(doc_rows, 0)], -1)
+
+    route_data = store.route_data.take(kept).reset_index(drop=True)
+
+    np.save(os.path.join(path, 'vectors.npy'), normalize_rows(vectors))
+    np.save(os.path.join(path, 'doc_rows.npy'), doc_rows)
+
+    columns = {}
+    for name in route_data.columns:
+
+        values = route_data[name].to_numpy()
+        kind = column_kind(values)
+        if kind == 'array':
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        elif kind == 'pairs':
+            np.save(os.path.join(path, f'{name}.npy'), np.array(values.tolist(), dtype=np.float64).reshape(-1, 2))
+        else:
+            blob_column.write(values.tolist(), path, name)
+        columns[name] = kind
+
+    manifest = {'version': ARTIFACT_VERSION, 'n_docs': len(doc_rows), 'n_routes': len(route_data),
+                'dim': int(vectors.shape[1]), 'columns': columns}
+    with open(os.path.join(path, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    return search_artifact.open(path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert the gzip-pickled search data to a search artifact')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='search_data.pkl.zip', help='the gzip-pickled search data')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='search_artifact', help='the artifact directory')
+    args = parser.parse_args()
+
+    from gensim.models import Doc2Vec
+    from route_store import load_search_data
+
+    start = time.perf_counter()
+    store = load_search_data(args.data)
+    print(f'pickled search data loaded in {1000 * (time.perf_counter() - start):.0f} ms')
+
+    model = Doc2Vec.load(args.model)
+    write_artifact(args.out, store, model.dv.vectors)
+
+    start = time.perf_counter()
+    artifact = search_artifact.open(args.out)
+    print(f'search artifact opened in {1000 * (time.perf_counter() - start):.1f} ms')
+    print(f'{artifact.n_routes} routes, {len(artifact)} docs written to {args.out}')
@@ -0,0 +1,207 @@
+import json
+import time
+import asyncio
+import argparse
+import warnings
+from urllib.parse import urlsplit, parse_qs
+
+warnings.filterwarnings('ignore')
+from gensim.models import Doc2Vec
+from text_cleaning import clean_desc
+from route_store import load_search_data
+from vector_index import ivf_index, exact_search, normalize_rows
+from inference_cache import inference_cache
+from batch_search import inference_pool, infer_in_worker
+
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class search_service(object):
+
+    """
+        resident description search: the model, route store and (optional) vector index are loaded
+        once and kept warm, query cleaning and inference run in a process pool and vector scoring
+        runs in a thread, so the event loop only parses requests and writes responses
+    """
+
+    def __init__(self, model, store, index=None, nprobe=None, model_path='doc2vec.model', jobs=None,
+                 epochs=1000, seed=None, cache_size=4096, fields=('route_ID', 'route_name', 'type_string')):
+
+        self.model = model
+        self.store = store
+        self.index = index
+        self.nprobe = nprobe
+        self.epochs = epochs
+        self.seed = seed
+        self.fields = list(fields)
+        self.cache = inference_cache(maxsize=cache_size)
+        self.normed_vectors = None
+        if index is None:
+            self.normed_vectors = store.vectors if store.vectors is not None else normalize_rows(model.dv.vectors)
+        self.pool = inference_pool(model, model_path=model_path, jobs=jobs)
+        self.pool.submit(len, ()).result()  # start the workers now, before the event loop and its threads exist
+        self.started = time.time()
+        self.requests = 0
+
+    def close(self):
+        self.pool.shutdown()
+
+    def score(self, vector, topn):
+
+        if self.index is not None:
+            sims = self.index.search(vector, topn=topn, nprobe=self.nprobe)
+        else:
+            sims = exact_search(self.normed_vectors, vector, topn=topn)
+
+        res = self.store.take([d for d, _ in sims], [s for _, s in sims])
+
+        return res[self.fields + ['score']].to_dict('records')
+
+    async def search(self, query, topn):
+
+        loop = asyncio.get_running_loop()
+        tokens = await loop.run_in_executor(self.pool, clean_desc, query)
+
+        key = (tuple(tokens), self.epochs, self.seed)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await loop.run_in_executor(self.pool, infer_in_worker, (tokens, self.epochs, self.seed))
+            self.cache.put(key, vector)
+
+        results = await loop.run_in_executor(None, self.score, vector, topn)
+
+        return {'query': query, 'results': results}
+
+    def health(self):
+
+        return {'status': 'ok', 'routes': self.store.n_routes, 'docs': len(self.model.dv),
+                'index': self.index is not None, 'uptime_s': round(time.time() - self.started, 1),
+                'requests': self.requests, 'cache': self.cache.stats()}
+
+    async def route(self, method, target, body):
+
+        url = urlsplit(target)
+
+        if url.path == '/health':
+            return 200, self.health()
+
+        if url.path != '/search':
+            return 404, {'error': f'unknown path {url.path}'}
+
+        if method == 'GET':
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        elif method == 'POST':
+            params = json.loads(body or b'{}')
+            if not isinstance(params, dict):
+                raise ValueError('the request body must be a JSON object')
+        else:
+            return 405, {'error': f'{method} is not supported'}
+
+        query = params.get('q', params.get('query'))
+        if not query:
+            return 400, {'error': 'a query is required (q=...)'}
+
+        self.requests += 1
+        return 200, await self.search(query, int(params.get('n', params.get('topn', 3))))
+
+    async def handle(self, reader, writer):
+
+        """
+            a minimal HTTP/1.1 connection handler with keep-alive
+        """
+
+        try:
+            while True:
+
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, _ = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, payload = await self.route(method, target, body)
+                except (ValueError, TypeError) as err:
+                    status, payload = 400, {'error': str(err)}
+                except Exception as err:
+                    status, payload = 500, {'error': repr(err)}
+
+                data = json.dumps(payload, default=lambda x: x.item() if hasattr(x, 'item') else str(x)).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                        'Content-Type: application/json\r\n'
+                        f'Content-Length: {len(data)}\r\n'
+                        f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+
+                writer.write(head.encode('latin-1') + data)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8080, unix_socket=None):
+
+    if unix_socket:
+        server = await asyncio.start_unix_server(service.handle, path=unix_socket)
+        print(f'serving on unix socket {unix_socket}')
+    else:
+        server = await asyncio.start_server(service.handle, host=host, port=port)
+        print(f'serving on http://{host}:{port}')
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the description search as a long-running HTTP service')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='search_data.pkl.zip', help='the search data, or a search artifact directory')
+    parser.add_argument('-i', action='store', dest='index', type=str,
+                        required=False, default=None, help='a vector index directory built by vector_index.py')
+    parser.add_argument('-p', action='store', dest='nprobe', type=int,
+                        required=False, default=None, help='the number of index lists to probe')
+    parser.add_argument('-j', action='store', dest='jobs', type=int,
+                        required=False, default=None, help='the number of inference worker processes')
+    parser.add_argument('-e', action='store', dest='epochs', type=int,
+                        required=False, default=1000, help='the number of inference epochs per query')
+    parser.add_argument('-s', action='store', dest='seed', type=int,
+                        required=False, default=None, help='a seed for reproducible query vectors')
+    parser.add_argument('--host', action='store', dest='host', type=str,
+                        required=False, default='127.0.0.1', help='the host to bind')
+    parser.add_argument('--port', action='store', dest='port', type=int,
+                        required=False, default=8080, help='the port to bind')
+    parser.add_argument('--unix', action='store', dest='unix', type=str,
+                        required=False, default=None, help='serve on this unix socket instead of TCP')
+    args = parser.parse_args()
+
+    model = Doc2Vec.load(args.model)
+    store = load_search_data(args.data)
+    index = ivf_index.load(args.index) if args.index else None
+
+    service = search_service(model, store, index=index, nprobe=args.nprobe, model_path=args.model,
+                             jobs=args.jobs, epochs=args.epochs, seed=args.seed)
+    try:
+        asyncio.run(serve(service, host=args.host, port=args.port, unix_socket=args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
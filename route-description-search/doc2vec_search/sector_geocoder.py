@@ -0,0 +1,141 @@
+import os
+import gzip
+import time
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class stub_resolver(object):
+
+    """
+        offline resolver that just formats the coordinates, for tests and for runs without address data
+    """
+
+    def address(self, lat, lon):
+        return f'{lat:.4f}, {lon:.4f}'
+
+
+class nominatim_resolver(object):
+
+    """
+        online resolver using Nominatim reverse geocoding (one network call per lookup)
+    """
+
+    def __init__(self, user_agent='http', min_delay=1.0):
+
+        from geopy.geocoders import Nominatim
+
+        self.geolocator = Nominatim(user_agent=user_agent)
+        self.min_delay = min_delay  # Nominatim's usage policy allows one request per second
+        self.last_call = 0.0
+
+    def address(self, lat, lon):
+
+        wait = self.min_delay - (time.time() - self.last_call)
+        if wait > 0:
+            time.sleep(wait)
+        self.last_call = time.time()
+
+        location = self.geolocator.reverse(f'{lat}, {lon}')
+        if location is None:
+            return None
+
+        display = location.raw['display_name']
+        return ','.join(display.split(',')[0:-2])  # drop the postcode and country
+
+
+def unit_vectors(lats, lons):
+
+    """
+        points on the unit sphere, so euclidean nearest neighbours are great-circle nearest neighbours
+    """
+
+    lat, lon = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class offline_resolver(object):
+
+    """
+        resolves coordinates from a precomputed sector address table with a KD-tree, the nearest
+        sector within max_km gives the address, anything further falls back to the fallback resolver
+    """
+
+    def __init__(self, table, max_km=2.0, fallback=None):
+
+        from scipy.spatial import cKDTree
+
+        table = table.dropna(subset=['address']).reset_index(drop=True)
+        self.addresses = table['address'].to_numpy()
+        self.tree = cKDTree(unit_vectors(table['lat'].to_numpy(), table['lon'].to_numpy()))
+        self.max_chord = 2 * np.sin(max_km / (2 * EARTH_RADIUS_KM))
+        self.fallback = fallback or stub_resolver()
+
+    @classmethod
+    def load(cls, path='sector_addresses.pkl.zip', **kwargs):
+        return cls(pd.read_pickle(path, compression='gzip'), **kwargs)
+
+    def address(self, lat, lon):
+
+        if len(self.addresses) == 0:
+            return self.fallback.address(lat, lon)
+
+        dist, i = self.tree.query(unit_vectors([lat], [lon])[0])
+        if dist > self.max_chord:
+            return self.fallback.address(lat, lon)
+
+        return self.addresses[i]
+
+
+def build_sector_addresses(route_data, resolver, table=None, save_path=None, save_every=100):
+
+    """
+        reverse geocodes every distinct parent_loc (lon, lat) in route_data once
+        an existing table is extended rather than rebuilt, and progress is saved every save_every lookups
+    """
+
+    locs = np.array(route_data['parent_loc'].tolist(), dtype=np.float64)
+    locs = np.unique(locs[~np.isnan(locs).any(axis=1)], axis=0)
+
+    if table is None:
+        table = pd.DataFrame({'lat': pd.Series(dtype=float), 'lon': pd.Series(dtype=float), 'address': pd.Series(dtype=object)})
+
+    done = set(zip(table['lon'], table['lat']))
+    todo = [(lon, lat) for lon, lat in locs if (lon, lat) not in done]
+    print(f'{len(locs)} sector locations, {len(todo)} to resolve')
+
+    rows = []
+    for i, (lon, lat) in enumerate(todo):
+
+        rows.append({'lat': lat, 'lon': lon, 'address': resolver.address(lat, lon)})
+
+        if save_path and (i + 1) % save_every == 0:
+            pd.concat([table, pd.DataFrame(rows)], ignore_index=True).to_pickle(save_path, compression='gzip')
+
+    table = pd.concat([table, pd.DataFrame(rows)], ignore_index=True)
+    if save_path:
+        table.to_pickle(save_path, compression='gzip')
+
+    return table
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Precompute the sector address table used for offline result addresses')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='search_data.pkl.zip', help='the search data')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='sector_addresses.pkl.zip', help='the output address table')
+    args = parser.parse_args()
+
+    with gzip.open(args.data, 'rb') as key:
+        route_data = pickle.load(key)['route_data']
+
+    table = pd.read_pickle(args.out, compression='gzip') if os.path.exists(args.out) else None
+    table = build_sector_addresses(route_data, nominatim_resolver(), table=table, save_path=args.out)
+    print(f'{len(table)} sector addresses saved to {args.out}')
@@ -0,0 +1,92 @@
+import re
+import string
+from nltk import word_tokenize
+from gensim.parsing.preprocessing import STOPWORDS
+
+
+# the cleaning steps, compiled once; the order matters (digits go before the dash rule, which sees \w around the dash)
+WHITESPACE_RE = re.compile(r'\s+')  # multiple spaces converted to single spaces
+DIGITS_TABLE = str.maketrans('', '', '0123456789')  # remove digits
+DASH_RE = re.compile(r'(?<=\w)-(?=\w)')  # dash replaced with space
+PUNCT_TABLE = str.maketrans('', '', string.punctuation)  # remove punctuation and special characters
+
+
+TOKENIZERS = {'nltk': word_tokenize, 'whitespace': str.split}
+
+CLEANING_VERSION = 1  # bump whenever a change here changes the tokens, so token caches built with the old code are rebuilt
+
+
+def normalize_text(desc, keep_stopwords=False):
+
+    """
+        the text part of cleaning: lowercase, optional stopword removal, whitespace collapsed to single
+        spaces, digits removed and word-internal dashes replaced with spaces; punctuation is left in
+    """
+
+    desc = str(desc).lower()  # lowercase
+    if keep_stopwords:
+        desc = WHITESPACE_RE.sub(' ', desc)
+    else:
+        desc = ' '.join(w for w in desc.split() if w not in STOPWORDS)  # same as gensim's remove_stopwords
+
+    desc = desc.translate(DIGITS_TABLE)
+
+    return DASH_RE.sub(' ', desc)
+
+
+def clean_desc(desc, keep_stopwords=False, tokenizer='nltk'):
+
+    """
+        cleans descriptions for use with the doc2vec and word2vec models
+
+        tokenizer='nltk' (the default) gives the tokens the models were trained on, 'whitespace' is a
+        much faster split that differs from nltk only on non-ascii punctuation such as curly quotes
+    """
+
+    desc = normalize_text(desc, keep_stopwords=keep_stopwords).translate(PUNCT_TABLE)
+    tokens = TOKENIZERS[tokenizer](desc)
+
+    return [t for t in tokens if len(t) > 1]  # remove short tokens
+
+
+def clean_sentences(desc, keep_stopwords=True, tokenizer='nltk'):
+
+    """
+        cleans a description and splits it into sentences (token lists), as used for word2vec training
+    """
+
+    tokenize = TOKENIZERS[tokenizer]
+    sentences = normalize_text(desc, keep_stopwords=keep_stopwords).split('. ')
+
+    return [[t for t in tokenize(s.translate(PUNCT_TABLE)) if len(t) > 1] for s in sentences]
+
+
+def join_description(description):
+
+    """
+        descriptions in the curated data are lists of paragraphs
+    """
+
+    return ' '.join(description) if isinstance(description, (list, tuple)) else description
+
+
+def clean_series(descriptions, keep_stopwords=False, tokenizer='nltk'):
+
+    """
+        batch version of clean_desc for a pandas Series of descriptions (strings or lists of paragraphs)
+        lowercasing, digit, dash and punctuation removal run as vectorized string operations over the
+        whole Series, returns a list of token lists in the Series' order
+    """
+
+    text = descriptions.map(join_description).astype(str).str.lower()
+    if keep_stopwords:
+        text = text.str.replace(WHITESPACE_RE, ' ', regex=True)
+    else:
+        text = text.str.split().map(lambda ws: ' '.join(w for w in ws if w not in STOPWORDS))
+
+    text = text.str.translate(DIGITS_TABLE)
+    text = text.str.replace(DASH_RE, ' ', regex=True).str.translate(PUNCT_TABLE)
+
+    tokenize = TOKENIZERS[tokenizer]
+
+    return [[t for t in tokenize(desc) if len(t) > 1] for desc in text]
@@ -0,0 +1,233 @@
+import os
+import json
+import argparse
+import numpy as np
+
+
+INDEX_VERSION = 1
+
+
+def normalize_rows(vectors):
+
+    """
+        returns a float32 copy of vectors with unit-length rows (zero rows are left as zeros)
+    """
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+
+    return vectors / norms
+
+
+def top_k(scores, topn):
+
+    """
+        positions and scores of the topn largest entries of a 1d score array, best first
+    """
+
+    topn = min(topn, len(scores))
+    if topn <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+
+    part = np.argpartition(-scores, topn - 1)[:topn]  # unordered topn, O(N)
+    order = part[np.argsort(-scores[part], kind='stable')]
+
+    return order, scores[order]
+
+
+def exact_search(normed_vectors, query, topn=3):
+
+    """
+        brute-force cosine search over unit-normalized doc vectors
+        returns a list of (doc_id, similarity) like model.dv.most_similar
+    """
+
+    query = normalize_rows(query)
+    scores = normed_vectors @ query
+    doc_ids, sims = top_k(scores, topn)
+
+    return [(int(d), float(s)) for d, s in zip(doc_ids, sims)]
+
+
+def spherical_kmeans(vectors, n_lists, n_iter=20, seed=0, sample_size=100000, chunk_size=65536):
+
+    """
+        k-means on the unit sphere (assignment by maximum dot product), fit on a random sample
+        of the unit-normalized vectors, returns the unit-normalized centroids
+    """
+
+    rng = np.random.RandomState(seed)
+    if len(vectors) > sample_size:
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    else:
+        sample = np.asarray(vectors)
+
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+
+        assign = assign_lists(sample, centroids, chunk_size=chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=n_lists)
+
+        empty = counts == 0  # re-seed empty lists with random sample points
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+
+    """
+        index of the closest centroid (by dot product) for every row of vectors, computed in chunks
+    """
+
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        block = np.asarray(vectors[start:start + chunk_size])
+        assign[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+
+    return assign
+
+
+class ivf_index(object):
+
+    """
+        inverted-file (IVF) approximate nearest neighbour index over unit-normalized doc vectors
+
+        The vectors are clustered with spherical k-means and stored contiguously, grouped by list,
+        so a query only scans the nprobe lists whose centroids are closest to it. nprobe is the
+        recall/latency knob: nprobe = n_lists is an exact search, small nprobe is fast but may miss
+        neighbours that fall in other lists. All arrays are plain .npy files and are memory-mapped
+        when loaded, so several processes share one copy through the page cache.
+    """
+
+    def __init__(self, centroids, vectors, doc_ids, offsets, nprobe=8):
+
+        self.centroids = centroids  # (n_lists, dim), unit length
+        self.vectors = vectors  # (n_docs, dim), unit length, ordered by list
+        self.doc_ids = doc_ids  # (n_docs,), original doc tag of each row in vectors
+        self.offsets = offsets  # (n_lists + 1,), rows of list i are offsets[i]:offsets[i+1]
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_iter=20, seed=0, nprobe=8):
+
+        """
+            builds the index from raw doc vectors (e.g. model.dv.vectors), row i is doc tag i
+        """
+
+        normed = normalize_rows(vectors)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(normed))))  # common IVF rule of thumb
+        n_lists = min(n_lists, len(normed))
+
+        centroids = spherical_kmeans(normed, n_lists, n_iter=n_iter, seed=seed)
+
+        return cls.from_centroids(centroids, normed, np.arange(len(normed)), nprobe=nprobe)
+
+    @classmethod
+    def from_centroids(cls, centroids, normed, doc_ids, nprobe=8):
+
+        """
+            lists the unit-normalized vectors of doc_ids (normed row i is doc tag doc_ids[i]) under
+            their closest centroid
+        """
+
+        assign = assign_lists(normed, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(centroids, normed[order], np.asarray(doc_ids, dtype=np.int64)[order], offsets, nprobe=nprobe)
+
+    def reassign(self, vectors, live=None):
+
+        """
+            a new index over vectors (row i is doc tag i) that keeps this index's centroids, so docs
+            can be added, replaced or removed (live[i] False) without clustering again
+        """
+
+        doc_ids = np.arange(len(vectors)) if live is None else np.flatnonzero(live)
+        normed = normalize_rows(np.asarray(vectors)[doc_ids])
+
+        return ivf_index.from_centroids(np.asarray(self.centroids), normed, doc_ids, nprobe=self.nprobe)
+
+    def save(self, path):
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(path, 'doc_ids.npy'), self.doc_ids)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+
+        meta = {'version': INDEX_VERSION, 'n_docs': len(self), 'n_lists': self.n_lists,
+                'dim': int(self.vectors.shape[1]), 'nprobe': self.nprobe}
+        with open(os.path.join(path, 'index.json'), 'w') as out:
+            json.dump(meta, out, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+
+        with open(os.path.join(path, 'index.json'), 'r') as meta_file:
+            meta = json.load(meta_file)
+
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f'index at {path} has version {meta["version"]}, expected {INDEX_VERSION}')
+
+        mode = 'r' if mmap else None
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+                  for name in ('centroids', 'vectors', 'doc_ids', 'offsets')]
+
+        return cls(*arrays, nprobe=meta['nprobe'])
+
+    def search(self, query, topn=3, nprobe=None):
+
+        """
+            approximate cosine search, returns a list of (doc_id, similarity) like model.dv.most_similar
+        """
+
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        query = normalize_rows(query)
+
+        lists, _ = top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        scores = self.vectors[rows] @ query
+        best, sims = top_k(scores, topn)
+
+        return [(int(d), float(s)) for d, s in zip(self.doc_ids[rows[best]], sims)]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build an IVF vector index from the doc2vec model')
+    parser.add_argument('-m', action='store', dest='model', type=str,
+                        required=False, default='doc2vec.model', help='the doc2vec model to index')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='doc2vec_index', help='the output index directory')
+    parser.add_argument('-l', action='store', dest='n_lists', type=int,
+                        required=False, default=None, help='the number of inverted lists (default 4*sqrt(N))')
+    parser.add_argument('-p', action='store', dest='nprobe', type=int,
+                        required=False, default=8, help='the default number of lists probed per query')
+    args = parser.parse_args()
+
+    from gensim.models import Doc2Vec
+
+    model = Doc2Vec.load(args.model)
+    index = ivf_index.build(model.dv.vectors, n_lists=args.n_lists, nprobe=args.nprobe)
+    index.save(args.out)
+
+    print(f'indexed {len(index)} doc vectors into {index.n_lists} lists, saved to {args.out}')
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import hashlib
+import resource
+import contextlib
+import numpy as np
+import gensim
+from doc2vec_search.text_cleaning import CLEANING_VERSION
+from concurrent.futures import ProcessPoolExecutor
+
+
+CACHE_VERSION = 1
+
+
+class token_cache(object):
+
+    """
+        a tokenized corpus stored on disk as one int32 token-id array plus item offsets
+
+        Item i (a document or a sentence) is ids[offsets[i]:offsets[i+1]], decoded through vocab.
+        Both arrays are memory-mapped when opened, so iterating over the corpus (every epoch, every
+        phrase pass) never holds more than the current item as Python strings.
+    """
+
+    def __init__(self, path, ids, offsets, vocab, key=None):
+
+        self.path = path
+        self.ids = ids
+        self.offsets = offsets
+        self.vocab = np.array(vocab, dtype=object)
+        self.key = key
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.vocab[self.ids[self.offsets[i]:self.offsets[i + 1]]].tolist()
+
+    def __iter__(self):
+
+        vocab, ids, offsets = self.vocab, self.ids, self.offsets
+        for i in range(len(self)):
+            yield vocab[ids[offsets[i]:offsets[i + 1]]].tolist()
+
+    @property
+    def n_tokens(self):
+        return int(self.offsets[-1])
+
+    @classmethod
+    def build(cls, token_lists, path, key=None, buffer_size=1 << 20):
+
+        """
+            writes the token lists (any iterable, consumed once) to path, returns the opened cache
+        """
+
+        os.makedirs(path, exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):  # an interrupted build must not leave the old metadata valid
+            os.remove(os.path.join(path, 'cache.json'))
+        vocab, offsets, buffer = {}, [0], []
+
+        with open(os.path.join(path, 'ids.bin'), 'wb') as ids_file:
+            for tokens in token_lists:
+                buffer.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+                offsets.append(offsets[-1] + len(tokens))
+                if len(buffer) >= buffer_size:
+                    ids_file.write(np.array(buffer, dtype=np.int32).tobytes())
+                    buffer = []
+            ids_file.write(np.array(buffer, dtype=np.int32).tobytes())
+
+        np.array(offsets, dtype=np.int64).tofile(os.path.join(path, 'offsets.bin'))
+        with open(os.path.join(path, 'vocab.json'), 'w') as vocab_file:
+            json.dump(list(vocab), vocab_file)  # dicts keep insertion order, so position == id
+        with open(os.path.join(path, 'cache.json.tmp'), 'w') as meta_file:
+            json.dump({'version': CACHE_VERSION, 'key': key, 'n_items': len(offsets) - 1,
+                       'n_tokens': offsets[-1], 'vocab_size': len(vocab)}, meta_file, indent=2)
+        # the metadata is written last, so it only exists once the arrays are complete
+        os.replace(os.path.join(path, 'cache.json.tmp'), os.path.join(path, 'cache.json'))
+
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+
+        with open(os.path.join(path, 'cache.json'), 'r') as meta_file:
+            meta = json.load(meta_file)
+        with open(os.path.join(path, 'vocab.json'), 'r') as vocab_file:
+            vocab = json.load(vocab_file)
+
+        if meta['n_tokens'] > 0:
+            ids = np.memmap(os.path.join(path, 'ids.bin'), dtype=np.int32, mode='r', shape=(meta['n_tokens'],))
+        else:
+            ids = np.empty(0, dtype=np.int32)
+        offsets = np.memmap(os.path.join(path, 'offsets.bin'), dtype=np.int64, mode='r', shape=(meta['n_items'] + 1,))
+
+        return cls(path, ids, offsets, vocab, key=meta['key'])
+
+    @classmethod
+    def open_or_build(cls, token_lists_fn, path, key=None, rebuild=False):
+
+        """
+            reuses the cache at path if it was built with the same key, otherwise builds it from
+            token_lists_fn() (a callable, so nothing is tokenized when the cache is reused)
+        """
+
+        if not rebuild and os.path.exists(os.path.join(path, 'cache.json')):
+            cache = cls.open(path)
+            if cache.key == key:
+                return cache
+
+        return cls.build(token_lists_fn(), path, key=key)
+
+
+class tagged_corpus(object):
+
+    """
+        re-iterable doc2vec corpus over a token_cache, item i is tagged [i]
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, i):
+        return gensim.models.doc2vec.TaggedDocument(self.cache[i], [i])
+
+    def __iter__(self):
+        for i, words in enumerate(self.cache):
+            yield gensim.models.doc2vec.TaggedDocument(words, [i])
+
+
+class phrased_corpus(object):
+
+    """
+        re-iterable corpus that applies phrase models (in order) to every sentence as it is read; the phrasing is
+        repeated on every pass, so for a corpus read many times write it once to a token_cache
+    """
+
+    def __init__(self, sentences, phrasers):
+
+        self.sentences = sentences
+        self.phrasers = phrasers
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def __iter__(self):
+        for sentence in self.sentences:
+            for phraser in self.phrasers:
+                sentence = phraser[sentence]
+            yield sentence
+
+
+def parallel_tokenize(descriptions, shard_fn, jobs=1, shard_size=5000):
+
+    """
+        splits a Series of descriptions into shards, runs shard_fn (a picklable function returning a
+        list of token lists for a shard) over them in a process pool and yields the token lists in the
+        original order, so doc tags assigned by position are the same for any number of jobs
+    """
+
+    shards = (descriptions.iloc[i:i + shard_size] for i in range(0, len(descriptions), shard_size))
+
+    if jobs == 1:
+        for shard in shards:
+            yield from shard_fn(shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for tokens in pool.map(shard_fn, shards):  # map returns results in submission order
+            yield from tokens
+
+
+@contextlib.contextmanager
+def timed_stage(name, timings):
+
+    """
+        times the enclosed block, prints it and records it in the timings dict
+    """
+
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+    print(f'[{name}: {timings[name]:.1f} s]')
+
+
+def print_timings(timings):
+
+    print('{:<25} {:<10}'.format(*['stage', 'seconds']))
+    print('------------------------------------')
+    for name, seconds in timings.items():
+        print('{:<25} {:<10.1f}'.format(*[name, seconds]))
+    print('------------------------------------')
+    print()
+
+
+def corpus_key(route_ids, descriptions, **options):
+
+    """
+        identifies the routes, their descriptions, the cleaning code version and the cleaning options a
+        token cache was built from, so an edited description or changed cleaning never reuses stale tokens
+    """
+
+    digest = hashlib.sha1()
+    for route_id, description in zip(route_ids, descriptions):
+        digest.update(f'{route_id}\t{description}\n'.encode('utf-8'))
+
+    return ' '.join([digest.hexdigest(), f'cleaning={CLEANING_VERSION}'] + [f'{k}={v}' for k, v in sorted(options.items())])
+
+
+def peak_rss_mb():
+
+    """
+        peak resident set size of this process so far, in MB (ru_maxrss is in KB on Linux)
+    """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
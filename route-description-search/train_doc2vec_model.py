@@ -1,109 +1,90 @@
-import re
-import string
+import os
 import pickle
+import argparse
 import gensim
-import collections
-import random
 import pandas as pd
-import numpy as np
-from nltk import word_tokenize
-from gensim.parsing.preprocessing import remove_stopwords
+from doc2vec_search.text_cleaning import clean_desc, clean_series
+from token_corpus import token_cache, tagged_corpus, corpus_key, peak_rss_mb
+from token_corpus import parallel_tokenize, timed_stage, print_timings
+from doc2vec_evaluation import self_rank_report, print_rank_table, write_report
 
 
-def read_corpus(df):
+def read_corpus(df, jobs=1):
 
     """
-        read corpus from df, clean each description as it is read
+        read corpus from df, clean each description as it is read (in jobs processes, in order)
     """
 
-    count = -1
-    for i, data in df.iterrows():
-
-        count += 1
-        desc = ' '.join(data.description)
-
-        desc = str(desc).lower()  # lowercase
-        desc = remove_stopwords(desc)
-        desc = re.sub(r'\s+', ' ', desc)  # multiple spaces converted to single spaces
-        desc = re.sub('[0-9]', '', desc)  # remove digits
-        desc = re.sub(r'(?<=\w)-(?=\w)', ' ', desc)  # dash replaced with space
-        desc = re.sub(f'[{re.escape(string.punctuation)}]', '', desc)  # remove punctuation and special characters
-
-        tokens = word_tokenize(desc)
-        tokens = [t for t in tokens if len(t) > 1]  # remove short tokens
+    for count, tokens in enumerate(parallel_tokenize(df['description'], clean_series, jobs=jobs)):
 
         yield gensim.models.doc2vec.TaggedDocument(tokens, [count])
 
 
-def clean_desc(desc):
-
-    """
-        cleans descriptions
-    """
-
-    desc = str(desc).lower()  # lowercase
-    desc = remove_stopwords(desc)
-    desc = re.sub(r'\s+', ' ', desc)  # multiple spaces converted to single spaces
-    desc = re.sub('[0-9]', '', desc)  # remove digits
-    desc = re.sub(r'(?<=\w)-(?=\w)', ' ', desc)  # dash replaced with space
-    desc = re.sub(f'[{re.escape(string.punctuation)}]', '', desc)  # remove punctuation and special characters
-
-    tokens = word_tokenize(desc)
-    tokens = [t for t in tokens if len(t) > 1]  # remove short tokens
-
-    return tokens
-
-
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description='Train the doc2vec model on the route descriptions')
+    parser.add_argument('--token-cache', action='store', dest='token_cache', type=str,
+                        required=False, default='doc2vec_tokens', help='the on-disk token cache directory')
+    parser.add_argument('--rebuild-cache', action='store_true', dest='rebuild',
+                        help='re-tokenize even if the token cache matches the data')
+    parser.add_argument('--in-memory', action='store_true', dest='in_memory',
+                        help='hold the whole tokenized corpus in memory (the old behaviour, for comparing peak RSS)')
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int,
+                        required=False, default=os.cpu_count(), help='the number of tokenization processes')
+    parser.add_argument('--eval-samples', action='store', dest='eval_samples', type=int,
+                        required=False, default=1000, help='the number of training documents in the sanity check')
+    parser.add_argument('--eval-seed', action='store', dest='eval_seed', type=int,
+                        required=False, default=0, help='the seed for choosing the sanity check documents')
+    parser.add_argument('--eval-report', action='store', dest='eval_report', type=str,
+                        required=False, default='doc2vec_sanity_check.json', help='the JSON sanity check report')
+    args = parser.parse_args()
+    timings = {}
+
     # read data and remove routes with no description
-    df = pd.read_pickle('Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', compression='zip')
-    df_desc = df[['route_name', 'route_ID', 'type_string', 'description']]
-    mask = (df['description'].str.len() > 0)
-    df_desc = df_desc[mask]
+    with timed_stage('load data', timings):
+        df = pd.read_pickle('Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', compression='zip')
+        df_desc = df[['route_name', 'route_ID', 'type_string', 'description']]
+        mask = (df['description'].str.len() > 0)
+        df_desc = df_desc[mask]
     print(len(df_desc.index), 'initial descriptions')
     print()
 
-    # convert to corpus
-    train_corpus = list(read_corpus(df_desc))  # documents are tagged for training, i.e. tokens_only=False
+    # convert to corpus, tokenized once into the on-disk cache and streamed from it for every pass
+    with timed_stage('tokenize', timings):
+        cache = token_cache.open_or_build(lambda: (doc.words for doc in read_corpus(df_desc, jobs=args.jobs)),
+                                          args.token_cache, key=corpus_key(df_desc.route_ID, df_desc.description),
+                                          rebuild=args.rebuild)
+    train_corpus = tagged_corpus(cache)  # documents are tagged for training, i.e. tokens_only=False
+    if args.in_memory:
+        train_corpus = list(train_corpus)
+    print(cache.n_tokens, 'tokens in the corpus')
     docID_2_rID = dict((i, rID) for i, rID in enumerate(df_desc.route_ID))
 
     # train and save the model
     # upped the epochs from typical 10-20 since the descriptions are relatively short
     model = gensim.models.doc2vec.Doc2Vec(vector_size=50, min_count=2, epochs=80, window=10) 
-    model.build_vocab(train_corpus)
+    with timed_stage('build vocab', timings):
+        model.build_vocab(train_corpus)
     print('training...')
-    model.train(train_corpus, total_examples=model.corpus_count, epochs=model.epochs)
+    with timed_stage('train', timings):
+        model.train(train_corpus, total_examples=model.corpus_count, epochs=model.epochs)
     print('saving...')
     print()
-    model.save('doc2vec.model')
-
-    with open('docID_2_routeID.pkl', 'wb') as rIDmap:
-        pickle.dump(docID_2_rID, rIDmap)
+    with timed_stage('save', timings):
+        model.save('doc2vec.model')
+        with open('docID_2_routeID.pkl', 'wb') as rIDmap:
+            pickle.dump(docID_2_rID, rIDmap)
+    print(f'peak RSS after training: {peak_rss_mb():.0f} MB')
+    print()
 
     # sanity check against training data
     print('SANITY CHECK AGAINST TRAINING DATA:')
     print('------------------------------------')
-    ranks = []
-    samples = random.sample(range(len(train_corpus)), 1000)  # 1000 random samples from the training data
-
-    for doc_id in samples:
-        inferred_vector = model.infer_vector(train_corpus[doc_id].words)  # get the inferred vector for the training doc
-        sims = model.dv.most_similar([inferred_vector], topn=len(model.dv))  # calculate the most similar docs (the doc itself should be in this)
-        rank = [ID for ID, sim in sims].index(doc_id)  # calculate the rank the document is to itself (rank 0 means it is most similar to itself)
-        ranks.append(rank)  # list the ranks
-
-    counter = collections.Counter(ranks)
-    ranks = counter.most_common()
-    ranks = sorted(ranks, key=lambda x: x[0])
-
-    print('{:<10} {:<10} {:<15}'.format(*['rank', 'count', 'cumulative sum']))
-    print('------------------------------------')
-    for i, (rank, count) in enumerate(ranks):
-        cumsum = np.sum([r[1] for r in ranks[0:i+1]])
-        print('{:<10} {:<10} {:<15}'.format(*[rank, count, cumsum]))
-    print('------------------------------------')
-    print()
+    with timed_stage('sanity check', timings):
+        report = self_rank_report(model, train_corpus, n_samples=args.eval_samples, seed=args.eval_seed,
+                                  model_name='doc2vec.model')
+    print_rank_table(report)
+    write_report(report, args.eval_report)
 
     # check against test descriptions
     with open('validation_phrases.txt', 'r') as td:
@@ -128,3 +109,5 @@ if __name__ == '__main__':
             print(line)
 
         print('-----------------------------------------------------------------------------------------------------------------------')
+
+    print_timings(timings)
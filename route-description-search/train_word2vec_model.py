@@ -1,69 +1,99 @@
-import re
-import string
+import os
+import argparse
+import functools
 import gensim
 import pandas as pd
-from nltk import word_tokenize
-from gensim.parsing.preprocessing import remove_stopwords
+from doc2vec_search.text_cleaning import clean_sentences, join_description
+from token_corpus import token_cache, phrased_corpus, corpus_key, peak_rss_mb
+from token_corpus import parallel_tokenize, timed_stage, print_timings
 from gensim.models import Phrases
 from gensim.models.phrases import Phraser
 
 
-def read_sentences(df, keep_stopwords=True):
-    
+def sentence_shard(descriptions, keep_stopwords=True):
+
     """
-        read corpus from df, clean each description as it is read
+        the cleaned sentences of every description in a shard, in order
     """
-    
-    for i, data in df.iterrows():
-        
-        desc = ' '.join(data.description)
-        desc = str(desc).lower()  # lowercase
-        
-        if not keep_stopwords:
-            desc = remove_stopwords(desc)
-            
-        desc = re.sub(r'\s+', ' ', desc)  # multiple spaces converted to single spaces
-        desc = re.sub('[0-9]', '', desc)  # remove digits
-        desc = re.sub(r'(?<=\w)-(?=\w)', ' ', desc)  # dash replaced with space
-        sentences = desc.split('. ')
 
-        for sentence in sentences:
-        
-            sentence = re.sub(f'[{re.escape(string.punctuation)}]', '', sentence)  # remove punctuation and special characters
-            tokens = word_tokenize(sentence)
-            tokens = [t for t in tokens if len(t) > 1]  # remove short tokens
+    return [sentence for description in descriptions
+            for sentence in clean_sentences(join_description(description), keep_stopwords=keep_stopwords)]
+
 
-            yield tokens
+def read_sentences(df, keep_stopwords=True, jobs=1):
+    
+    """
+        read corpus from df, clean each description as it is read (in jobs processes, in order)
+    """
+    
+    shard_fn = functools.partial(sentence_shard, keep_stopwords=keep_stopwords)
+    yield from parallel_tokenize(df['description'], shard_fn, jobs=jobs)
 
 
 if __name__ == '__main__':
 
-    df = pd.read_pickle('Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', compression='zip')
-    df_desc = df[['route_name', 'route_ID', 'type_string', 'description']]
-    mask = (df['description'].str.len() > 0)
-    df_desc = df_desc[mask]
+    parser = argparse.ArgumentParser(description='Train the word2vec and phrase models on the route descriptions')
+    parser.add_argument('--token-cache', action='store', dest='token_cache', type=str,
+                        required=False, default='word2vec_tokens', help='the on-disk token cache directory prefix')
+    parser.add_argument('--rebuild-cache', action='store_true', dest='rebuild',
+                        help='re-tokenize even if the token caches match the data')
+    parser.add_argument('--in-memory', action='store_true', dest='in_memory',
+                        help='hold the tokenized sentences in memory (the old behaviour, for comparing peak RSS)')
+    parser.add_argument('--jobs', action='store', dest='jobs', type=int,
+                        required=False, default=os.cpu_count(), help='the number of tokenization processes')
+    args = parser.parse_args()
+    timings = {}
+
+    with timed_stage('load data', timings):
+        df = pd.read_pickle('Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', compression='zip')
+        df_desc = df[['route_name', 'route_ID', 'type_string', 'description']]
+        mask = (df['description'].str.len() > 0)
+        df_desc = df_desc[mask]
     print(len(df_desc.index), 'initial descriptions')
     print()
 
-    sw_sentences = list(read_sentences(df, keep_stopwords=True))
-    nsw_sentences = list(read_sentences(df, keep_stopwords=False))
-    
-    bigram = Phrases(sw_sentences, min_count=5, threshold=100)
-    trigram = Phrases(bigram[sw_sentences], threshold=10)
-    bigram_mod = Phraser(bigram)
-    trigram_mod = Phraser(trigram)
-    
-    sentences = [bigram_mod[sent] for sent in nsw_sentences]
-    sentences = [trigram_mod[bigram_mod[sent]] for sent in sentences]
+    # sentences are tokenized once into on-disk caches, every phrase and training pass streams from them
+    with timed_stage('tokenize', timings):
+        sw_sentences = token_cache.open_or_build(lambda: read_sentences(df, keep_stopwords=True, jobs=args.jobs),
+                                                 args.token_cache + '_sw',
+                                                 key=corpus_key(df.route_ID, df.description, keep_stopwords=True),
+                                                 rebuild=args.rebuild)
+        nsw_sentences = token_cache.open_or_build(lambda: read_sentences(df, keep_stopwords=False, jobs=args.jobs),
+                                                  args.token_cache + '_nsw',
+                                                  key=corpus_key(df.route_ID, df.description, keep_stopwords=False),
+                                                  rebuild=args.rebuild)
+    if args.in_memory:
+        sw_sentences, nsw_sentences = list(sw_sentences), list(nsw_sentences)
+
+    with timed_stage('phrases', timings):
+        bigram = Phrases(sw_sentences, min_count=5, threshold=100)
+        trigram = Phrases(phrased_corpus(sw_sentences, [bigram]), threshold=10)
+        bigram_mod = Phraser(bigram)
+        trigram_mod = Phraser(trigram)
+
+    # the same phrasing as before: bigrams applied twice, then trigrams; done once, into a third token cache that the
+    # vocab and training passes stream from
+    with timed_stage('phrase corpus', timings):
+        sentences = phrased_corpus(nsw_sentences, [bigram_mod, bigram_mod, trigram_mod])
+        if args.in_memory:
+            sentences = list(sentences)
+        else:
+            sentences = token_cache.build(sentences, args.token_cache + '_phrased')
     
     model = gensim.models.word2vec.Word2Vec(min_count=10, window=5, vector_size=50)
-    model.build_vocab(sentences)
+    with timed_stage('build vocab', timings):
+        model.build_vocab(sentences)
     print(len(model.wv), 'words in the vocab')
 
     print('training...')
-    model.train(sentences, total_examples=model.corpus_count, epochs=10)
+    with timed_stage('train', timings):
+        model.train(sentences, total_examples=model.corpus_count, epochs=10)
     print('saving...')
     print()
-    model.save('word2vec.model')
-    bigram_mod.save('bigram.model')
-    trigram_mod.save('trigram.model')
+    with timed_stage('save', timings):
+        model.save('word2vec.model')
+        bigram_mod.save('bigram.model')
+        trigram_mod.save('trigram.model')
+    print(f'peak RSS after training: {peak_rss_mb():.0f} MB')
+    print()
+    print_timings(timings)
@@ -0,0 +1,86 @@
+import re
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from grade_rank_calculation import grade_ranks
+
+def legacy_calculate_grade_rank(grade):
+
+    """
+        the original per-call implementation, kept here as the reference
+    """
+
+    weight_dict = {'YDS': {'a': 0, 'a/b': 1, '-': 1, 'b':2, 'b/c':3, 'not_given':3, 'c':4, 'c/d':5, '+':5, 'd':6},
+               'Vermin': {'-': 0, 'not_given': 1,  '+': 2, 'range': 2}}
+
+    if grade == None:
+        return grade
+
+    elif 'V' in grade:
+        grade_type = 'Vermin'
+        noV = grade.replace('V', '')
+        ran = re.match(r'\d{1,2}-\d{1,2}', noV)
+        num = int(re.sub('[^0-9]', '', noV.split('-')[0]))
+        non_num = re.sub('[0-9]', '', noV)
+
+    elif '5.' in grade:
+        grade_type = 'YDS'
+        no5 = grade.split('.')[-1]
+        num = int(re.sub('[^0-9]', '', no5))
+        non_num = re.sub('[0-9]', '', no5)
+        ran = None
+
+    else:
+        message = ' '.join(['grade format of', grade, 'does not match the YDS or Vermin systems.'])
+        raise ValueError(message)
+
+    non_num = 'not_given' if non_num == '' else non_num
+    wdict = weight_dict[grade_type]
+    weight = wdict['range'] if ran else wdict[non_num]
+
+    return 10 * num + weight
+
+def grade_column(n_rows, seed=0):
+
+    """
+        a column of n_rows grades drawn from every YDS and Vermin grade, with 1% None
+    """
+
+    yds = ['5.' + str(n) + s for n in range(0, 10) for s in ('', '-', '+')]
+    yds += ['5.' + str(n) + s for n in range(10, 16) for s in ('', 'a', 'a/b', '-', 'b', 'b/c', 'c', 'c/d', '+', 'd')]
+    vermin = ['V' + str(n) + s for n in range(0, 17) for s in ('', '-', '+')]
+    vermin += ['V' + str(n) + '-' + str(n + 1) for n in range(0, 16)]
+
+    rng = np.random.default_rng(seed)
+    grades = np.array(yds + vermin + [None], dtype=object)
+    p = np.full(len(grades), 0.99 / (len(grades) - 1))
+    p[-1] = 0.01
+
+    return pd.Series(grades[rng.choice(len(grades), size=n_rows, p=p)], dtype=object)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark grade_ranks against the original per-row calculation')
+    parser.add_argument('-n', action='store', dest='n_rows', type=int,
+                        required=False, default=1000000, help='the number of rows in the grade column')
+    args = parser.parse_args()
+
+    grades = grade_column(args.n_rows)
+    print(f'{len(grades)} rows, {grades.nunique()} distinct grades')
+
+    start = time.perf_counter()
+    reference = pd.Series([legacy_calculate_grade_rank(g) for g in grades.tolist()], dtype=float)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ranks = grade_ranks(grades)
+    batch_s = time.perf_counter() - start
+
+    same = np.array_equal(ranks.to_numpy(), reference.to_numpy(dtype=float), equal_nan=True)
+    print('{:<30} {:<10}'.format(*['implementation', 'seconds']))
+    print('------------------------------------------')
+    print('{:<30} {:<10.3f}'.format(*['original (per row)', legacy_s]))
+    print('{:<30} {:<10.3f}'.format(*['grade_ranks', batch_s]))
+    print('------------------------------------------')
+    print(f'speedup: {legacy_s / batch_s:.0f}x, identical ranks: {same}')
@@ -0,0 +1,79 @@
+import math
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from location_optimization import location_optimizer
+
+def legacy_haversine(loc0, loc1):
+
+    """
+        mpu.haversine_distance, which the optimizer called once per route: (lat, lon) in degrees to km
+    """
+
+    lat1, lon1 = loc0
+    lat2, lon2 = loc1
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
+
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+def legacy_total_energy(quals, locs, loc, eps=1.0e-6):
+
+    TE = 0.0
+    for qual, pos in zip(quals, locs):
+        dist = legacy_haversine(pos, loc) + eps
+        TE += -qual/(dist*dist)
+
+    return TE
+
+def evals_per_second(fn, locs, min_seconds=1.0):
+
+    n, start = 0, time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        fn(locs)
+        n += locs.shape[1]
+
+    return n / (time.perf_counter() - start)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the location optimizer energy against the per-route loop')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality data')
+    parser.add_argument('-m', action='store', dest='metric', type=str,
+                        required=False, default='ARQI_median', help='the quality metric')
+    parser.add_argument('-p', action='store', dest='population', type=int,
+                        required=False, default=30, help='locations per batch (differential_evolution: popsize * 2)')
+    args = parser.parse_args()
+
+    df = pd.read_pickle(args.data, compression='zip')
+    rng = np.random.default_rng(0)
+    locs = np.stack([rng.uniform(36.5, 49, args.population), rng.uniform(-123.9157, -69.2246, args.population)])
+
+    exact = location_optimizer(df, metric=args.metric)
+    approx = location_optimizer(df, metric=args.metric, far_field=True)
+
+    quals = list(exact.quals)
+    route_locs = list(zip(np.degrees(exact.lat), np.degrees(exact.lon)))
+    legacy = lambda population: [legacy_total_energy(quals, route_locs, loc) for loc in population.T]
+
+    expected = np.array(legacy(locs))
+    single = np.array([exact.total_energy(loc) for loc in locs.T])
+    batched = exact.population_energy(locs)
+    far_field = approx.population_energy(locs)
+
+    print(f'{len(quals)} routes, {args.population} locations per batch')
+    print('-'*72)
+    print('{:<26} {:<16} {:<10} {:<18}'.format(*['energy', 'evals/s', 'speedup', 'max rel. error']))
+    print('-'*72)
+
+    base = evals_per_second(legacy, locs[:, :2])
+    for name, fn, result in [('per-route loop', legacy, expected),
+                             ('vectorized, one location', lambda p: [exact.total_energy(loc) for loc in p.T], single),
+                             ('vectorized population', exact.population_energy, batched),
+                             ('far-field population', approx.population_energy, far_field)]:
+        rate = base if fn is legacy else evals_per_second(fn, locs)
+        error = np.max(np.abs(result - expected) / np.abs(expected))
+        print('{:<26} {:<16,.0f} {:<10.1f} {:<18.2e}'.format(name, rate, rate / base, error))
@@ -0,0 +1,103 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from grade_rank_calculation import calculate_grade_rank
+from sector_aggregation import aggregate_sectors, marker_sizes
+
+def legacy_aggregate_sectors(df, metric, metric_threshold):
+
+    """
+        the original list-based aggregation from route_quality_map_generation.py, kept here as the reference
+    """
+
+    cols = ['route_name', 'nopm_YDS', 'safety', metric]
+    df_agg = df.groupby('sector_ID')[['route_name', 'nopm_YDS', 'safety', metric]].agg(lambda x: list(x))
+    df_agg.columns = cols
+
+    df_agg['sector_ID'] = df_agg.index
+    df_agg.index = range(len(df_agg.index))
+    name_loc = df[['parent_sector', 'sector_ID', 'parent_loc']].copy()
+    name_loc = name_loc.drop_duplicates(subset=['sector_ID'])
+    df_agg = pd.merge(df_agg, name_loc, on='sector_ID')
+
+    df_agg['num_routes'] = df_agg.apply(lambda row: len(row['route_name']), axis=1)
+    df_agg['NRGT'] = df_agg.apply(lambda row: len([r for r in row[metric] if r >= metric_threshold]), axis=1)
+    df_agg['lat'] = df_agg.apply(lambda row: row['parent_loc'][1], axis=1)
+    df_agg['lon'] = df_agg.apply(lambda row: row['parent_loc'][0], axis=1)
+    df_agg['best_route'] = df_agg.apply(lambda row:
+      [(n, np.round(m,2), g) for n,m,g in zip(row['route_name'],row[metric],row['nopm_YDS'])
+      if m == max(row[metric])][0], axis=1)
+
+    sizenorm = max(df_agg['NRGT'])
+    df_agg['size'] = 0
+    sizes = np.linspace(0, sizenorm, num=6)
+    size_limits = [(sizes[i], sizes[i+1], (i+1)*7) for i in range(len(sizes)-1)]
+
+    for ll,hl,size in size_limits:
+        df_agg.loc[(df_agg['NRGT'] > ll) & (df_agg['NRGT'] <= hl), 'size'] = size
+    df_agg.loc[df_agg['NRGT'] == 0, 'size'] = 7
+
+    return df_agg
+
+def aggregate(df, metric, metric_threshold):
+
+    df_agg = aggregate_sectors(df, metric, metric_threshold)
+    df_agg['size'] = marker_sizes(df_agg['NRGT'], zero_size=7)
+
+    return df_agg
+
+def same_result(new, old):
+
+    best = pd.Series(list(zip(new['best_name'], new['best_metric'], new['best_grade'])))
+    return all([np.array_equal(new[c].to_numpy(), old[c].to_numpy()) for c in ('sector_ID', 'num_routes', 'NRGT', 'size')] +
+               [np.allclose(new[c], old[c]) for c in ('lat', 'lon')] +
+               [best.tolist() == old['best_route'].tolist()])
+
+def filtered(df, route_type, grade_range):
+
+    if route_type != 'all':
+        df = df[df['type_string'] == route_type]
+    if grade_range != 'all':
+        lo, hi = [calculate_grade_rank(g) for g in grade_range.split('-')]
+        df = df[(lo <= df['YDS_rank']) & (df['YDS_rank'] <= hi)]
+
+    return df
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the sector aggregation against the original list-based version')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality data')
+    parser.add_argument('-r', action='store', dest='repeats', type=int,
+                        required=False, default=3, help='timed runs per implementation (the best is reported)')
+    args = parser.parse_args()
+
+    DF = pd.read_pickle(args.data, compression='zip')
+    cases = [('RQI_median', 3.5, 'all', 'all'), ('ARQI_median', 3.0, 'sport', '5.10a-5.11a'),
+             ('RQI_mean', 2.5, 'trad', '5.6-5.15a')]
+
+    print(f'{len(DF)} routes, {DF["sector_ID"].nunique()} sectors')
+    print('-'*88)
+    print('{:<14} {:<10} {:<8} {:<14} {:<12} {:<12} {:<8} {:<8}'.format(
+        *['metric', 'threshold', 'type', 'grades', 'original (s)', 'vectorized', 'speedup', 'same']))
+    print('-'*88)
+
+    for metric, threshold, route_type, grade_range in cases:
+
+        df = filtered(DF, route_type, grade_range)
+        times = {}
+        for name, fn in (('original', legacy_aggregate_sectors), ('vectorized', aggregate)):
+            runs = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                out = fn(df, metric, threshold)
+                runs.append(time.perf_counter() - start)
+            times[name] = (min(runs), out)
+
+        same = same_result(times['vectorized'][1], times['original'][1])
+        line = [metric, threshold, route_type, grade_range, times['original'][0], times['vectorized'][0],
+                times['original'][0] / times['vectorized'][0], str(same)]
+        print('{:<14} {:<10} {:<8} {:<14} {:<12.3f} {:<12.3f} {:<8.1f} {:<8}'.format(*line))
+
+    print('-'*88)
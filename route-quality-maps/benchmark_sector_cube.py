@@ -0,0 +1,66 @@
+import time
+import argparse
+import pandas as pd
+from grade_rank_calculation import calculate_grade_rank
+from sector_aggregation import aggregate_sectors
+from sector_cube import sector_cube
+
+def filter_and_aggregate(df, route_type, metric, metric_threshold, state, lo_rank, hi_rank):
+
+    """
+        the per-click path of the app before the cube: filter the route rows, then aggregate them
+    """
+
+    if route_type != 'all':
+        df = df[df['type_string'] == route_type]
+    if state != 'all':
+        df = df[df['state'] == state]
+    df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)]
+
+    return aggregate_sectors(df, metric, metric_threshold)
+
+def best_time(fn, repeats):
+
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        runs.append(time.perf_counter() - start)
+
+    return min(runs), out
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark map queries answered by the sector cube against filtering the routes')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality data')
+    parser.add_argument('-r', action='store', dest='repeats', type=int,
+                        required=False, default=5, help='timed runs per query (the best is reported)')
+    args = parser.parse_args()
+
+    DF = pd.read_pickle(args.data, compression='zip')
+    state = sorted(set(DF['state']))[0]
+
+    build_s, cube = best_time(lambda: sector_cube.build(DF), 1)
+    print(f'{len(DF)} routes, cube built in {build_s:.2f} s')
+
+    cases = [('all', 'RQI_mean', 3.5, 'all', '5.6', '5.15a'), ('sport', 'ARQI_median', 3.0, 'all', '5.10a', '5.11a'),
+             ('trad', 'median_rating', 2.5, state, '5.8', '5.10d'), ('all', 'ARQI_mean', 4.0, state, '5.12a', '5.12a')]
+
+    print('-'*96)
+    print('{:<7} {:<15} {:<6} {:<12} {:<14} {:<12} {:<10} {:<8} {:<6}'.format(
+        *['type', 'metric', 'min', 'state', 'grades', 'filter (ms)', 'cube (ms)', 'speedup', 'same']))
+    print('-'*96)
+
+    for route_type, metric, threshold, st, lo, hi in cases:
+
+        query = (route_type, metric, threshold, st, calculate_grade_rank(lo), calculate_grade_rank(hi))
+        filter_s, expected = best_time(lambda: filter_and_aggregate(DF, *query), args.repeats)
+        cube_s, result = best_time(lambda: cube.query(route_type, metric, threshold, state=st, lo_rank=query[4],
+                                                      hi_rank=query[5]), args.repeats)
+
+        line = [route_type, metric, threshold, st, f'{lo}-{hi}', 1000 * filter_s, 1000 * cube_s,
+                filter_s / cube_s, str(result.equals(expected))]
+        print('{:<7} {:<15} {:<6} {:<12} {:<14} {:<12.1f} {:<10.1f} {:<8.1f} {:<6}'.format(*line))
+
+    print('-'*96)
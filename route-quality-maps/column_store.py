@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sector_cube import METRICS
+
+STORE_VERSION = 1
+
+# the columns the map app uses
+APP_COLUMNS = ['route_name', 'sector_ID', 'parent_sector', 'parent_loc', 'state', 'type_string', 'nopm_YDS', 'safety',
+               'YDS_rank'] + METRICS
+
+def write_column_store(df, path, columns=APP_COLUMNS):
+
+    """
+        writes the route data as an uncompressed column store that loads without unpickling:
+
+            block_<dtype>.npy       the numeric columns of one dtype as a (columns, rows) array
+            <column>.codes.npy      string columns as categorical codes ...
+            manifest.json           ... with their categories, plus the column layout
+
+        parent_loc (lon, lat) tuples are stored as numeric lon and lat columns
+    """
+
+    os.makedirs(path, exist_ok=True)
+    df = df[list(columns)].reset_index(drop=True)
+
+    if 'parent_loc' in df.columns:
+        loc = np.array(df['parent_loc'].tolist(), dtype=float).reshape(-1, 2)
+        df = df.drop(columns=['parent_loc']).assign(lon=loc[:, 0], lat=loc[:, 1])
+
+    blocks, categoricals = {}, {}
+    for name in df.columns:
+
+        values = df[name]
+        if values.dtype.kind in 'biuf':
+            blocks.setdefault(values.dtype.name, []).append(name)
+        else:
+            codes, categories = pd.factorize(values, sort=True) # None/NaN get code -1
+            dtype = np.int16 if len(categories) < 2**15 else np.int32
+            np.save(os.path.join(path, f'{name}.codes.npy'), codes.astype(dtype))
+            categoricals[name] = [str(c) for c in categories]
+
+    for dtype, names in blocks.items():
+        np.save(os.path.join(path, f'block_{dtype}.npy'), np.ascontiguousarray(df[names].to_numpy(dtype=dtype).T))
+
+    manifest = {'version': STORE_VERSION, 'n_rows': len(df), 'blocks': blocks, 'categoricals': categoricals}
+    with open(os.path.join(path, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+def load_column_store(path, mmap=True):
+
+    """
+        the column store as a DataFrame whose numeric columns are views of the (memory-mapped) block arrays and whose
+        string columns are categoricals; no per-row Python objects are created, so worker processes forked after loading
+        (gunicorn --preload) or mapping the same files share the pages instead of each holding a copy
+    """
+
+    with open(os.path.join(path, 'manifest.json'), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest['version'] != STORE_VERSION:
+        raise ValueError(f'column store at {path} has version {manifest["version"]}, expected {STORE_VERSION}')
+
+    mode = 'r' if mmap else None
+    frames = [pd.DataFrame(np.load(os.path.join(path, f'block_{dtype}.npy'), mmap_mode=mode).T, columns=names, copy=False)
+              for dtype, names in manifest['blocks'].items()]
+    df = pd.concat(frames, axis=1, copy=False) if frames else pd.DataFrame(index=range(manifest['n_rows']))
+
+    for name, categories in manifest['categoricals'].items():
+        codes = np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode=mode)
+        df[name] = pd.Categorical.from_codes(codes, categories=categories)
+
+    return df
+
+def load_route_data(path):
+
+    """
+        a column store directory, or the zipped pickle
+    """
+
+    if os.path.isdir(path):
+        return load_column_store(path)
+
+    return pd.read_pickle(path, compression='zip')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert the route quality data to a memory-mappable column store')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality data')
+    parser.add_argument('-o', action='store', dest='out', type=str,
+                        required=False, default='RouteQualityData', help='the column store directory')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = pd.read_pickle(args.data, compression='zip')
+    print(f'pickle loaded in {time.perf_counter() - start:.2f} s')
+
+    write_column_store(df, args.out)
+
+    start = time.perf_counter()
+    df = load_column_store(args.out)
+    print(f'column store loaded in {1000 * (time.perf_counter() - start):.1f} ms ({len(df)} routes)')
@@ -0,0 +1,387 @@
+import io
+import os
+import re
+import json
+import time
+import zipfile
+import hashlib
+import inspect
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import grade_rank_calculation
+from grade_rank_calculation import grade_ranks
+
+PIPELINE_VERSION = 1 # bump to invalidate every cached stage, e.g. after a pandas pickle format change
+
+# route types in the order they are joined into type_flags; routes of the EXCLUDED_TYPES are not rock climbs
+ROUTE_TYPES = ['trad', 'sport', 'tr', 'boulder', 'alpine', 'aid', 'ice', 'mixed', 'snow']
+EXCLUDED_TYPES = {'ice', 'mixed', 'snow'}
+
+PLUS_MINUS_RE = re.compile(r'^(5\.1[0-5])([-+])$')
+MAX_STARS = 4
+
+#
+# stages: each takes the files it reads and the outputs of the stages it depends on, and returns one DataFrame
+#
+
+def file_hash(path, block_size=2**20):
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def open_lines(path):
+
+    if zipfile.is_zipfile(path):
+        archive = zipfile.ZipFile(path)
+        return io.TextIOWrapper(archive.open(archive.namelist()[0]), encoding='utf-8')
+
+    return open(path, 'r', encoding='utf-8')
+
+def nopm_grades(yds):
+
+    """
+        YDS grades without plus/minus and anything after the grade (e.g. 5.9 PG13): 5.10- to 5.15- become a/b, 5.10+ to
+        5.15+ become c/d (the ranks are the same)
+    """
+
+    return yds.str.split().str[0].str.replace(PLUS_MINUS_RE, lambda m: m.group(1) + ('a/b' if m.group(2) == '-' else 'c/d'),
+                                              regex=True)
+
+def main_type(flags):
+
+    """
+        the single type the maps filter on: trad if the route is flagged trad (also e.g. trad, sport or trad, tr),
+        else sport if it is flagged sport, else its first flag (e.g. tr or boulder, neither sport nor trad)
+    """
+
+    return next((t for t in flags if t in ('trad', 'sport')), flags[0] if flags else '')
+
+def parse_routes(files, state=None):
+
+    """
+        the routes of an OpenBeta routes JSONL export (zipped or not), one row per route
+        (state comes from the records, or from the file's STATE=path argument); type_string is the route's main_type
+        and type_flags all the types it is flagged with
+    """
+
+    rows = []
+    with open_lines(files[0]) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            r = json.loads(line)
+            meta = r.get('metadata') or {}
+            types = r.get('type') or {}
+            description = r.get('description') or ''
+            flags = [t for t in ROUTE_TYPES if types.get(t)]
+            rows.append((meta.get('mp_route_id'), r.get('route_name'), main_type(flags), ', '.join(flags),
+                         (r.get('grade') or {}).get('YDS'), r.get('safety'), meta.get('mp_sector_id'), meta.get('parent_sector'),
+                         tuple(meta.get('parent_lnglat') or (np.nan, np.nan)), r.get('state') or meta.get('state') or state,
+                         ' '.join(description) if isinstance(description, list) else description))
+
+    df = pd.DataFrame(rows, columns=['route_ID', 'route_name', 'type_string', 'type_flags', 'YDS', 'safety', 'sector_ID',
+                                     'parent_sector', 'parent_loc', 'state', 'description'])
+    df['route_ID'] = pd.to_numeric(df['route_ID'], errors='coerce')
+    df['sector_ID'] = pd.to_numeric(df['sector_ID'], errors='coerce')
+
+    return df.dropna(subset=['route_ID']).astype({'route_ID': np.int64})
+
+def rating_stats(files):
+
+    """
+        votes, mean and interpolated median of the star ratings of each route, from a ratings csv (route_id, ratings)
+
+        The interpolated median treats each star value v as the class [v - 0.5, v + 0.5): with N votes, F votes below
+        the median class and f votes in it, it is v - 0.5 + (N/2 - F) / f. All routes are done at once from a
+        (routes x star values) count table.
+    """
+
+    ratings = pd.read_csv(files[0], usecols=['route_id', 'ratings'],
+                          compression='zip' if files[0].endswith('.zip') else None).dropna()
+    codes, route_ids = pd.factorize(ratings['route_id'], sort=True)
+    stars = np.clip(np.rint(ratings['ratings'].to_numpy(dtype=float)), 0, MAX_STARS).astype(np.int64)
+
+    counts = np.bincount(codes * (MAX_STARS + 1) + stars, minlength=len(route_ids) * (MAX_STARS + 1))
+    counts = counts.reshape(len(route_ids), MAX_STARS + 1)
+    votes = counts.sum(axis=1)
+    cumulative = np.cumsum(counts, axis=1)
+
+    median_class = np.argmax(cumulative >= votes[:, None] / 2, axis=1)
+    rows = np.arange(len(route_ids))
+    below = cumulative[rows, median_class] - counts[rows, median_class]
+    median = median_class - 0.5 + (votes / 2 - below) / counts[rows, median_class]
+
+    mean = np.bincount(codes, weights=ratings['ratings'].to_numpy(dtype=float), minlength=len(route_ids)) / votes
+
+    return pd.DataFrame({'route_ID': np.asarray(route_ids, dtype=np.int64), 'num_votes': votes, 'mean_rating': mean,
+                         'median_rating': median})
+
+def curate(routes):
+
+    """
+        the rock routes of all route files with their YDS_rank and nopm_YDS, one row per route_ID
+    """
+
+    df = pd.concat(routes, ignore_index=True).drop_duplicates('route_ID', keep='last')
+    excluded = df['type_flags'].str.split(', ').map(lambda types: bool(EXCLUDED_TYPES.intersection(types)))
+    df = df[~excluded & df['YDS'].notna()].reset_index(drop=True)
+
+    df['nopm_YDS'] = nopm_grades(df['YDS'])
+    df['YDS_rank'] = grade_ranks(df['nopm_YDS'], errors='ignore')
+
+    return df.sort_values('route_ID', ignore_index=True)
+
+def route_quality(curated, stats):
+
+    """
+        the curated routes with ratings and their quality metrics:
+
+            RQI = S (1 - 1/N) for the mean and median rating S of N votes
+            ARQI = S (1 - 1/(w N)), where w is the highest votes-per-route of any (nopm_YDS, type_string) group divided by
+                   the votes-per-route of the route's group, so votes on rarely climbed grades/types count for more
+                   (type_string is the single sport or trad type, see main_type, so a grade's sport routes with and
+                   without a tr flag share one rate)
+    """
+
+    stats = pd.concat(stats, ignore_index=True).groupby('route_ID', sort=False).first() # a route is rated in one file
+    df = curated.drop(columns=['description']).join(stats, on='route_ID', how='inner')
+    df = df[df['num_votes'] > 0].reset_index(drop=True)
+
+    group = [df['nopm_YDS'], df['type_string']]
+    votes_per_route = df['num_votes'].groupby(group).transform('sum') / df['num_votes'].groupby(group).transform('size')
+    weight = votes_per_route.max() / votes_per_route
+
+    votes = df['num_votes'].to_numpy(dtype=float)
+    for average in ['mean', 'median']:
+        rating = df[f'{average}_rating']
+        df[f'RQI_{average}'] = rating * (1 - 1 / votes)
+        df[f'ARQI_{average}'] = rating * (1 - 1 / (weight * votes))
+
+    df['votes_weight'] = weight
+
+    return df
+
+#
+# the pipeline: stages are cached by a key hashed from their inputs' content, and run in a process pool
+# as soon as the stages they depend on are done
+#
+
+class stage(object):
+
+    """
+        a stage's code is the source of the module defining fn (its helpers and constants included) and of the
+        other modules in code, so editing any of them rebuilds the stage
+    """
+
+    def __init__(self, name, fn, files=(), deps=(), params=None, output=None, code=()):
+
+        self.name = name
+        self.fn = fn
+        self.files = list(files)
+        self.deps = list(deps)
+        self.params = params or {}
+        self.output = output # the published pickle, if any
+        self.code = [inspect.getmodule(fn)] + list(code)
+
+    def code_hash(self):
+
+        digest = hashlib.sha1()
+        for module in self.code:
+            digest.update(inspect.getsource(module).encode('utf-8'))
+
+        return digest.hexdigest()
+
+def run_stage(fn, files, dep_paths, params, path):
+
+    """
+        runs in a pool worker: reads the dependencies' outputs from the cache, writes this stage's output to it
+    """
+
+    start = time.perf_counter()
+    inputs = [[pd.read_pickle(p) for p in paths] if isinstance(paths, list) else pd.read_pickle(paths) for paths in dep_paths]
+    df = fn(files, *inputs, **params) if files else fn(*inputs, **params)
+
+    df.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path) # an interrupted build never leaves a partial cache entry
+
+    return time.perf_counter() - start
+
+class pipeline(object):
+
+    """
+        stages in dependency order; a stage's key hashes its name, its code, parameters, the content of its files and
+        the keys of its dependencies, so after a change only the stages downstream of it are rebuilt
+
+        A dependency given as a list of stage names passes a list of their outputs (e.g. every state's ratings). The
+        cache keeps the current run's entries and the max_entries most recently used others.
+    """
+
+    def __init__(self, stages, cache_dir='.build_cache', max_entries=32):
+
+        self.stages = {s.name: s for s in stages}
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def keys(self):
+
+        hashes, keys = {}, {}
+        for s in self.stages.values():
+            for path in s.files:
+                if path not in hashes:
+                    hashes[path] = file_hash(path)
+            deps = [[keys[d] for d in dep] if isinstance(dep, list) else keys[dep] for dep in s.deps]
+            key = json.dumps([PIPELINE_VERSION, s.name, s.fn.__name__, s.code_hash(), s.params, [hashes[p] for p in s.files],
+                              deps], sort_keys=True)
+            keys[s.name] = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        return keys
+
+    def path(self, name, key):
+        return os.path.join(self.cache_dir, f'{name}-{key[:16]}.pkl')
+
+    def published_path(self):
+        return os.path.join(self.cache_dir, 'published.json')
+
+    def published(self):
+
+        """
+            {output file: path of the stage output it was published from}
+        """
+
+        if not os.path.exists(self.published_path()):
+            return {}
+
+        with open(self.published_path(), 'r') as f:
+            return json.load(f)
+
+    def evict(self, keep):
+
+        """
+            removes the cache entries other than keep, except the max_entries most recently used
+        """
+
+        entries = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f != 'published.json']
+        stale = sorted((e for e in entries if e not in keep), key=os.path.getmtime, reverse=True)
+        for path in stale[self.max_entries:]:
+            os.remove(path)
+
+    def run(self, jobs=None, force=False):
+
+        """
+            builds the stages that are not cached (all of them with force), publishes the outputs, returns the
+            timings as {stage: (status, seconds)}
+        """
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        start = time.perf_counter()
+        keys = self.keys()
+        timings = {'hash inputs': ('done', time.perf_counter() - start)}
+        paths = {name: self.path(name, key) for name, key in keys.items()}
+
+        done = set()
+        for name in self.stages:
+            if not force and os.path.exists(paths[name]):
+                os.utime(paths[name]) # the modification time is the last use, for evict
+                timings[name] = ('cached', 0.0)
+                done.add(name)
+
+        def dep_names(s):
+            return [d for dep in s.deps for d in (dep if isinstance(dep, list) else [dep])]
+
+        running = {}
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            while len(done) < len(self.stages):
+
+                for name, s in self.stages.items():
+                    if name not in done and name not in running.values() and all(d in done for d in dep_names(s)):
+                        dep_paths = [[paths[d] for d in dep] if isinstance(dep, list) else paths[dep] for dep in s.deps]
+                        running[pool.submit(run_stage, s.fn, s.files, dep_paths, s.params, paths[name])] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    timings[name] = ('built', future.result())
+                    done.add(name)
+                    print(f'[{name}: {timings[name][1]:.1f} s]')
+
+        # an output is republished whenever it was published from another stage output, e.g. after going back to
+        # earlier inputs whose stages are all cached
+        published = self.published()
+        for name, s in self.stages.items():
+            output = os.path.abspath(s.output) if s.output else None
+            stale = timings[name][0] == 'built' or published.get(output) != paths[name]
+            if output and (stale or not os.path.exists(output)):
+                publish_start = time.perf_counter()
+                compression = {'method': 'zip', 'archive_name': os.path.splitext(os.path.basename(output))[0]}
+                pd.read_pickle(paths[name]).to_pickle(output + '.tmp', compression=compression)
+                os.replace(output + '.tmp', output)
+                published[output] = paths[name]
+                timings[f'publish {os.path.basename(s.output)}'] = ('done', time.perf_counter() - publish_start)
+
+        with open(self.published_path() + '.tmp', 'w') as f:
+            json.dump(published, f, indent=2)
+        os.replace(self.published_path() + '.tmp', self.published_path())
+
+        self.evict(set(paths.values()))
+
+        timings['total'] = ('', time.perf_counter() - start)
+        order = ['hash inputs'] + list(self.stages) + [n for n in timings if n.startswith('publish')] + ['total']
+        return {name: timings[name] for name in order}
+
+def build_pipeline(routes_files, ratings_files, curated_out, quality_out, cache_dir='.build_cache', max_entries=32):
+
+    """
+        routes_files are OpenBeta routes exports, each optionally given as STATE=path; ratings_files are ratings csvs
+    """
+
+    stages = []
+    for i, spec in enumerate(routes_files):
+        state, path = spec.split('=', 1) if '=' in spec else (None, spec)
+        stages.append(stage(f'routes_{i}', parse_routes, files=[path], params={'state': state}))
+    for i, path in enumerate(ratings_files):
+        stages.append(stage(f'ratings_{i}', rating_stats, files=[path]))
+
+    stages.append(stage('curated', curate, deps=[[s.name for s in stages if s.name.startswith('routes_')]],
+                        output=curated_out, code=[grade_rank_calculation]))
+    stages.append(stage('route_quality', route_quality,
+                        deps=['curated', [s.name for s in stages if s.name.startswith('ratings_')]], output=quality_out))
+
+    return pipeline(stages, cache_dir, max_entries)
+
+def print_timings(timings):
+
+    print('{:<40} {:<8} {:<10}'.format(*['stage', 'status', 'seconds']))
+    print('-'*60)
+    for name, (status, seconds) in timings.items():
+        print('{:<40} {:<8} {:<10.2f}'.format(*[name, status, seconds]))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the curated route data and RouteQualityData from the raw OpenBeta dumps')
+    parser.add_argument('-r', action='store', dest='routes', type=str, nargs='+',
+                        required=True, help='routes JSONL exports (zipped or not), as path or STATE=path')
+    parser.add_argument('-t', action='store', dest='ratings', type=str, nargs='+',
+                        required=True, help='ratings csvs with route_id and ratings columns (zipped or not)')
+    parser.add_argument('-c', action='store', dest='curated', type=str,
+                        required=False, default='Curated_OpenBetaAug2020_RytherAnderson.pkl.zip', help='the curated routes output')
+    parser.add_argument('-q', action='store', dest='quality', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality output')
+    parser.add_argument('-b', action='store', dest='cache_dir', type=str,
+                        required=False, default='.build_cache', help='the stage cache directory')
+    parser.add_argument('-m', action='store', dest='max_entries', type=int,
+                        required=False, default=32, help='the number of stale stage outputs kept in the cache')
+    parser.add_argument('-j', action='store', dest='jobs', type=int,
+                        required=False, default=None, help='the number of worker processes')
+    parser.add_argument('--force', action='store_true', dest='force', help='rebuild every stage')
+    args = parser.parse_args()
+
+    timings = build_pipeline(args.routes, args.ratings, args.curated, args.quality, args.cache_dir,
+                             args.max_entries).run(args.jobs, args.force)
+    print()
+    print_timings(timings)
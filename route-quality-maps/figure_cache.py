@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import sqlite3
+
+class figure_cache(object):
+
+    """
+        a bounded LRU cache of serialized figures in a local SQLite file, shared by every worker process on the host
+
+        Keys are the normalized filter values plus a data version, so figures built from an older data file are never
+        served. Hits and misses are counted in the same file, so stats() reports the hit rate across all workers.
+    """
+
+    def __init__(self, path, max_entries=512, version=''):
+
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version
+        self._conn = None
+        self._pid = None
+
+    def connection(self):
+
+        if self._pid != os.getpid(): # connections must not be shared with forked workers
+            # created readable by this user only, SQLite gives its WAL files the same permissions
+            os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS figures (key TEXT PRIMARY KEY, value TEXT, last_used REAL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, count INTEGER)')
+            self._conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+            self._pid = os.getpid()
+
+        return self._conn
+
+    def key(self, *filters):
+        return json.dumps([self.version] + list(filters))
+
+    def get(self, key):
+
+        conn = self.connection()
+        row = conn.execute('SELECT value FROM figures WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            conn.execute("UPDATE counters SET count = count + 1 WHERE name = 'misses'")
+            return None
+
+        conn.execute('UPDATE figures SET last_used = ? WHERE key = ?', (time.time(), key))
+        conn.execute("UPDATE counters SET count = count + 1 WHERE name = 'hits'")
+
+        return row[0]
+
+    def put(self, key, value):
+
+        conn = self.connection()
+        conn.execute('INSERT OR REPLACE INTO figures VALUES (?, ?, ?)', (key, value, time.time()))
+        conn.execute('DELETE FROM figures WHERE key IN (SELECT key FROM figures ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                     (self.max_entries,)) # evict the least recently used entries
+
+    def stats(self):
+
+        conn = self.connection()
+        counts = dict(conn.execute('SELECT name, count FROM counters').fetchall())
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM figures').fetchone()
+        requests = counts['hits'] + counts['misses']
+
+        return {'hits': counts['hits'], 'misses': counts['misses'], 'hit_rate': counts['hits'] / requests if requests else 0.0,
+                'entries': entries, 'max_entries': self.max_entries, 'bytes': size}
+
+    def clear(self):
+
+        conn = self.connection()
+        conn.execute('DELETE FROM figures')
+        conn.execute('UPDATE counters SET count = 0')
+
+def data_version(path):
+
+    """
+        identifies a data file (or a column store directory, by its manifest) by size and modification time
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, 'manifest.json')
+
+    stat = os.stat(path)
+    return f'{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}'
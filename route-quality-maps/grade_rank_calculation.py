@@ -1,42 +1,92 @@
 import re
+import warnings
+import functools
+import numpy as np
+import pandas as pd
+
+# e.g. V7-8 would be calculated as 7*10 + 2
+WEIGHT_DICT = {'YDS': {'a': 0, 'a/b': 1, '-': 1, 'b':2, 'b/c':3, 'not_given':3, 'c':4, 'c/d':5, '+':5, 'd':6},
+               'Vermin': {'-': 0, 'not_given': 1,  '+': 2, 'range': 2}}
+
+RANGE_RE = re.compile(r'\d{1,2}-\d{1,2}')
+NON_DIGITS_RE = re.compile('[^0-9]')
+DIGITS_RE = re.compile('[0-9]')
+
+@functools.lru_cache(maxsize=1024)
+def parse_grade_rank(grade):
 
-def calculate_grade_rank(grade):
-    
     """
-        function to calculate unambiguous rock climb grades, the grade should be passed as a string, e.g. "V7" or "5.10a"
+        the rank of one grade string, memoized (bounded, as the app passes user-entered strings) since there
+        are only a few hundred distinct grades
     """
-    
-    weight_dict = {'YDS': {'a': 0, 'a/b': 1, '-': 1, 'b':2, 'b/c':3, 'not_given':3, 'c':4, 'c/d':5, '+':5, 'd':6},
-               'Vermin': {'-': 0, 'not_given': 1,  '+': 2, 'range': 2}} # e.g. V7-8 would be calculated as 7*10 + 2
-    
-    if grade == None:
-        return grade
-    
-    elif 'V' in grade:
+
+    if 'V' in grade:
         grade_type = 'Vermin'
         noV = grade.replace('V', '')
-        ran = re.match(r'\d{1,2}-\d{1,2}', noV) # check if the grade is given as a range
-        num = int(re.sub('[^0-9]', '', noV.split('-')[0]))
-        non_num = re.sub('[0-9]', '', noV)
-        
+        ran = RANGE_RE.match(noV) # check if the grade is given as a range
+        num = int(NON_DIGITS_RE.sub('', noV.split('-')[0]))
+        non_num = DIGITS_RE.sub('', noV)
+
     elif '5.' in grade:
         grade_type = 'YDS'
         no5 = grade.split('.')[-1]
-        num = int(re.sub('[^0-9]', '', no5))
-        non_num = re.sub('[0-9]', '', no5)
+        num = int(NON_DIGITS_RE.sub('', no5))
+        non_num = DIGITS_RE.sub('', no5)
         ran = None # not using range grades here, e.g. a/b has its own entry in the weight dict
-        
+
     else:
         message = ' '.join(['grade format of', grade, 'does not match the YDS or Vermin systems.'])
         raise ValueError(message)
-    
+
     non_num = 'not_given' if non_num == '' else non_num
-    wdict = weight_dict[grade_type]
+    wdict = WEIGHT_DICT[grade_type]
     weight = wdict['range'] if ran else wdict[non_num]
     rank = 10 * num + weight
-   
+
     return rank
 
+def calculate_grade_rank(grade):
+    
+    """
+        function to calculate unambiguous rock climb grades, the grade should be passed as a string, e.g. "V7" or "5.10a"
+    """
+    
+    if grade == None:
+        return grade
+
+    return parse_grade_rank(grade)
+
+def grade_ranks(series, errors='warn'):
+
+    """
+        calculate_grade_rank for a whole column of grades, returned as a float Series (NaN for None/NaN)
+        each distinct grade is ranked once and the ranks are mapped back to the rows with a single take;
+        grades that cannot be ranked also become NaN and are reported once the whole column is done,
+        with errors='warn' (a warning), 'raise' (a ValueError) or 'ignore'
+    """
+
+    codes, uniques = pd.factorize(series) # None/NaN get code -1
+    table = np.full(len(uniques) + 1, np.nan) # so code -1 picks the trailing NaN
+
+    invalid = []
+    for i, grade in enumerate(uniques):
+        try:
+            table[i] = parse_grade_rank(grade)
+        except (ValueError, KeyError, TypeError):
+            invalid.append(i)
+
+    ranks = pd.Series(table[codes], index=series.index, name=series.name)
+
+    if invalid and errors != 'ignore':
+        counts = pd.Series(codes).value_counts()
+        message = ', '.join(f'{uniques[i]!r} ({counts[i]} rows)' for i in invalid)
+        message = ' '.join([str(len(invalid)), 'grades do not match the YDS or Vermin systems:', message])
+        if errors == 'raise':
+            raise ValueError(message)
+        warnings.warn(message)
+
+    return ranks
+
 if __name__ == '__main__':
 
     example_grades = ['V8-9', 'V9', 'V10-', 'V10', 'V10+', 'V10-11', '5.8', '5.9', '5.9+', '5.12a', '5.12a/b',
@@ -1,54 +1,316 @@
+import json
+import time
+import inspect
+import argparse
 import numpy as np
-import pandas as pd
-import plotly.graph_objects as go
+from concurrent.futures import ProcessPoolExecutor
 from grade_rank_calculation import calculate_grade_rank
-from mpu import haversine_distance
+from sector_aggregation import lon_lat
+from column_store import load_route_data
+from figure_cache import figure_cache, data_version
 from scipy.optimize import differential_evolution
 from multiprocessing import cpu_count
 
+EARTH_RADIUS_KM = 6371.0
+
+BLOCK_SIZE = 2**16 # (location, route) pairs per block of a population, to keep the temporaries in cache
+BOUNDS = [(36.5,49), (-123.9157,-69.2246)] # (lat, lon) of the contiguous US
+
+_worker_optimizer = None  # the optimizer used by pool workers
+
+def haversine_km(lat0, lon0, lat1, lon1, cos_lat0=None):
+
+    """
+        great circle distance in km between points given in radians, broadcasting like any NumPy expression
+        (cos_lat0 may be passed precomputed)
+    """
+
+    cos_lat0 = np.cos(lat0) if cos_lat0 is None else cos_lat0
+    a = np.sin((lat1 - lat0) / 2)**2 + cos_lat0 * np.cos(lat1) * np.sin((lon1 - lon0) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
 class location_optimizer(object):
 
-    def __init__(self, df, starting_loc=np.array([39.5501, -105.7281]), metric='ARQI_median', 
-                 route_type='all', grade_range='all'):
+    """
+        finds the location with the lowest total energy -sum(quality / distance^2) over the selected routes
+
+        The route coordinates and qualities are kept as contiguous float arrays, so the energy of a location (or of a whole
+        population of locations, see population_energy) is one NumPy haversine over all routes. With far_field=True the
+        routes are also binned into cells of cell_deg degrees: cells whose centroid is more than far_km away from a location
+        count as a single point at their quality weighted centroid with their summed quality, and only the routes of the
+        nearer cells are evaluated one by one.
+
+        Locations within exclusion_km of an excluded location (see top_locations) get a positive energy, worse than any
+        location outside, that grows with their depth into the excluded disc, so searches are pushed out of it rather than
+        stalling on a plateau.
+    """
+
+    def __init__(self, df, starting_loc=np.array([39.5501, -105.7281]), metric='ARQI_median',
+                 route_type='all', grade_range='all', far_field=False, cell_deg=0.5, far_km=250.0):
 
         if route_type != 'all':
-            df = df[df['type_string'] == route_type].copy()
-            
+            df = df[df['type_string'] == route_type]
+
         if grade_range != 'all':
             lo,hi = grade_range.split('-')
             lo_rank = calculate_grade_rank(lo)
-            hi_rank = calculate_grade_rank(hi)                
-            df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)].copy()
+            hi_rank = calculate_grade_rank(hi)
+            df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)]
+
+        df = df[df[metric].notna()]
+        loc = np.radians(lon_lat(df))
+
+        self.lat = np.ascontiguousarray(loc[:, 1])
+        self.lon = np.ascontiguousarray(loc[:, 0])
+        self.quals = df[metric].to_numpy(dtype=float)
+        self.cos_lat = np.cos(self.lat)
+
+        self.far_field = far_field
+        self.far_km = far_km
+        self.excluded = np.empty((2, 0)) # (lat, lon) in radians
+        self.exclusion_km = 0.0
+        if far_field:
+            self.build_grid(np.radians(cell_deg))
+
+        self.n_evals = 0
+        self.eval_seconds = 0.0
+
+    def build_grid(self, cell):
 
-        df['parent_loc'] = df.apply(lambda row: np.array(row['parent_loc'][::-1]), axis=1)
+        """
+            sorts the routes by grid cell and keeps each cell's route slice, summed quality and quality weighted centroid
+        """
 
-        self.quals = df[metric]
-        self.locs = df['parent_loc']
-        
-    def energy(self, quality, loc0, loc1, eps=1.0e-6):
-    
-        dist = haversine_distance(loc0, loc1) + eps
+        cell_ids, route_cell = np.unique(np.stack([np.floor(self.lat / cell), np.floor(self.lon / cell)]), axis=1,
+                                         return_inverse=True)
+        order = np.argsort(route_cell.ravel(), kind='stable')
+        route_cell = route_cell.ravel()[order]
+        self.lat, self.lon, self.quals, self.cos_lat = self.lat[order], self.lon[order], self.quals[order], self.cos_lat[order]
+
+        n_cells = cell_ids.shape[1]
+        counts = np.bincount(route_cell, minlength=n_cells)
+        self.cell_starts = np.cumsum(counts) - counts
+        self.cell_counts = counts
+        self.cell_quals = np.bincount(route_cell, weights=self.quals, minlength=n_cells)
+
+        # cells whose qualities sum to zero contribute nothing, their centroid is the plain mean position
+        weighted = self.cell_quals > 0
+        for name, coord in (('cell_lat', self.lat), ('cell_lon', self.lon)):
+            mean = np.bincount(route_cell, weights=coord, minlength=n_cells) / counts
+            centroid = np.bincount(route_cell, weights=self.quals * coord, minlength=n_cells)
+            setattr(self, name, np.divide(centroid, self.cell_quals, out=mean, where=weighted))
+        self.cell_cos_lat = np.cos(self.cell_lat)
+
+    def energy(self, quality, lat, lon, lat0, lon0, cos_lat=None, eps=1.0e-6):
+
+        dist = haversine_km(lat, lon, lat0, lon0, cos_lat) + eps
         return -quality/(dist*dist)
-    
+
+    def near_routes(self, near_cells):
+
+        counts = self.cell_counts[near_cells]
+        offsets = np.cumsum(counts) - counts
+        return np.arange(counts.sum()) + np.repeat(self.cell_starts[near_cells] - offsets, counts)
+
+    def population_energy(self, locs):
+
+        """
+            total energies of a (2, S) array of S (lat, lon) locations in degrees, the layout differential_evolution
+            passes to a vectorized objective; a single (lat, lon) location gives a scalar
+        """
+
+        start = time.perf_counter()
+        locs = np.asarray(locs, dtype=float)
+        lat0, lon0 = np.radians(locs.reshape(2, -1))
+
+        if not self.far_field:
+            TE = np.empty(len(lat0))
+            block = max(1, BLOCK_SIZE // max(len(self.quals), 1))
+            for b in range(0, len(lat0), block):
+                TE[b:b + block] = self.energy(self.quals, self.lat, self.lon, lat0[b:b + block, None],
+                                              lon0[b:b + block, None], self.cos_lat).sum(axis=1)
+        else:
+            cell_dist = haversine_km(self.cell_lat, self.cell_lon, lat0[:, None], lon0[:, None], self.cell_cos_lat)
+            far = cell_dist > self.far_km
+            TE = -np.where(far, self.cell_quals / (cell_dist + 1.0e-6)**2, 0.0).sum(axis=1)
+            for s in range(len(lat0)):
+                near = self.near_routes(np.flatnonzero(~far[s]))
+                TE[s] += self.energy(self.quals[near], self.lat[near], self.lon[near], lat0[s], lon0[s],
+                                     self.cos_lat[near]).sum()
+
+        if self.excluded.shape[1]:
+            excluded_dist = haversine_km(self.excluded[0], self.excluded[1], lat0[:, None], lon0[:, None])
+            depth = self.exclusion_km - excluded_dist.min(axis=1)
+            TE = np.where(depth > 0, depth, TE)
+
+        self.n_evals += len(lat0)
+        self.eval_seconds += time.perf_counter() - start
+
+        return TE if locs.ndim > 1 else TE[0]
+
     def total_energy(self, loc):
-        
-        TE = 0.0
+        return self.population_energy(np.asarray(loc, dtype=float).reshape(2))
+
+    def evals_per_second(self):
+        return self.n_evals / self.eval_seconds if self.eval_seconds else 0.0
+
+    def run(self, seed=None, popsize=15, maxiter=1000, tol=0.01, disp=False):
+
+        """
+            one differential evolution search, returns the optimum as a dict of lat, lon, energy, the seed, the number of
+            generations, evaluations and evaluations per second, seconds and success
+        """
+
+        self.n_evals, self.eval_seconds = 0, 0.0
+
+        # evaluate each generation as one batch: scipy >= 1.9 takes a vectorized objective, older versions accept
+        # a map-like for workers, which receives the whole population
+        if 'vectorized' in inspect.signature(differential_evolution).parameters:
+            batch = {'vectorized': True}
+        else:
+            batch = {'workers': lambda func, population: self.population_energy(np.array(list(population)).T)}
+
+        start = time.perf_counter()
+        res = differential_evolution(self.population_energy, BOUNDS, seed=seed, popsize=popsize, maxiter=maxiter, tol=tol,
+                                     polish=True, updating='deferred', disp=disp, **batch)
+
+        return {'lat': float(res.x[0]), 'lon': float(res.x[1]), 'energy': float(res.fun), 'seed': seed, 'nit': int(res.nit),
+                'n_evals': self.n_evals, 'evals_per_second': self.evals_per_second(),
+                'seconds': time.perf_counter() - start, 'success': bool(res.success)}
+
+    def exclude(self, optima, exclusion_km):
+
+        self.excluded = np.radians(np.array([[o['lat'] for o in optima], [o['lon'] for o in optima]], dtype=float))
+        self.exclusion_km = exclusion_km
+
+    def optimize(self, starts=1, workers=None, seed=0, pool=None, **options):
+
+        """
+            the best of `starts` searches with seeds seed, seed + 1, ..., run in a process pool of `workers`
+            (default: one per core, up to the number of starts) when there is more than one
+        """
+
+        seeds = [None if seed is None else seed + i for i in range(starts)]
+        if starts == 1:
+            return self.run(seed=seeds[0], **options)
+
+        jobs = [(s, self.excluded, self.exclusion_km, options) for s in seeds]
+        if pool is None:
+            with optimizer_pool(self, workers or min(starts, cpu_count())) as pool:
+                optima = list(pool.map(run_in_worker, jobs))
+        else:
+            optima = list(pool.map(run_in_worker, jobs))
+
+        return min(optima, key=lambda o: o['energy'])
+
+    def top_locations(self, k=5, exclusion_km=100.0, starts=1, workers=None, seed=0, **options):
+
+        """
+            the k best distinct locations: each search excludes everything within exclusion_km of the optima found
+            before it, so the k optima are more than exclusion_km apart; ranked by energy
+        """
+
+        optima = []
+        pool = optimizer_pool(self, workers or min(starts, cpu_count())) if starts > 1 else None
+
+        try:
+            for i in range(k):
+                self.exclude(optima, exclusion_km)
+                round_seed = None if seed is None else seed + i * starts
+                optima.append(self.optimize(starts, seed=round_seed, pool=pool, **options))
+        finally:
+            self.exclude([], 0.0)
+            if pool is not None:
+                pool.shutdown()
+
+        # searches are stochastic, a later one can find a better optimum than an earlier one settled for
+        return [dict(o, rank=i + 1) for i, o in enumerate(sorted(optima, key=lambda o: o['energy']))]
+
+def init_optimizer_worker(optimizer):
+
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+
+def run_in_worker(job):
+
+    seed, excluded, exclusion_km, options = job
+    _worker_optimizer.excluded, _worker_optimizer.exclusion_km = excluded, exclusion_km
+
+    return _worker_optimizer.run(seed=seed, **options)
+
+def optimizer_pool(optimizer, workers):
+
+    """
+        a process pool whose workers each hold the optimizer (sent once per worker, not with every search)
+    """
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_optimizer_worker, initargs=(optimizer,))
+
+def best_locations(data, metric='ARQI_median', route_type='all', grade_range='all', k=1, exclusion_km=100.0,
+                   far_field=False, starts=1, workers=None, seed=0, popsize=15, maxiter=1000, tol=0.01, cache_path=None):
+
+    """
+        the top_locations of the route data file for a metric, route type and grade range
+
+        With a cache_path the optima are kept in a figure_cache keyed by these arguments (not workers, which do not change
+        the result, but the differential evolution popsize, maxiter and tol) and by the data file's version, so a repeated
+        query returns without loading the data.
+    """
+
+    cache = figure_cache(cache_path, version=data_version(data)) if cache_path else None
+    key = cache.key(metric, route_type, grade_range, k, exclusion_km, far_field, starts, seed, popsize, maxiter,
+                    tol) if cache else None
 
-        for qual, pos in zip(self.quals, self.locs):
-            TE += self.energy(qual, pos, loc)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
 
-        return TE
+    optimizer = location_optimizer(load_route_data(data), metric=metric, route_type=route_type, grade_range=grade_range,
+                                   far_field=far_field)
+    optima = optimizer.top_locations(k, exclusion_km, starts=starts, workers=workers, seed=seed, popsize=popsize,
+                                     maxiter=maxiter, tol=tol)
 
-    def optimize(self):
+    if cache is not None:
+        cache.put(key, json.dumps(optima))
 
-        bounds = [(36.5,49), (-123.9157,-69.2246)]
+    return optima
 
-        res = differential_evolution(self.total_energy, bounds, polish=True, disp=True)
+if __name__ == '__main__':
 
-        print(res)
- 
-df = pd.read_pickle('RouteQualityData.pkl.zip', compression='zip')
-LO = location_optimizer(df, grade_range='5.13a-5.13b', route_type='sport')
-LO.optimize()
+    parser = argparse.ArgumentParser(description='Find the best climbing locations for a metric, route type and grade range')
+    parser.add_argument('-d', action='store', dest='data', type=str,
+                        required=False, default='RouteQualityData.pkl.zip', help='the route quality data, or a column store directory')
+    parser.add_argument('-m', action='store', dest='metric', type=str,
+                        required=False, default='ARQI_median', help='the quality metric')
+    parser.add_argument('-t', action='store', dest='route_type', type=str,
+                        required=False, default='sport', help='the route type (trad, sport or all)')
+    parser.add_argument('-g', action='store', dest='grade_range', type=str,
+                        required=False, default='5.13a-5.13b', help='the grade range, e.g. 5.10a-5.11d, or all')
+    parser.add_argument('-k', action='store', dest='k', type=int,
+                        required=False, default=1, help='the number of distinct locations to find')
+    parser.add_argument('-x', action='store', dest='exclusion_km', type=float,
+                        required=False, default=100.0, help='the minimum distance between the locations in km')
+    parser.add_argument('-s', action='store', dest='starts', type=int,
+                        required=False, default=1, help='independent searches per location, the best is kept')
+    parser.add_argument('-j', action='store', dest='workers', type=int,
+                        required=False, default=None, help='the number of worker processes for the searches')
+    parser.add_argument('-r', action='store', dest='seed', type=int,
+                        required=False, default=0, help='the seed of the first search')
+    parser.add_argument('-c', action='store', dest='cache', type=str,
+                        required=False, default='location_optima.sqlite', help='the result cache file (empty for none)')
+    parser.add_argument('--far-field', action='store_true', dest='far_field',
+                        help='approximate distant routes by grid cell centroids')
+    args = parser.parse_args()
 
+    start = time.perf_counter()
+    optima = best_locations(args.data, args.metric, args.route_type, args.grade_range, k=args.k, exclusion_km=args.exclusion_km,
+                            far_field=args.far_field, starts=args.starts, workers=args.workers, seed=args.seed,
+                            cache_path=args.cache or None)
 
+    print('{:<6} {:<10} {:<11} {:<16} {:<12} {:<12}'.format(*['rank', 'lat', 'lon', 'energy', 'evals', 'evals/s']))
+    print('-'*72)
+    for o in optima:
+        print('{:<6} {:<10.4f} {:<11.4f} {:<16.6g} {:<12} {:<12,.0f}'.format(
+            o['rank'], o['lat'], o['lon'], o['energy'], o['n_evals'], o['evals_per_second']))
+    print(f'{time.perf_counter() - start:.2f} s')
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+from sector_aggregation import lon_lat
+
+TILE_PX = 512 # mapbox renders the world as 512 * 2^zoom pixels
+MAX_LAT = 85.0511
+
+def web_mercator(lon, lat):
+
+    """
+        lon/lat in degrees to web mercator x, y in [0, 1) (y grows southwards, like the map)
+    """
+
+    lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lon) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+
+    return x, y
+
+def inverse_web_mercator(x, y):
+
+    lon = 360.0 * np.asarray(x) - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y)))))
+
+    return lon, lat
+
+def viewport(relayout_data, cell_px=48):
+
+    """
+        (zoom level, (x0, y0, x1, y1) mercator bounds or None) of the map from the Graph's relayoutData
+
+        The zoom is floored and the bounds are snapped outwards to the clustering grid at that zoom, so nearby views
+        give the same viewport (and share cached figures) and clusters do not shift while panning.
+    """
+
+    relayout_data = relayout_data or {}
+    zoom = int(np.floor(relayout_data.get('mapbox.zoom', 3.5)))
+    corners = relayout_data.get('mapbox._derived', {}).get('coordinates')
+
+    if not corners:
+        return zoom, None
+
+    x, y = web_mercator(*np.array(corners, dtype=float).T)
+    cells = TILE_PX * 2**zoom / cell_px
+    bounds = (np.floor(x.min() * cells) / cells, np.floor(y.min() * cells) / cells,
+              np.ceil(x.max() * cells) / cells, np.ceil(y.max() * cells) / cells)
+
+    return zoom, tuple(float(b) for b in bounds)
+
+class sector_grid(object):
+
+    """
+        web mercator coordinates of every sector, computed once from the route data, for clustering sector tables
+        (as returned by aggregate_sectors or sector_cube.query) on a zoom-dependent pixel grid
+    """
+
+    def __init__(self, sector_ids, x, y):
+
+        self.sector_ids = sector_ids # sorted
+        self.x = x
+        self.y = y
+
+    @classmethod
+    def build(cls, df):
+
+        first = df.drop_duplicates(subset=['sector_ID']).sort_values('sector_ID')
+        loc = lon_lat(first)
+        x, y = web_mercator(loc[:, 0], loc[:, 1])
+
+        return cls(first['sector_ID'].to_numpy(), x, y)
+
+    def xy(self, sector_ids):
+
+        pos = np.searchsorted(self.sector_ids, sector_ids)
+        return self.x[pos], self.y[pos]
+
+    def cluster(self, df_agg, zoom, bounds=None, cell_px=48, detail_zoom=9, max_points=2000):
+
+        """
+            the sectors in bounds, merged into one marker per grid cell of cell_px pixels below detail_zoom (or when more
+            than max_points sectors are in view), so the number of markers is bounded by the number of cells on screen
+
+            A cluster's marker is at the mean position of its sectors and sums their num_routes and NRGT; its label
+            gives the number of sectors, and its best route is the best of its sectors' best routes.
+        """
+
+        x, y = self.xy(df_agg['sector_ID'].to_numpy())
+
+        if bounds is not None:
+            x0, y0, x1, y1 = bounds
+            in_view = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            df_agg, x, y = df_agg[in_view].reset_index(drop=True), x[in_view], y[in_view]
+
+        df_agg = df_agg.assign(n_sectors=1)
+        if zoom >= detail_zoom and len(df_agg) <= max_points:
+            return df_agg
+
+        cells = TILE_PX * 2**zoom / cell_px
+        cell_ids, cluster = np.unique(np.floor(x * cells) * (cells + 1) + np.floor(y * cells), return_inverse=True)
+        n_clusters = len(cell_ids)
+
+        n_sectors = np.bincount(cluster, minlength=n_clusters)
+        lon, lat = inverse_web_mercator(np.bincount(cluster, weights=x, minlength=n_clusters) / n_sectors,
+                                        np.bincount(cluster, weights=y, minlength=n_clusters) / n_sectors)
+
+        # best route of each cluster: highest best_metric, ties to the first sector
+        metric = df_agg['best_metric'].to_numpy(dtype=float)
+        order = np.lexsort((np.arange(len(df_agg)), -np.where(np.isnan(metric), -np.inf, metric), cluster))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = cluster[order][1:] != cluster[order][:-1]
+        best = df_agg.iloc[order[first]].reset_index(drop=True)
+
+        label = np.where(n_sectors > 1, pd.Series(n_sectors).astype(str) + ' sectors', best['parent_sector'].astype(str))
+
+        return pd.DataFrame({'sector_ID': best['sector_ID'],
+                             'parent_sector': label,
+                             'num_routes': np.bincount(cluster, weights=df_agg['num_routes'], minlength=n_clusters).astype(np.int64),
+                             'NRGT': np.bincount(cluster, weights=df_agg['NRGT'], minlength=n_clusters).astype(np.int64),
+                             'lat': lat,
+                             'lon': lon,
+                             'best_name': best['best_name'],
+                             'best_metric': best['best_metric'],
+                             'best_grade': best['best_grade'],
+                             'n_sectors': n_sectors})
@@ -0,0 +1,70 @@
+import os
+import argparse
+
+def smaps_rollup(pid):
+
+    """
+        the memory totals of a process in kB (Rss, Pss, Shared_Clean, Private_Dirty, ...), from /proc/<pid>/smaps_rollup
+    """
+
+    totals = {}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as rollup:
+        for line in rollup:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == 'kB':
+                totals[fields[0].rstrip(':')] = int(fields[1])
+
+    return totals
+
+def children(pid):
+
+    kids = []
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children', 'r') as task_children:
+            kids += [int(p) for p in task_children.read().split()]
+
+    return kids
+
+def gunicorn_master():
+
+    """
+        the pid of the oldest gunicorn process (the master)
+    """
+
+    pids = []
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as cmdline:
+                if b'gunicorn' in cmdline.read():
+                    pids.append(int(pid))
+        except OSError:
+            continue
+
+    return min(pids) if pids else None
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Report the memory of the gunicorn master and its workers (Linux only)')
+    parser.add_argument('-p', action='store', dest='pid', type=int,
+                        required=False, default=None, help='the master pid (default: the oldest gunicorn process)')
+    args = parser.parse_args()
+
+    master = args.pid or gunicorn_master()
+    if master is None:
+        raise SystemExit('no gunicorn process found')
+
+    fields = ['Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty']
+    print('{:<10} {:<8} '.format(*['process', 'pid']) + ' '.join('{:<14}'.format(f + ' (MB)') for f in fields))
+    print('-'*104)
+
+    totals = dict.fromkeys(fields, 0)
+    for role, pid in [('master', master)] + [('worker', p) for p in children(master)]:
+        mem = smaps_rollup(pid)
+        for f in fields:
+            totals[f] += mem.get(f, 0)
+        print('{:<10} {:<8} '.format(*[role, pid]) + ' '.join('{:<14.1f}'.format(mem.get(f, 0) / 1024) for f in fields))
+
+    print('-'*104)
+    print('{:<19} '.format('total') + ' '.join('{:<14.1f}'.format(totals[f] / 1024) for f in fields))
+    print()
+    print('Pss splits shared pages between the processes that map them, so the Pss total is the real footprint.')
@@ -1,7 +1,13 @@
+import os
+import json
 import numpy as np
-import pandas as pd
 import plotly.graph_objects as go
 from grade_rank_calculation import calculate_grade_rank
+from sector_aggregation import aggregate_sectors, marker_sizes
+from sector_cube import sector_cube
+from figure_cache import figure_cache, data_version
+from column_store import load_route_data
+from map_clustering import sector_grid, viewport
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
@@ -10,7 +16,13 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 from flask import Flask
 
-DF = pd.read_pickle('RouteQualityData.pkl.zip', compression='zip')
+DATA = os.environ.get('RQM_DATA', 'RouteQualityData.pkl.zip') # or a column store directory, see column_store.py
+DF = load_route_data(DATA)
+CUBE = sector_cube.build(DF) # answers the map filters without touching the route rows
+SECTOR_GRID = sector_grid.build(DF)
+FIGURE_CACHE = figure_cache(os.environ.get('RQM_FIGURE_CACHE', '/tmp/rqm_figure_cache.sqlite'),
+                            max_entries=int(os.environ.get('RQM_FIGURE_CACHE_SIZE', 512)),
+                            version=data_version(DATA))
 AT = open('.mapbox_token').read()
 present_states = ['all'] + list(sorted(set(DF['state'])))
 
@@ -205,7 +217,8 @@ app.layout = html.Div([
 
 @app.callback(
     Output(component_id='mymap', component_property='figure'),
-    [Input(component_id='button', component_property='n_clicks')],
+    [Input(component_id='button', component_property='n_clicks'),
+     Input(component_id='mymap', component_property='relayoutData')],
     [State(component_id='route_type', component_property='value'),
      State(component_id='metric', component_property='value'),
      State(component_id='state', component_property='value'),
@@ -214,7 +227,7 @@ app.layout = html.Div([
      State(component_id='max_grade', component_property='value')],
 )
 
-def update_map(n_clicks, route_type, metric, state, metric_threshold, min_grade, max_grade):
+def update_map(n_clicks, relayout_data, route_type, metric, state, metric_threshold, min_grade, max_grade):
 
     if not n_clicks:
        raise PreventUpdate
@@ -237,84 +250,91 @@ def update_map(n_clicks, route_type, metric, state, metric_threshold, min_grade,
     if max_grade is None:
         max_grade = '5.15a'
 
-    df = DF.copy()
-
-    if route_type != 'all':
-        df = df[df['type_string'] == route_type].copy()
-
-    if state != 'all':
-        df = df[df['state'] == state].copy()
-     
     lo, hi = min_grade, max_grade
     lo_rank = calculate_grade_rank(lo)
     hi_rank = calculate_grade_rank(hi)                
-    df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)].copy()
-    
-    cols = ['route_name', 'nopm_YDS', 'safety', metric]        
-    df_agg = df.groupby('sector_ID')['route_name', 'nopm_YDS', 'safety', metric].agg(lambda x: list(x))
-    df_agg.columns = cols
-
-    df_agg['sector_ID'] = df_agg.index
-    df_agg.index = range(len(df_agg.index))
-    name_loc = df[['parent_sector', 'sector_ID', 'parent_loc']].copy()
-    name_loc = name_loc.drop_duplicates(subset=['sector_ID'])
-    df_agg = pd.merge(df_agg, name_loc, on='sector_ID')
-    
-    df_agg['num_routes'] = df_agg.apply(lambda row: len(row['route_name']), axis=1)
-    df_agg['NRGT'] = df_agg.apply(lambda row: len([r for r in row[metric] if r >= metric_threshold]), axis=1)
-    df_agg['lat'] = df_agg.apply(lambda row: row['parent_loc'][1], axis=1)
-    df_agg['lon'] = df_agg.apply(lambda row: row['parent_loc'][0], axis=1)
-    df_agg['best_route'] = df_agg.apply(lambda row: 
-      [(n, np.round(m,2), g) for n,m,g in zip(row['route_name'],row[metric],row['nopm_YDS']) 
-      if m == max(row[metric])][0], axis=1)
-    
-    sizenorm = max(df_agg['NRGT'])
-    df_agg['size'] = 0
-    sizes = np.linspace(0, sizenorm, num=6)
-    size_limits = [(sizes[i], sizes[i+1], (i+1)*7) for i in range(len(sizes)-1)]
-    
-    for ll,hl,size in size_limits:
-        df_agg.loc[(df_agg['NRGT'] > ll) & (df_agg['NRGT'] <= hl), 'size'] = size
-    df_agg.loc[df_agg['NRGT'] == 0, 'size'] = 5
-            
-    data = go.Scattermapbox(
-        lat = df_agg['lat'],
-        lon = df_agg['lon'],
-        mode='markers',
-        marker = dict(size=df_agg['size'],
-                      color=df_agg['NRGT'],
-                      reversescale=False,
-                      cmin=0,
-                      cmax=sizenorm-0.10*sizenorm,
-                      colorscale='Inferno',
-                      colorbar_title='# Routes<br>\u2265 Min'),
-        customdata=np.c_[df_agg['parent_sector'], 
-                         df_agg['num_routes'],
-                         df_agg['NRGT'],
-                         df_agg['best_route']],
-        hovertemplate=
-        '<b>%{customdata[0]}</b><br>' +
-        'Total Routes: %{customdata[1]}<br>' +
-        'Routes \u2265 Min Quality: %{customdata[2]}<br><br>' +
-        '<b>Best Route</b><br>' + 
-        'Name: %{customdata[3][0]}<br>' +
-        'Grade: %{customdata[3][2]}<br>' +
-        'Rating: %{customdata[3][1]} stars' +
-        '<extra></extra>'
-        )
+
+    # only the sectors in view are sent, clustered on a grid below street-level zoom
+    zoom, bounds = viewport(relayout_data)
+
+    # equivalent grades (e.g. 5.10- and 5.10a/b) have the same rank, so they share a cache entry
+    key = FIGURE_CACHE.key(route_type, metric, state, float(metric_threshold), lo_rank, hi_rank, zoom, bounds)
+    cached = FIGURE_CACHE.get(key)
+    if cached is not None:
+        figure = json.loads(cached)
+        figure['layout']['mapbox']['accesstoken'] = AT # figures are cached without the token
+        return figure
+
+    if CUBE.answers(route_type, metric, metric_threshold):
+        df_agg = CUBE.query(route_type, metric, metric_threshold, state=state, lo_rank=lo_rank, hi_rank=hi_rank)
+
+    else: # filters the cube does not cover (e.g. a threshold off its grid), filter the routes
+        df = DF
+
+        if route_type != 'all':
+            df = df[df['type_string'] == route_type]
+
+        if state != 'all':
+            df = df[df['state'] == state]
+
+        df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)]
+        df_agg = aggregate_sectors(df, metric, metric_threshold)
+
+    df_agg = SECTOR_GRID.cluster(df_agg, zoom, bounds)
+
+    sizenorm = max(df_agg['NRGT'], default=0)
+    df_agg['size'] = marker_sizes(df_agg['NRGT'], zero_size=5)
+
+    if df_agg.empty: # no sector in view (e.g. panned over the ocean), an empty map with the same layout
+        data = go.Scattermapbox(lat=[], lon=[], mode='markers')
+    else:
+        data = go.Scattermapbox(
+            lat = df_agg['lat'],
+            lon = df_agg['lon'],
+            mode='markers',
+            marker = dict(size=df_agg['size'],
+                          color=df_agg['NRGT'],
+                          reversescale=False,
+                          cmin=0,
+                          cmax=sizenorm-0.10*sizenorm,
+                          colorscale='Inferno',
+                          colorbar_title='# Routes<br>\u2265 Min'),
+            customdata=np.c_[df_agg['parent_sector'], 
+                             df_agg['num_routes'],
+                             df_agg['NRGT'],
+                             df_agg['best_name'],
+                             df_agg['best_metric'],
+                             df_agg['best_grade']],
+            hovertemplate=
+            '<b>%{customdata[0]}</b><br>' +
+            'Total Routes: %{customdata[1]}<br>' +
+            'Routes \u2265 Min Quality: %{customdata[2]}<br><br>' +
+            '<b>Best Route</b><br>' + 
+            'Name: %{customdata[3]}<br>' +
+            'Grade: %{customdata[5]}<br>' +
+            'Rating: %{customdata[4]} stars' +
+            '<extra></extra>'
+            )
     
     layout = dict(margin=dict(l=0, t=0, r=0, b=0, pad=0),
                   mapbox=dict(center=dict(lat=39,lon=-95),
                               style='light',
-                              zoom=3.5,
-                              accesstoken=AT),
+                              zoom=3.5),
                   geo=dict(scope='usa',
-                           projection_type='albers usa'))
+                           projection_type='albers usa'),
+                  uirevision='map') # keep the user's pan and zoom when the figure is replaced
     
+    # the token is left out of the cached figure, so it is never written to disk and a new token applies to cached figures
     fig = go.Figure(data=data, layout=layout)    
+    FIGURE_CACHE.put(key, fig.to_json())
+    fig.update_layout(mapbox_accesstoken=AT)
 
     return fig
 
+@server.route('/cache_stats')
+def cache_stats():
+    return FIGURE_CACHE.stats()
+
 if __name__ == '__main__':
     #app.run_server()
     app.run_server(port=8000)
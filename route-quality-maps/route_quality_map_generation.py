@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from grade_rank_calculation import calculate_grade_rank
+from sector_aggregation import aggregate_sectors, marker_sizes
 
 AT = open('.mapbox_token').read()
 
@@ -16,32 +17,10 @@ def route_quality_map_with_filters(df, fname='quality_map', metric='ARQI_median'
         hi_rank = calculate_grade_rank(hi)                
         df = df[(lo_rank <= df['YDS_rank']) & (df['YDS_rank'] <= hi_rank)].copy()
     
-    cols = ['route_name', 'nopm_YDS', 'safety', metric]        
-    df_agg = df.groupby('sector_ID')['route_name', 'nopm_YDS', 'safety', metric].agg(lambda x: list(x))
-    df_agg.columns = cols
-    
-    df_agg['sector_ID'] = df_agg.index
-    df_agg.index = range(len(df_agg.index))
-    name_loc = df[['parent_sector', 'sector_ID', 'parent_loc']].copy()
-    name_loc = name_loc.drop_duplicates(subset=['sector_ID'])
-    df_agg = pd.merge(df_agg, name_loc, on='sector_ID')
-    
-    df_agg['num_routes'] = df_agg.apply(lambda row: len(row['route_name']), axis=1)
-    df_agg['NRGT'] = df_agg.apply(lambda row: len([r for r in row[metric] if r >= metric_threshold]), axis=1)
-    df_agg['lat'] = df_agg.apply(lambda row: row['parent_loc'][1], axis=1)
-    df_agg['lon'] = df_agg.apply(lambda row: row['parent_loc'][0], axis=1)
-    df_agg['best_route'] = df_agg.apply(lambda row: 
-      [(n, np.round(m,2), g) for n,m,g in zip(row['route_name'],row[metric],row['nopm_YDS']) 
-      if m == max(row[metric])][0], axis=1)
-    
-    sizenorm = max(df_agg['NRGT'])
-    df_agg['size'] = 0
-    sizes = np.linspace(0, sizenorm, num=6)
-    size_limits = [(sizes[i], sizes[i+1], (i+1)*7) for i in range(len(sizes)-1)]
+    df_agg = aggregate_sectors(df, metric, metric_threshold)
 
-    for ll,hl,size in size_limits:
-        df_agg.loc[(df_agg['NRGT'] > ll) & (df_agg['NRGT'] <= hl), 'size'] = size
-    df_agg.loc[df_agg['NRGT'] == 0, 'size'] = 7
+    sizenorm = max(df_agg['NRGT'])
+    df_agg['size'] = marker_sizes(df_agg['NRGT'], zero_size=7)
             
     data = go.Scattermapbox(
         lat = df_agg['lat'],
@@ -54,7 +33,8 @@ def route_quality_map_with_filters(df, fname='quality_map', metric='ARQI_median'
                       cmax=sizenorm,
                       colorscale='Inferno',
                       colorbar_title='# Routes > Threshold'),
-        customdata=np.c_[df_agg['parent_sector'], df_agg['num_routes'], df_agg['NRGT'], df_agg['best_route']],
+        customdata=np.c_[df_agg['parent_sector'], df_agg['num_routes'], df_agg['NRGT'],
+                         df_agg['best_name'], df_agg['best_metric'], df_agg['best_grade']],
         hoverlabel=dict(font_size=12,
                         font_family='Arial',
                         bgcolor='white'),
@@ -63,9 +43,9 @@ def route_quality_map_with_filters(df, fname='quality_map', metric='ARQI_median'
         'Total Routes: %{customdata[1]}<br>' +
         'Routes > Min Quality: %{customdata[2]}<br><br>' +
         '<b>Best Route</b><br>' + 
-        'Name: %{customdata[3][0]}<br>' +
-        'Grade: %{customdata[3][2]}<br>' +
-        'Rating: %{customdata[3][1]} stars' +
+        'Name: %{customdata[3]}<br>' +
+        'Grade: %{customdata[5]}<br>' +
+        'Rating: %{customdata[4]} stars' +
         '<extra></extra>'
         )
     
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+def lon_lat(df):
+
+    """
+        (n, 2) array of (lon, lat) per row, from lon/lat columns (see column_store.py) or parent_loc tuples
+    """
+
+    if 'lon' in df.columns and 'lat' in df.columns:
+        return df[['lon', 'lat']].to_numpy(dtype=float)
+
+    return np.array(df['parent_loc'].tolist(), dtype=float).reshape(-1, 2)
+
+def aggregate_sectors(df, metric, metric_threshold):
+
+    """
+        one row per sector (sorted by sector_ID) with the sector's name and location, the number of routes,
+        the number of routes with metric >= metric_threshold (NRGT) and its best route by metric,
+        computed with groupby reductions over the route rows
+    """
+
+    df = df.reset_index(drop=True)
+    sector = df['sector_ID']
+    metric_values = df[metric]
+
+    groups = metric_values.groupby(sector, sort=True)
+    num_routes = groups.size()
+    nrgt = (metric_values >= metric_threshold).groupby(sector, sort=True).sum()
+    best = metric_values.fillna(-np.inf).groupby(sector, sort=True).idxmax() # first row with the highest metric
+
+    first = df.drop_duplicates(subset=['sector_ID']).set_index('sector_ID').loc[num_routes.index]
+    loc = lon_lat(first)
+    best_rows = df.loc[best.to_numpy()]
+
+    df_agg = pd.DataFrame({'sector_ID': num_routes.index,
+                           'parent_sector': first['parent_sector'].to_numpy(),
+                           'num_routes': num_routes.to_numpy(),
+                           'NRGT': nrgt.to_numpy(),
+                           'lat': loc[:, 1],
+                           'lon': loc[:, 0],
+                           'best_name': best_rows['route_name'].to_numpy(),
+                           'best_metric': np.round(best_rows[metric].to_numpy(), 2),
+                           'best_grade': best_rows['nopm_YDS'].to_numpy()})
+
+    return df_agg
+
+def marker_sizes(nrgt, zero_size=7, step=7, n_bins=5):
+
+    """
+        marker size per sector: NRGT is binned into n_bins equal bins between 0 and its maximum,
+        bin i (upper edge inclusive) gets size (i+1)*step and sectors with NRGT == 0 get zero_size
+    """
+
+    nrgt = np.asarray(nrgt)
+    if nrgt.size == 0:
+        return np.zeros(0, dtype=int)
+
+    edges = np.linspace(0, nrgt.max(), num=n_bins + 1)
+
+    return np.where(nrgt == 0, zero_size, step * np.searchsorted(edges, nrgt, side='left'))
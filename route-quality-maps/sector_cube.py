@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from sector_aggregation import lon_lat
+
+METRICS = ['mean_rating', 'median_rating', 'RQI_mean', 'RQI_median', 'ARQI_mean', 'ARQI_median']
+
+class sector_cube(object):
+
+    """
+        per-sector aggregates precomputed for every filter the map app offers, so a query never touches the route rows
+
+        For each route type the routes are grouped into cells of (grade rank, sector, state), sorted by grade rank. Each cell
+        keeps its route count, the number of its routes at or above every threshold on the grid (0, 0.5, ..., 4 by default)
+        for every metric, and its best route per metric. A grade range is then a contiguous slice of cells, and a query is a
+        few bincounts over that slice: its cost depends on the number of (grade, sector) cells, not on the number of routes.
+        Routes without a YDS rank are left out (the app's grade filter drops them too).
+    """
+
+    def __init__(self, sectors, routes, types, states, thresholds):
+
+        self.sectors = sectors # sector_ID, parent_sector, lat, lon, one row per sector code
+        self.routes = routes # route_name, nopm_YDS and metric arrays, indexed by route position
+        self.types = types # route type -> dict of cell arrays
+        self.states = states # state -> state code
+        self.thresholds = thresholds
+
+    @classmethod
+    def build(cls, df, metrics=METRICS, route_types=('trad', 'sport'), threshold_step=0.5, max_threshold=4.0):
+
+        df = df.reset_index(drop=True)
+        sector_codes, sector_ids = pd.factorize(df['sector_ID'], sort=True)
+        state_codes, states = pd.factorize(df['state'])
+
+        first = df.drop_duplicates(subset=['sector_ID']).set_index('sector_ID').loc[sector_ids]
+        loc = lon_lat(first)
+        sectors = pd.DataFrame({'sector_ID': sector_ids, 'parent_sector': first['parent_sector'].to_numpy(),
+                                'lat': loc[:, 1], 'lon': loc[:, 0]})
+        routes = {c: df[c].to_numpy(dtype=object if c in ('route_name', 'nopm_YDS') else float)
+                  for c in ['route_name', 'nopm_YDS'] + list(metrics)}
+
+        thresholds = np.arange(0, max_threshold + threshold_step / 2, threshold_step)
+        ranked = df['YDS_rank'].notna().to_numpy()
+
+        types = {}
+        for route_type in ('all',) + tuple(route_types):
+            rows = ranked if route_type == 'all' else ranked & (df['type_string'] == route_type).to_numpy()
+            types[route_type] = cls.build_cells(df, np.flatnonzero(rows), sector_codes, state_codes, metrics, thresholds)
+
+        return cls(sectors, routes, types, {s: i for i, s in enumerate(states)}, thresholds)
+
+    @staticmethod
+    def build_cells(df, rows, sector_codes, state_codes, metrics, thresholds):
+
+        rank = df['YDS_rank'].to_numpy()[rows]
+        sector, state = sector_codes[rows], state_codes[rows]
+
+        order = np.lexsort((rows, state, sector, rank)) # by cell, then by row within a cell
+        rows, rank, sector, state = rows[order], rank[order], sector[order], state[order]
+
+        new_cell = np.ones(len(rows), dtype=bool)
+        new_cell[1:] = (rank[1:] != rank[:-1]) | (sector[1:] != sector[:-1]) | (state[1:] != state[:-1])
+        starts = np.flatnonzero(new_cell)
+        counts = np.diff(np.append(starts, len(rows)))
+
+        cells = {'rank': rank[starts], 'sector': sector[starts], 'state': state[starts], 'count': counts}
+        if not len(rows):
+            empty = np.empty(0, dtype=np.int64)
+            cells.update({m: {'nrgt': np.empty((0, len(thresholds)), dtype=np.int32), 'best': empty, 'order': empty}
+                          for m in metrics})
+            return cells
+
+        position = np.arange(len(rows))
+        for metric in metrics:
+
+            values = df[metric].to_numpy(dtype=float)[rows]
+            nrgt = np.stack([np.add.reduceat((values >= t).astype(np.int32), starts) for t in thresholds], axis=1)
+
+            filled = np.where(np.isnan(values), -np.inf, values)
+            cell_max = np.maximum.reduceat(filled, starts)
+            first_max = np.minimum.reduceat(np.where(filled == np.repeat(cell_max, counts), position, len(rows)), starts)
+
+            best = rows[first_max] # the first route with the cell's highest metric
+
+            # cells from worst to best best route (ties: later rows first), so writing them in this order leaves the best last
+            order = np.lexsort((-best, filled[first_max]))
+
+            cells[metric] = {'nrgt': nrgt, 'best': best, 'order': order}
+
+        return cells
+
+    def threshold_level(self, metric_threshold):
+
+        level = int(np.searchsorted(self.thresholds, metric_threshold))
+        if level < len(self.thresholds) and self.thresholds[level] == metric_threshold:
+            return level
+
+        return None
+
+    def answers(self, route_type, metric, metric_threshold):
+
+        """
+            whether query can answer this filter (the route type and metric are in the cube, the threshold is on its grid)
+        """
+
+        return route_type in self.types and metric in self.routes and metric not in ('route_name', 'nopm_YDS') and \
+            self.threshold_level(metric_threshold) is not None
+
+    def query(self, route_type, metric, metric_threshold, state='all', lo_rank=-np.inf, hi_rank=np.inf):
+
+        """
+            the same table as sector_aggregation.aggregate_sectors for routes of route_type (or 'all') in state (or 'all')
+            with lo_rank <= YDS_rank <= hi_rank, see answers() for the filters it covers
+        """
+
+        cells = self.types[route_type]
+        level = self.threshold_level(metric_threshold)
+
+        start, stop = np.searchsorted(cells['rank'], lo_rank, 'left'), np.searchsorted(cells['rank'], hi_rank, 'right')
+        sector = cells['sector'][start:stop]
+        count = cells['count'][start:stop]
+        nrgt = cells[metric]['nrgt'][start:stop, level]
+
+        order = cells[metric]['order']
+        order = order[(order >= start) & (order < stop)]
+
+        if state != 'all':
+            code = self.states.get(state, -1)
+            in_state = cells['state'][start:stop] == code
+            sector, count, nrgt = sector[in_state], count[in_state], nrgt[in_state]
+            order = order[cells['state'][order] == code]
+
+        n_sectors = len(self.sectors)
+        num_routes = np.bincount(sector, weights=count, minlength=n_sectors).astype(np.int64)
+        n_above = np.bincount(sector, weights=nrgt, minlength=n_sectors).astype(np.int64)
+
+        # best route per sector: order runs from worst to best cell, a stable sort by sector keeps that order within
+        # each sector, and the sector's last cell is its best
+        order = order[np.argsort(cells['sector'][order], kind='stable')]
+        sectors, last = np.unique(cells['sector'][order][::-1], return_index=True)
+        best_of_sector = np.zeros(n_sectors, dtype=np.int64)
+        best_of_sector[sectors] = cells[metric]['best'][order[::-1][last]]
+
+        present = np.flatnonzero(num_routes > 0)
+        best_rows = best_of_sector[present]
+        df_agg = self.sectors.iloc[present].reset_index(drop=True)
+        df_agg.insert(2, 'num_routes', num_routes[present])
+        df_agg.insert(3, 'NRGT', n_above[present])
+        df_agg['best_name'] = self.routes['route_name'][best_rows]
+        df_agg['best_metric'] = np.round(self.routes[metric][best_rows], 2)
+        df_agg['best_grade'] = self.routes['nopm_YDS'][best_rows]
+
+        return df_agg